@@ -49,9 +49,10 @@ from airflow.exceptions import AirflowException
 from airflow.executors import DEFAULT_EXECUTOR
 from airflow.models import (DagModel, DagBag, TaskInstance,
                             DagPickle, DagRun, Variable, DagStat,
-                            Pool, Connection)
+                            Pool, Connection, ConfigVersion)
 from airflow.ti_deps.dep_context import (DepContext, SCHEDULER_DEPS)
 from airflow.utils import db as db_utils
+from airflow.utils.dag_cache import DagPickleCache
 from airflow.utils import logging as logging_utils
 from airflow.utils.state import State
 from airflow.www.app import cached_app
@@ -116,11 +117,24 @@ def process_subdir(subdir):
 
 
 def get_dag(args):
-    dagbag = DagBag(process_subdir(args.subdir))
+    subdir = process_subdir(args.subdir)
+    dag_cache = None
+    if conf.getboolean('core', 'dag_pickle_cache') and os.path.isfile(subdir):
+        dag_cache = DagPickleCache(conf.get('core', 'dag_pickle_cache_dir'),
+                                   DAGS_FOLDER,
+                                   conf.getint('core', 'dag_pickle_cache_size'))
+        dags = dag_cache.get(subdir)
+        if dags and args.dag_id in dags:
+            return dags[args.dag_id]
+        fingerprint = dag_cache.get_fingerprint(subdir)
+
+    dagbag = DagBag(subdir)
     if args.dag_id not in dagbag.dags:
         raise AirflowException(
             'dag_id could not be found: {}. Either the dag did not exist or it failed to '
             'parse.'.format(args.dag_id))
+    if dag_cache and not dagbag.import_errors:
+        dag_cache.put(subdir, fingerprint, dagbag.dags)
     return dagbag.dags[args.dag_id]
 
 
@@ -224,6 +238,7 @@ def variables(args):
     if args.delete:
         session = settings.Session()
         session.query(Variable).filter_by(key=args.delete).delete()
+        ConfigVersion.bump(session=session)
         session.commit()
         session.close()
     if args.set:
@@ -758,7 +773,8 @@ def scheduler(args):
         subdir=process_subdir(args.subdir),
         run_duration=args.run_duration,
         num_runs=args.num_runs,
-        do_pickle=args.do_pickle)
+        do_pickle=args.do_pickle,
+        profile=args.profile)
 
     if args.daemon:
         pid, stdout, stderr, log_file = setup_locations("scheduler", args.pid, args.stdout, args.stderr, args.log_file)
@@ -956,6 +972,7 @@ def connections(args):
         else:
             deleted_conn_id = to_delete.conn_id
             session.delete(to_delete)
+            ConfigVersion.bump(session=session)
             session.commit()
             msg = '\n\tSuccessfully deleted `conn_id`={conn_id}\n'
             msg = msg.format(conn_id=deleted_conn_id)
@@ -983,6 +1000,7 @@ def connections(args):
                 .query(Connection)
                 .filter(Connection.conn_id == new_conn.conn_id).first()):
             session.add(new_conn)
+            ConfigVersion.bump(session=session)
             session.commit()
             msg = '\n\tSuccessfully added `conn_id`={conn_id} : {uri}\n'
             msg = msg.format(conn_id=new_conn.conn_id, uri=args.conn_uri)
@@ -1307,6 +1325,14 @@ class CLIFactory(object):
             ("-n", "--num_runs"),
             default=None, type=int,
             help="Set the number of runs to execute before exiting"),
+        'profile': Arg(
+            ("--profile",),
+            default=False,
+            help=(
+                "Profile the scheduling loop with cProfile and write pstats "
+                "snapshots to the [scheduler] profile_dump_dir every "
+                "profile_dump_interval seconds"),
+            action="store_true"),
         # worker
         'do_pickle': Arg(
             ("-p", "--do_pickle"),
@@ -1479,8 +1505,8 @@ class CLIFactory(object):
             'func': scheduler,
             'help': "Start a scheduler instance",
             'args': ('dag_id_opt', 'subdir', 'run_duration', 'num_runs',
-                     'do_pickle', 'pid', 'daemon', 'stdout', 'stderr',
-                     'log_file'),
+                     'do_pickle', 'profile', 'pid', 'daemon', 'stdout',
+                     'stderr', 'log_file'),
         }, {
             'func': worker,
             'help': "Start a Celery worker node",
@@ -98,6 +98,12 @@ airflow_home = {AIRFLOW_HOME}
 # This path must be absolute
 dags_folder = {AIRFLOW_HOME}/dags
 
+# Whether to watch the DAG folder with inotify (requires pyinotify) to find
+# the new and changed files, instead of checking every directory and file of
+# the folder each time it's listed. inotify doesn't see the changes made on
+# other hosts, so leave this off for network file systems.
+dag_folder_use_inotify = False
+
 # The folder where airflow should store its log files
 # This path must be absolute
 base_log_folder = {AIRFLOW_HOME}/logs
@@ -131,11 +137,76 @@ sql_alchemy_pool_size = 5
 # not apply to sqlite.
 sql_alchemy_pool_recycle = 3600
 
+# Whether to count the queries and the time spent in the database by the
+# scheduler phases, the webserver views and the task runs, report them to
+# statsd, and log the slow queries along with where they're made from
+sql_instrumentation = False
+
+# The number of seconds above which a query is logged as slow when
+# sql_instrumentation is on
+sql_slow_query_threshold = 1
+
 # The amount of parallelism as a setting to the executor. This defines
 # the max number of task instances that should run simultaneously
 # on this airflow installation
 parallelism = 32
 
+# Whether `airflow run` keeps the DAGs it parsed from a DAG file pickled in
+# dag_pickle_cache_dir, for the next runs on the same machine to use until
+# the file, or a module it imports from the DAG folder, changes. The DAGs of
+# at most dag_pickle_cache_size files are kept, the least recently used are
+# removed first. The entries are only loaded when they are owned by the user
+# running the tasks, and not writable by others.
+dag_pickle_cache = False
+dag_pickle_cache_dir = {AIRFLOW_HOME}/dag_cache
+dag_pickle_cache_size = 100
+
+# Whether `airflow run --local` runs the task in a fork of itself, which
+# already has airflow and the DAG loaded, instead of in a new
+# `airflow run --raw` process
+local_task_job_fork = False
+
+# How long each process caches the Variables and the Connections it read from
+# the database, in seconds. 0 disables the cache. With
+# lookup_cache_version_check, the caches are also dropped when the Variables
+# or Connections are changed through Variable.set, the UI or the CLI, which
+# is checked at most every lookup_cache_version_check_interval seconds.
+lookup_cache_ttl = 0
+lookup_cache_version_check = False
+lookup_cache_version_check_interval = 5
+
+# Whether the scheduler writes the structure of the DAGs it parses to the
+# database, and the webserver shows the DAGs from there instead of parsing the
+# DAG folder in each of its workers
+store_serialized_dags = False
+
+# The values of the XComs whose pickle is larger than xcom_storage_threshold
+# bytes are written under this location, and the xcom table only keeps a
+# reference to them. It can be a folder (file:///...), an S3 (s3://...) or a
+# GCS (gs://...) URL, read with the xcom_storage_conn_id connection. Leave
+# empty to keep all the values in the database. The values are deleted from
+# the storage with their XComs, except when the xcom table is changed by other
+# means (e.g. SQL, resetdb) or after xcom_storage is emptied.
+xcom_storage =
+xcom_storage_conn_id =
+xcom_storage_threshold = 65536
+
+# Whether the LocalExecutor workers run each task in a fork of themselves,
+# which keeps airflow and the DAGs they parsed loaded, instead of starting an
+# `airflow run` process that imports airflow and parses the DAG file again.
+# The raw task then also runs in a fork, as with local_task_job_fork. The
+# parsed DAGs are kept until their file changes or for up to
+# local_executor_dag_cache_ttl seconds.
+local_executor_fork_tasks = False
+local_executor_dag_cache_ttl = 300
+
+# The LocalExecutor starts with this many workers, and starts more, up to
+# parallelism, when tasks are waiting. The workers above this number exit
+# after being idle for local_executor_worker_idle_timeout seconds. Leave empty
+# to always keep parallelism workers.
+local_executor_min_workers =
+local_executor_worker_idle_timeout = 300
+
 # The number of task instances allowed to run concurrently by the scheduler
 dag_concurrency = 16
 
@@ -266,6 +337,16 @@ demo_mode = False
 # manually. Otherwise the manual refresh button will not be displayed.
 graph_refresh_rate = 0
 
+# Rate at which to automatically refresh the task states in the tree view in
+# milliseconds, fetching only the task instances that changed. If not set or
+# set to 0, the tree will require refreshing manually.
+tree_refresh_rate = 0
+
+# How long (in secs) each webserver process reuses the counts of DAG runs and
+# task instances of the home page. The counts of the task instances are kept
+# up to date in the task_stats table by the scheduler. Set to 0 to disable.
+dashboard_stats_ttl = 10
+
 # The amount of time (in secs) webserver will wait for initial handshake
 # while fetching logs from other worker machine
 log_fetch_timeout_sec = 5
@@ -377,6 +458,27 @@ statsd_prefix = airflow
 # use more threads than the amount of cpu cores available.
 max_threads = 2
 
+# Process the DAG files in a pool of max_threads long-lived worker processes
+# that import airflow and the operators once, rather than in a new process
+# for every file.
+dag_file_processor_pool = False
+
+# Number of DAG files a worker of the pool processes before it is replaced
+# by a fresh one, to contain leaks from user code. 0 never replaces workers.
+dag_file_processor_max_tasks_per_worker = 100
+
+# When processing a DAG file that didn't change since it was last parsed in
+# the same process, reuse the DAGs found then instead of executing the file
+# again, for up to this many seconds. Only effective with
+# dag_file_processor_pool, as otherwise each file is parsed in a new process.
+# 0 parses the files every time.
+dag_file_parse_cache_ttl = 0
+
+# Where and how often (in seconds) `airflow scheduler --profile` writes the
+# cProfile snapshots of the scheduling loop
+profile_dump_dir = /tmp/airflow/scheduler/profiles
+profile_dump_interval = 300
+
 authenticate = False
 
 
@@ -470,6 +572,7 @@ web_server_port = 8080
 dag_orientation = LR
 log_fetch_timeout_sec = 5
 hide_paused_dags_by_default = False
+dashboard_stats_ttl = 0
 
 [email]
 email_backend = airflow.utils.email.send_email_smtp
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Writes the structure of the DAGs and the attributes of their tasks to the
+serialized_dag table as JSON, and reads them back as DAGs whose tasks are
+SerializedBaseOperators, so that the webserver can show the DAGs without
+importing the DAG files.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import inspect
+import json
+import logging
+from datetime import datetime, timedelta
+
+import dateutil.parser
+import six
+from dateutil.relativedelta import relativedelta
+
+from airflow.dag.base_dag import BaseDagBag
+from airflow.exceptions import AirflowException
+from airflow.models import BaseOperator, DAG, DagModel, SerializedDag
+from airflow.utils.db import provide_session
+
+_log = logging.getLogger(__name__)
+
+# The arguments of DAG() that are serialized
+DAG_FIELDS = (
+    'description',
+    'schedule_interval',
+    'start_date',
+    'end_date',
+    'template_searchpath',
+    'concurrency',
+    'max_active_runs',
+    'dagrun_timeout',
+    'orientation',
+    'params',
+)
+
+# The attributes of BaseOperator that are serialized
+OPERATOR_FIELDS = (
+    'owner',
+    'email',
+    'email_on_retry',
+    'email_on_failure',
+    'retries',
+    'retry_delay',
+    'retry_exponential_backoff',
+    'max_retry_delay',
+    'start_date',
+    'end_date',
+    'depends_on_past',
+    'wait_for_downstream',
+    'adhoc',
+    'priority_weight',
+    'queue',
+    'pool',
+    'sla',
+    'execution_timeout',
+    'trigger_rule',
+    'params',
+)
+
+# The attributes shown as code by the webserver, serialized along with the
+# template fields of each operator when it has them
+CODE_FIELDS = (
+    'bash_command',
+    'hql',
+    'sql',
+    'doc',
+    'doc_json',
+    'doc_rst',
+    'doc_yaml',
+    'doc_md',
+    'python_callable',
+)
+
+
+def _serialize(value):
+    """
+    :return: the value as something json.dumps() supports. The values that
+    can't be read back are turned into strings, to be displayed.
+    """
+    if value is None or isinstance(
+            value, (bool, float) + six.integer_types + six.string_types):
+        return value
+    elif isinstance(value, datetime):
+        return {'__type': 'datetime', '__value': value.isoformat()}
+    elif isinstance(value, timedelta):
+        return {'__type': 'timedelta', '__value': value.total_seconds()}
+    elif isinstance(value, relativedelta):
+        return {'__type': 'relativedelta', '__value': dict(
+            (k, getattr(value, k)) for k in
+            ('years', 'months', 'days', 'hours', 'minutes', 'seconds',
+             'microseconds'))}
+    elif isinstance(value, (list, tuple, set)):
+        return [_serialize(v) for v in value]
+    elif isinstance(value, dict):
+        return {'__type': 'dict', '__value': dict(
+            (str(k), _serialize(v)) for k, v in value.items())}
+    elif inspect.isfunction(value) or inspect.ismethod(value):
+        try:
+            return inspect.getsource(value)
+        except (IOError, TypeError):
+            return repr(value)
+    return str(value)
+
+
+def _deserialize(value):
+    if isinstance(value, list):
+        return [_deserialize(v) for v in value]
+    elif not isinstance(value, dict):
+        return value
+    value_type, value = value['__type'], value['__value']
+    if value_type == 'datetime':
+        return dateutil.parser.parse(value)
+    elif value_type == 'timedelta':
+        return timedelta(seconds=value)
+    elif value_type == 'relativedelta':
+        return relativedelta(**value)
+    elif value_type == 'dict':
+        return dict((k, _deserialize(v)) for k, v in value.items())
+    raise AirflowException("Unknown serialized type {}".format(value_type))
+
+
+class SerializedBaseOperator(BaseOperator):
+    """
+    Stands in for an operator of a serialized DAG. It has the attributes of
+    the operator that the webserver shows, and a class with the name, colors
+    and template fields of the operator's class, but it can't be executed.
+    """
+    _classes = {}
+
+    @classmethod
+    def get_class(cls, task_type, ui_color, ui_fgcolor, template_fields):
+        """
+        :return: the subclass standing in for an operator class
+        """
+        key = (task_type, ui_color, ui_fgcolor, tuple(template_fields))
+        if key not in cls._classes:
+            cls._classes[key] = type(str(task_type), (cls,), {
+                'ui_color': ui_color,
+                'ui_fgcolor': ui_fgcolor,
+                'template_fields': tuple(template_fields),
+            })
+        return cls._classes[key]
+
+    def execute(self, context):
+        raise AirflowException(
+            "The task {} was read from the serialized DAG {}, it can't be "
+            "executed".format(self.task_id, self.dag_id))
+
+
+def serialize_dag(dag):
+    """
+    :param dag: the DAG, with its SubDAGs
+    :type dag: airflow.models.DAG
+    :rtype: dict
+    """
+    data = dict((field, _serialize(getattr(dag, field, None)))
+                for field in DAG_FIELDS)
+    data.update({
+        'dag_id': dag.dag_id,
+        'full_filepath': dag.full_filepath,
+        'fileloc': getattr(dag, 'fileloc', dag.full_filepath),
+        'is_subdag': getattr(dag, 'is_subdag', False),
+        'doc_md': getattr(dag, 'doc_md', None),
+        'tasks': [],
+    })
+    for task in sorted(dag.tasks, key=lambda t: t.task_id):
+        fields = dict((field, _serialize(getattr(task, field, None)))
+                      for field in OPERATOR_FIELDS)
+        for field in set(task.template_fields) | set(CODE_FIELDS):
+            if getattr(task, field, None) is not None:
+                fields[field] = _serialize(getattr(task, field))
+        task_data = {
+            'task_id': task.task_id,
+            'task_type': task.task_type,
+            'ui_color': task.ui_color,
+            'ui_fgcolor': task.ui_fgcolor,
+            'template_fields': list(task.template_fields),
+            'upstream_task_ids': sorted(task.upstream_task_ids),
+            'fields': fields,
+        }
+        if task.task_type == 'SubDagOperator' and hasattr(task, 'subdag'):
+            task_data['subdag'] = serialize_dag(task.subdag)
+        data['tasks'].append(task_data)
+    return data
+
+
+def deserialize_dag(data, parent_dag=None):
+    """
+    :param data: from serialize_dag()
+    :type data: dict
+    :param parent_dag: the DAG of the SubDagOperator, for SubDAGs
+    :type parent_dag: airflow.models.DAG
+    :return: the DAG, whose tasks are SerializedBaseOperators
+    :rtype: airflow.models.DAG
+    """
+    # A schedule_interval of None is kept, as it isn't the default
+    kwargs = dict((field, _deserialize(data[field]))
+                  for field in DAG_FIELDS
+                  if data[field] is not None or field == 'schedule_interval')
+    dag = DAG(data['dag_id'], full_filepath=data['full_filepath'], **kwargs)
+    dag.fileloc = data['fileloc']
+    dag.is_subdag = data['is_subdag']
+    dag.parent_dag = parent_dag
+    if data['doc_md'] is not None:
+        dag.doc_md = data['doc_md']
+
+    for task_data in data['tasks']:
+        task_class = SerializedBaseOperator.get_class(
+            task_data['task_type'],
+            task_data['ui_color'],
+            task_data['ui_fgcolor'],
+            task_data['template_fields'])
+        task = task_class(task_id=task_data['task_id'])
+        for field, value in task_data['fields'].items():
+            setattr(task, field, _deserialize(value))
+        if 'subdag' in task_data:
+            task.subdag = deserialize_dag(task_data['subdag'], parent_dag=dag)
+        task.dag = dag
+
+    # Set the edges directly rather than one at a time with set_upstream()
+    for task_data in data['tasks']:
+        task = dag.task_dict[task_data['task_id']]
+        for upstream_task_id in task_data['upstream_task_ids']:
+            task._upstream_task_ids.append(upstream_task_id)
+            dag.task_dict[upstream_task_id]._downstream_task_ids.append(
+                task.task_id)
+    dag.clear_topology()
+    return dag
+
+
+@provide_session
+def write_dag(dag, session=None):
+    """
+    Writes a DAG to the serialized_dag table, unless it didn't change since
+    it was last written, so that the webservers keep the one they loaded.
+
+    :return: whether the DAG was written
+    :rtype: bool
+    """
+    data = json.dumps(serialize_dag(dag), sort_keys=True)
+    data_hash = hashlib.sha1(data.encode('utf-8')).hexdigest()
+    row = (
+        session.query(SerializedDag.data_hash)
+        .filter(SerializedDag.dag_id == dag.dag_id)
+        .first())
+    if row and row.data_hash == data_hash:
+        return False
+
+    session.merge(SerializedDag(
+        dag_id=dag.dag_id,
+        fileloc=getattr(dag, 'fileloc', dag.full_filepath),
+        data=data,
+        data_hash=data_hash,
+        last_updated=datetime.now()))
+    session.commit()
+    return True
+
+
+class SerializedDagBag(BaseDagBag):
+    """
+    A DagBag of the DAGs in the serialized_dag table, for the webserver.
+    The DAGs are deserialized when first needed, and again when the scheduler
+    writes a new version of them.
+    """
+    def __init__(self):
+        # (data_hash, DAG) by DAG ID
+        self._dags = {}
+
+    def _load(self, row):
+        dag = deserialize_dag(json.loads(row.data))
+        dag.last_loaded = row.last_updated
+        self._dags[row.dag_id] = (row.data_hash, dag)
+        return dag
+
+    @property
+    def dag_ids(self):
+        return list(self.dags.keys())
+
+    @property
+    @provide_session
+    def dags(self, session=None):
+        """
+        Queries the versions of the DAGs on each access, to load the DAGs that
+        were written again, so read it once per request.
+
+        :return: the DAGs of the active DagModels by DAG ID
+        :rtype: dict[unicode, airflow.models.DAG]
+        """
+        versions = dict(
+            session.query(SerializedDag.dag_id, SerializedDag.data_hash)
+            .join(DagModel, DagModel.dag_id == SerializedDag.dag_id)
+            .filter(DagModel.is_active)
+            .all())
+        for dag_id in list(self._dags):
+            if dag_id not in versions:
+                del self._dags[dag_id]
+        stale_dag_ids = [
+            dag_id for dag_id, data_hash in versions.items()
+            if dag_id not in self._dags or
+            self._dags[dag_id][0] != data_hash]
+        if stale_dag_ids:
+            rows = (
+                session.query(SerializedDag)
+                .filter(SerializedDag.dag_id.in_(stale_dag_ids))
+                .all())
+            for row in rows:
+                self._load(row)
+
+        dags = dict((dag_id, dag) for dag_id, (_, dag) in self._dags.items())
+        for dag in dags.values():
+            if dag.is_subdag and dag.parent_dag is None:
+                dag.parent_dag = dags.get(self._get_parent_dag_id(dag))
+        return dags
+
+    @staticmethod
+    def _get_parent_dag_id(dag):
+        return dag.dag_id.rsplit('.', 1)[0]
+
+    @provide_session
+    def get_dag(self, dag_id, session=None):
+        """
+        :return: the DAG, or None if it wasn't serialized
+        :rtype: airflow.models.DAG
+        """
+        row = (
+            session.query(SerializedDag.data_hash)
+            .filter(SerializedDag.dag_id == dag_id)
+            .first())
+        if row is None:
+            self._dags.pop(dag_id, None)
+            return None
+        if dag_id in self._dags and self._dags[dag_id][0] == row.data_hash:
+            return self._dags[dag_id][1]
+
+        dag = self._load(
+            session.query(SerializedDag)
+            .filter(SerializedDag.dag_id == dag_id)
+            .one())
+        if dag.is_subdag:
+            dag.parent_dag = self.get_dag(
+                self._get_parent_dag_id(dag), session=session)
+        return dag
+
+    def collect_dags(self, only_if_updated=True):
+        """
+        Drops the loaded DAGs, to read them again when they are needed.
+        """
+        self._dags.clear()
+
+    def size(self):
+        return len(self.dags)
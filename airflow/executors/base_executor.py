@@ -13,8 +13,12 @@
 # limitations under the License.
 
 from builtins import range
+import heapq
+import itertools
 
 from airflow import configuration
+from airflow.settings import Stats
+from airflow.utils.db import provide_session
 from airflow.utils.state import State
 from airflow.utils.logging import LoggingMixin
 
@@ -34,6 +38,11 @@ class BaseExecutor(LoggingMixin):
         """
         self.parallelism = parallelism
         self.queued_tasks = {}
+        # Heap of (-priority, sequence number, key, queued task) to launch the
+        # queued tasks by priority, then in the order they were queued.
+        # Entries whose queued task is no longer in queued_tasks are skipped.
+        self._queue_heap = []
+        self._queue_counter = itertools.count()
         self.running = {}
         self.event_buffer = {}
 
@@ -48,7 +57,10 @@ class BaseExecutor(LoggingMixin):
         key = task_instance.key
         if key not in self.queued_tasks and key not in self.running:
             self.logger.info("Adding to queue: {}".format(command))
-            self.queued_tasks[key] = (command, priority, queue, task_instance)
+            queued_task = (command, priority, queue, task_instance)
+            self.queued_tasks[key] = queued_task
+            heapq.heappush(self._queue_heap, (
+                -priority, next(self._queue_counter), key, queued_task))
 
     def queue_task_instance(
             self,
@@ -95,33 +107,79 @@ class BaseExecutor(LoggingMixin):
         self.logger.debug("{} in queue".format(len(self.queued_tasks)))
         self.logger.debug("{} open slots".format(open_slots))
 
-        sorted_queue = sorted(
-            [(k, v) for k, v in self.queued_tasks.items()],
-            key=lambda x: x[1][1],
-            reverse=True)
-        for i in range(min((open_slots, len(self.queued_tasks)))):
-            key, (command, _, queue, ti) = sorted_queue.pop(0)
-            # TODO(jlowin) without a way to know what Job ran which tasks,
-            # there is a danger that another Job started running a task
-            # that was also queued to this executor. This is the last chance
-            # to check if that happened. The most probable way is that a
-            # Scheduler tried to run a task that was originally queued by a
-            # Backfill. This fix reduces the probability of a collision but
-            # does NOT eliminate it.
+        # Drop the entries of the tasks removed from queued_tasks by others
+        # when they start to outnumber the queued tasks
+        if len(self._queue_heap) > 2 * len(self.queued_tasks):
+            self._queue_heap = [
+                entry for entry in self._queue_heap
+                if self.queued_tasks.get(entry[2]) is entry[3]]
+            heapq.heapify(self._queue_heap)
+
+        to_launch = []
+        while self._queue_heap and len(to_launch) < open_slots:
+            _, _, key, queued_task = heapq.heappop(self._queue_heap)
+            if self.queued_tasks.get(key) is not queued_task:
+                continue
             self.queued_tasks.pop(key)
-            ti.refresh_from_db()
-            if ti.state != State.RUNNING:
+            to_launch.append((key, queued_task))
+
+        # TODO(jlowin) without a way to know what Job ran which tasks,
+        # there is a danger that another Job started running a task
+        # that was also queued to this executor. This is the last chance
+        # to check if that happened. The most probable way is that a
+        # Scheduler tried to run a task that was originally queued by a
+        # Backfill. This fix reduces the probability of a collision but
+        # does NOT eliminate it.
+        running_keys = self._get_running_keys([key for key, _ in to_launch])
+        launched = 0
+        for key, (command, _, queue, ti) in to_launch:
+            if key not in running_keys:
                 self.running[key] = command
                 self.execute_async(key, command=command, queue=queue)
+                launched += 1
             else:
                 self.logger.debug(
                     'Task is already running, not sending to '
                     'executor: {}'.format(key))
 
+        skipped = len(to_launch) - launched
+        self.logger.debug("Launched {} task instances, skipped {} already "
+                          "running".format(launched, skipped))
+        Stats.gauge('executor.open_slots', open_slots)
+        Stats.gauge('executor.queued_tasks', len(self.queued_tasks))
+        Stats.gauge('executor.running_tasks', len(self.running))
+        Stats.incr('executor.launched_tasks', launched)
+        Stats.incr('executor.skipped_tasks', skipped)
+
         # Calling child class sync method
         self.logger.debug("Calling the {} sync method".format(self.__class__))
         self.sync()
 
+    @staticmethod
+    @provide_session
+    def _get_running_keys(keys, session=None):
+        """
+        Returns which of the given task instance keys are in the running state
+        in the database, with one query.
+
+        :param keys: (dag_id, task_id, execution_date) of task instances
+        :type keys: list[tuple]
+        :rtype: set[tuple]
+        """
+        if not keys:
+            return set()
+        from airflow.models import TaskInstance as TI
+        dag_ids, task_ids, execution_dates = (set(l) for l in zip(*keys))
+        # The query can match task instances outside of keys, they're
+        # filtered out afterwards
+        rows = session.query(
+            TI.dag_id, TI.task_id, TI.execution_date).filter(
+            TI.dag_id.in_(dag_ids),
+            TI.task_id.in_(task_ids),
+            TI.execution_date.in_(execution_dates),
+            TI.state == State.RUNNING).all()
+        return set(keys) & set(tuple(row) for row in rows)
+
     def change_state(self, key, state):
         self.running.pop(key)
         self.event_buffer[key] = state
@@ -12,13 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from builtins import object
+from builtins import object, range
 import logging
 import subprocess
 import time
 
 from celery import Celery
 from celery import states as celery_states
+from celery.backends.base import KeyValueStoreBackend
+from celery.backends.database import DatabaseBackend
+from celery.backends.database.models import Task as CeleryTask
 
 from airflow.exceptions import AirflowException
 from airflow.executors.base_executor import BaseExecutor
@@ -66,6 +69,78 @@ def execute_command(command):
         raise AirflowException('Celery command failed')
 
 
+# How many task states are fetched from the result backend with one query
+STATE_FETCH_BATCH_SIZE = 1000
+
+
+def fetch_celery_task_states(async_results):
+    """
+    Returns the states of Celery tasks, fetched in batches with one query
+    (database backends) or one mget (key-value backends like Redis or
+    memcached) per STATE_FETCH_BATCH_SIZE tasks. Other backends are asked
+    about each task separately.
+
+    :param async_results: the AsyncResults of the tasks
+    :type async_results: list[celery.result.AsyncResult]
+    :return: the state of each task by task_id
+    :rtype: dict[unicode, unicode]
+    """
+    states = {}
+    by_backend = {}
+    for result in async_results:
+        by_backend.setdefault(id(result.backend),
+                              (result.backend, []))[1].append(result)
+
+    for backend, results in by_backend.values():
+        for i in range(0, len(results), STATE_FETCH_BATCH_SIZE):
+            batch = results[i:i + STATE_FETCH_BATCH_SIZE]
+            task_ids = [result.task_id for result in batch]
+            try:
+                if isinstance(backend, DatabaseBackend):
+                    batch_states = _fetch_states_from_database(backend,
+                                                               task_ids)
+                elif isinstance(backend, KeyValueStoreBackend):
+                    batch_states = _fetch_states_from_key_value_store(
+                        backend, task_ids)
+                else:
+                    batch_states = {result.task_id: result.state
+                                    for result in batch}
+            except Exception:
+                _log.exception("Error fetching the states of {} celery "
+                               "task(s) at once, fetching them one by one"
+                               .format(len(batch)))
+                batch_states = {result.task_id: result.state
+                                for result in batch}
+            states.update(batch_states)
+    return states
+
+
+def _fetch_states_from_database(backend, task_ids):
+    task_cls = getattr(backend, 'task_cls', CeleryTask)
+    session = backend.ResultSession()
+    try:
+        rows = session.query(task_cls.task_id, task_cls.status).filter(
+            task_cls.task_id.in_(task_ids)).all()
+    finally:
+        session.close()
+    # Tasks without a row yet haven't run
+    states = {task_id: celery_states.PENDING for task_id in task_ids}
+    states.update(rows)
+    return states
+
+
+def _fetch_states_from_key_value_store(backend, task_ids):
+    values = backend.mget(
+        [backend.get_key_for_task(task_id) for task_id in task_ids])
+    states = {}
+    for task_id, value in zip(task_ids, values):
+        if value is None:
+            states[task_id] = celery_states.PENDING
+        else:
+            states[task_id] = backend.decode(value)['status']
+    return states
+
+
 class CeleryExecutor(BaseExecutor):
     """
     CeleryExecutor is recommended for production use of Airflow. It allows
@@ -91,8 +166,9 @@ class CeleryExecutor(BaseExecutor):
 
         self.logger.debug(
             "Inquiring about {} celery task(s)".format(len(self.tasks)))
-        for key, async in list(self.tasks.items()):
-            state = async.state
+        states = fetch_celery_task_states(list(self.tasks.values()))
+        for key, result in list(self.tasks.items()):
+            state = states[result.task_id]
             if self.last_state[key] != state:
                 if state == celery_states.SUCCESS:
                     self.success(key)
@@ -107,13 +183,14 @@ class CeleryExecutor(BaseExecutor):
                     del self.tasks[key]
                     del self.last_state[key]
                 else:
-                    self.logger.info("Unexpected state: " + async.state)
-                self.last_state[key] = async.state
+                    self.logger.info("Unexpected state: " + state)
+                    self.last_state[key] = state
 
     def end(self, synchronous=False):
         if synchronous:
             while any([
-                    async.state not in celery_states.READY_STATES
-                    for async in self.tasks.values()]):
+                    state not in celery_states.READY_STATES
+                    for state in fetch_celery_task_states(
+                        list(self.tasks.values())).values()]):
                 time.sleep(5)
         self.sync()
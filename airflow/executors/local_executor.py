@@ -13,47 +13,245 @@
 # limitations under the License.
 
 import multiprocessing
+import os
+import shlex
 import subprocess
 import time
 
-from builtins import range
+from builtins import object, range
+from six.moves.queue import Empty
 
 from airflow import configuration
 from airflow.executors.base_executor import BaseExecutor
+from airflow.settings import Stats
 from airflow.utils.state import State
 from airflow.utils.logging import LoggingMixin
 
 PARALLELISM = configuration.get('core', 'PARALLELISM')
 
+FORK_TASKS = configuration.getboolean('core', 'local_executor_fork_tasks')
+DAG_CACHE_TTL = configuration.getint('core', 'local_executor_dag_cache_ttl')
+# Empty to always keep parallelism workers
+MIN_WORKERS = configuration.get('core', 'local_executor_min_workers')
+WORKER_IDLE_TIMEOUT = configuration.getint(
+    'core', 'local_executor_worker_idle_timeout')
+
+
+class LocalWorkerPoolState(object):
+    """
+    The counters shared by the LocalExecutor and its workers, used to scale
+    the number of workers between min_workers and the parallelism: the
+    executor starts workers when tasks are waiting and workers that have been
+    idle for idle_timeout seconds exit while there are more than min_workers.
+    """
+
+    def __init__(self, min_workers, idle_timeout):
+        self.min_workers = min_workers
+        self.idle_timeout = idle_timeout
+        self._lock = multiprocessing.Lock()
+        self._live_workers = multiprocessing.Value('i', 0, lock=False)
+        self._busy_workers = multiprocessing.Value('i', 0, lock=False)
+        self._queued_tasks = multiprocessing.Value('i', 0, lock=False)
+        self._stopping = multiprocessing.Value('b', False, lock=False)
+
+    @property
+    def live_workers(self):
+        return self._live_workers.value
+
+    @property
+    def busy_workers(self):
+        return self._busy_workers.value
+
+    @property
+    def queued_tasks(self):
+        """
+        The number of tasks put in the task queue that no worker took yet.
+        """
+        return self._queued_tasks.value
+
+    def worker_started(self):
+        with self._lock:
+            self._live_workers.value += 1
+
+    def worker_died(self):
+        """
+        Called by the executor for the workers that exited without releasing
+        themselves, e.g. when they were killed.
+        """
+        with self._lock:
+            self._live_workers.value -= 1
+
+    def release_idle_worker(self):
+        """
+        :return: whether an idle worker may exit
+        :rtype: bool
+        """
+        with self._lock:
+            if (not self._stopping.value and
+                    self._live_workers.value > self.min_workers):
+                self._live_workers.value -= 1
+                return True
+            return False
+
+    def task_queued(self):
+        with self._lock:
+            self._queued_tasks.value += 1
+
+    def task_started(self):
+        with self._lock:
+            self._queued_tasks.value -= 1
+            self._busy_workers.value += 1
+
+    def task_finished(self):
+        with self._lock:
+            self._busy_workers.value -= 1
+
+    def stop(self):
+        """
+        Keeps the workers from exiting when idle.
+
+        :return: the number of workers left
+        :rtype: int
+        """
+        with self._lock:
+            self._stopping.value = True
+            return self._live_workers.value
+
 
 class LocalWorker(multiprocessing.Process, LoggingMixin):
 
-    def __init__(self, task_queue, result_queue):
+    def __init__(self, task_queue, result_queue, fork_tasks=False,
+                 pool_state=None):
+        """
+        :param fork_tasks: whether to run the `airflow run` commands in a fork
+        of the worker, which keeps airflow and the DAGs it parsed loaded,
+        instead of in a new `bash -c` process
+        :type fork_tasks: bool
+        :param pool_state: the state of the pool of workers, to exit when idle
+        and count the busy workers. The worker runs until it receives a
+        poison pill when None.
+        :type pool_state: LocalWorkerPoolState
+        """
         multiprocessing.Process.__init__(self)
         self.task_queue = task_queue
         self.result_queue = result_queue
+        self.fork_tasks = fork_tasks
+        self.pool_state = pool_state
         self.daemon = True
+        # DagFileParseCache of the DAG files parsed by a worker forking tasks
+        self._dag_cache = None
 
     def run(self):
+        idle_timeout = None
+        if self.pool_state and self.pool_state.idle_timeout > 0:
+            idle_timeout = self.pool_state.idle_timeout
         while True:
-            key, command = self.task_queue.get()
+            try:
+                key, command, queued_time = self.task_queue.get(
+                    timeout=idle_timeout)
+            except Empty:
+                if self.pool_state.release_idle_worker():
+                    self.logger.info("{} exiting after being idle for {}s"
+                                     .format(self.__class__.__name__,
+                                             idle_timeout))
+                    break
+                continue
             if key is None:
                 # Received poison pill, no more tasks to run
                 self.task_queue.task_done()
                 break
+            Stats.timing('local_executor.task_wait_time',
+                         (time.time() - queued_time) * 1000)
             self.logger.info("{} running {}".format(
                 self.__class__.__name__, command))
-            command = "exec bash -c '{0}'".format(command)
+            if self.pool_state:
+                self.pool_state.task_started()
             try:
-                subprocess.check_call(command, shell=True)
-                state = State.SUCCESS
-            except subprocess.CalledProcessError as e:
-                state = State.FAILED
-                self.logger.error("failed to execute task {}:".format(str(e)))
-                # raise e
+                if self.fork_tasks:
+                    state = self._run_forked(command)
+                else:
+                    state = self._run_subprocess(command)
+            finally:
+                if self.pool_state:
+                    self.pool_state.task_finished()
             self.result_queue.put((key, state))
             self.task_queue.task_done()
-            time.sleep(1)
+            if not self.fork_tasks:
+                time.sleep(1)
+
+    def _run_subprocess(self, command):
+        """
+        Runs an `airflow run` command in a new `bash -c` process.
+
+        :return: the state of the command, SUCCESS or FAILED
+        """
+        command = "exec bash -c '{0}'".format(command)
+        try:
+            subprocess.check_call(command, shell=True)
+            return State.SUCCESS
+        except subprocess.CalledProcessError as e:
+            self.logger.error("failed to execute task {}:".format(str(e)))
+            return State.FAILED
+
+    def _get_dag(self, args):
+        """
+        Returns the DAG the `airflow run` arguments are about, parsing its
+        file only if it changed since it was last parsed by this worker, or
+        None if it has to be loaded by the task (e.g. from a pickle).
+        """
+        from airflow.bin.cli import process_subdir
+        from airflow.models import DAGS_FOLDER, DagBag
+        from airflow.utils.dag_processing import DagFileParseCache
+
+        if args.pickle:
+            return None
+        file_path = process_subdir(args.subdir)
+        if not os.path.isfile(file_path):
+            # Parsing the whole DAG folder isn't worth keeping
+            return None
+        if self._dag_cache is None:
+            self._dag_cache = DagFileParseCache(DAGS_FOLDER)
+
+        cached_dag_file = self._dag_cache.get(file_path, DAG_CACHE_TTL)
+        if cached_dag_file:
+            dagbag = cached_dag_file.dagbag
+        else:
+            fingerprint = self._dag_cache.get_fingerprint(file_path)
+            dagbag = DagBag(file_path)
+            if file_path not in dagbag.import_errors:
+                self._dag_cache.put(file_path, fingerprint, dagbag, {})
+        return dagbag.dags.get(args.dag_id)
+
+    def _run_forked(self, command):
+        """
+        Runs an `airflow run` command in a fork of this worker. The task
+        itself also runs in a fork, as if local_task_job_fork was set, rather
+        than in an `airflow run --raw` process that would import airflow and
+        parse the DAG file again.
+
+        :return: the state of the command, SUCCESS or FAILED
+        """
+        from airflow.bin.cli import CLIFactory
+        from airflow.jobs import ForkedProcess
+
+        try:
+            args = CLIFactory.get_parser().parse_args(shlex.split(command)[1:])
+            dag = self._get_dag(args)
+        except BaseException:
+            self.logger.exception("Failed to prepare {}".format(command))
+            return State.FAILED
+
+        def run_command():
+            # Only changes the configuration of the forked process
+            configuration.set('core', 'local_task_job_fork', 'True')
+            args.func(args, dag=dag)
+
+        return_code = ForkedProcess(run_command).wait()
+        if return_code == 0:
+            return State.SUCCESS
+        self.logger.error("failed to execute task {}: return code {}"
+                          .format(command, return_code))
+        return State.FAILED
 
 
 class LocalExecutor(BaseExecutor):
@@ -66,26 +264,80 @@ class LocalExecutor(BaseExecutor):
     def start(self):
         self.queue = multiprocessing.JoinableQueue()
         self.result_queue = multiprocessing.Queue()
-        self.workers = [
-            LocalWorker(self.queue, self.result_queue)
-            for i in range(self.parallelism)
-        ]
+        min_workers = self.parallelism
+        if MIN_WORKERS:
+            min_workers = min(int(MIN_WORKERS), self.parallelism)
+        self.pool_state = LocalWorkerPoolState(min_workers, WORKER_IDLE_TIMEOUT)
+        self.workers = []
+        for _ in range(self.pool_state.min_workers):
+            self._start_worker()
 
-        for w in self.workers:
-            w.start()
+    def _start_worker(self):
+        worker = LocalWorker(self.queue,
+                             self.result_queue,
+                             fork_tasks=FORK_TASKS,
+                             pool_state=self.pool_state)
+        self.pool_state.worker_started()
+        worker.start()
+        self.workers.append(worker)
+
+    def _reap_workers(self):
+        """
+        Forgets the workers that exited, e.g. after being idle.
+        """
+        for worker in list(self.workers):
+            if worker.is_alive():
+                continue
+            worker.join()
+            self.workers.remove(worker)
+            if worker.exitcode != 0:
+                self.logger.error("Worker (PID: {}) exited with code {}"
+                                  .format(worker.pid, worker.exitcode))
+                self.pool_state.worker_died()
 
     def execute_async(self, key, command, queue=None):
-        self.queue.put((key, command))
+        self.pool_state.task_queued()
+        self.queue.put((key, command, time.time()))
+        self._scale_up()
+
+    def _scale_up(self):
+        """
+        Starts workers for the queued tasks that no idle worker will take.
+        """
+        busy_workers = self.pool_state.busy_workers
+        live_workers = self.pool_state.live_workers
+        waiting_tasks = self.pool_state.queued_tasks
+        idle_workers = live_workers - busy_workers
+        while waiting_tasks > idle_workers and live_workers < self.parallelism:
+            self._start_worker()
+            idle_workers += 1
+            live_workers += 1
 
     def sync(self):
-        while not self.result_queue.empty():
-            results = self.result_queue.get()
+        # Drain the results at hand without waiting for more, as empty() isn't
+        # reliable
+        while True:
+            try:
+                results = self.result_queue.get_nowait()
+            except Empty:
+                break
             self.change_state(*results)
 
+        self._reap_workers()
+        # Workers may have exited while tasks were queued
+        self._scale_up()
+        busy_workers = self.pool_state.busy_workers
+        live_workers = self.pool_state.live_workers
+        Stats.gauge('local_executor.queue_depth', self.pool_state.queued_tasks)
+        Stats.gauge('local_executor.workers', live_workers)
+        Stats.gauge('local_executor.worker_utilization',
+                    100.0 * busy_workers / live_workers if live_workers else 0)
+
     def end(self):
+        self._reap_workers()
         # Sending poison pill to all worker
-        for _ in self.workers:
-            self.queue.put((None, None))
+        for _ in range(self.pool_state.stop()):
+            self.queue.put((None, None, None))
 
         # Wait for commands to finish
         self.queue.join()
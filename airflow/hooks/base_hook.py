@@ -23,7 +23,7 @@ import os
 import random
 
 from airflow import settings
-from airflow.models import Connection
+from airflow.models import ConfigVersion, Connection
 from airflow.exceptions import AirflowException
 
 _log = logging.getLogger(__name__)
@@ -42,19 +42,28 @@ class BaseHook(object):
     def __init__(self, source):
         pass
 
+    # The connections looked up by get_connections(), by conn_id
+    _connection_cache = ConfigVersion.get_cache('Connections')
+
     @classmethod
-    def get_connections(cls, conn_id):
+    def _get_connections_from_db(cls, conn_id):
         session = settings.Session()
         db = (
             session.query(Connection)
             .filter(Connection.conn_id == conn_id)
             .all()
         )
+        session.expunge_all()
+        session.close()
+        return db
+
+    @classmethod
+    def get_connections(cls, conn_id):
+        db = BaseHook._connection_cache.get(
+            conn_id, lambda: cls._get_connections_from_db(conn_id))
         if not db:
             raise AirflowException(
                 "The conn_id `{0}` isn't defined".format(conn_id))
-        session.expunge_all()
-        session.close()
         return db
 
     @classmethod
@@ -35,20 +35,24 @@ import time
 from time import sleep
 
 import psutil
-from sqlalchemy import Column, Integer, String, DateTime, func, Index, or_
+from sqlalchemy import (
+    Column, Integer, String, DateTime, and_, exists, func, Index, or_)
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm.session import make_transient
 from tabulate import tabulate
 
 from airflow import executors, models, settings
 from airflow import configuration as conf
+from airflow.dag.serialization import write_dag
 from airflow.exceptions import AirflowException
-from airflow.models import DagRun, TaskExclusion
+from airflow.models import DagRun, TaskExclusionIndex
 from airflow.settings import Stats
-from airflow.ti_deps.dep_context import DepContext, QUEUE_DEPS, RUN_DEPS
+from airflow.ti_deps.dep_context import (DagRunTIStates, DepContext, QUEUE_DEPS,
+                                         RUN_DEPS)
 from airflow.utils.state import State
 from airflow.utils.db import provide_session, pessimistic_connection_handling
 from airflow.utils.dag_processing import (AbstractDagFileProcessor,
+                                          DagFileParseCache,
                                           DagFileProcessorManager,
                                           SimpleDag,
                                           SimpleDagBag,
@@ -56,6 +60,7 @@ from airflow.utils.dag_processing import (AbstractDagFileProcessor,
 from airflow.utils.email import send_email
 from airflow.utils.helpers import kill_descendant_processes
 from airflow.utils.logging import LoggingMixin
+from airflow.utils.profiling import PeriodicProfiler, timed_phase
 from airflow.utils import asciiart
 
 
@@ -452,6 +457,419 @@ class DagFileProcessor(AbstractDagFileProcessor):
         return self._start_time
 
 
+class DagFileProcessorWorker(LoggingMixin):
+    """
+    A long-lived process that runs SchedulerJob.process_file() for every file
+    path it receives over a pipe, and sends back the result. The process exits
+    after processing max_tasks files, so that it can be replaced by a fresh
+    one and leaks from user code are contained.
+    """
+
+    def __init__(self, worker_id, max_tasks):
+        """
+        :param worker_id: an ID used to name the process
+        :type worker_id: int
+        :param max_tasks: the number of files to process before exiting. 0 or
+        less to never exit
+        :type max_tasks: int
+        """
+        self._conn, child_conn = multiprocessing.Pipe()
+        thread_name = "DagFileProcessorWorker{}".format(worker_id)
+        self._process = multiprocessing.Process(
+            target=DagFileProcessorWorker._run,
+            args=(child_conn, max_tasks, thread_name),
+            name="{}-Process".format(thread_name))
+        self._process.start()
+        # Only the child uses its end of the pipe
+        child_conn.close()
+        self._max_tasks = max_tasks
+        # The number of files sent to the worker
+        self.tasks_sent = 0
+        # Whether a file was sent and its result wasn't collected yet
+        self.busy = False
+
+    @staticmethod
+    def _run(conn, max_tasks, thread_name):
+        """
+        Runs in the worker process: processes the requests received over conn
+        until max_tasks files are processed or the pipe is closed.
+        """
+        # Update the logging configuration to include thread name.
+        thread_formatter = logging.Formatter(
+            settings.LOG_FORMAT_WITH_THREAD_NAME)
+        for handler in logging.getLogger('airflow').handlers:
+            handler.setFormatter(thread_formatter)
+
+        # Re-configure the ORM engine as there are issues with multiple processes
+        settings.configure_orm()
+
+        # Change the thread name to differentiate log lines.
+        threading.current_thread().name = thread_name
+
+        tasks_done = 0
+        while max_tasks <= 0 or tasks_done < max_tasks:
+            try:
+                request = conn.recv()
+            except EOFError:
+                break
+            if request is None:
+                break
+            file_path, pickle_dags, dag_id_white_list, log_file = request
+            conn.send(DagFileProcessorWorker._process_file(file_path,
+                                                           pickle_dags,
+                                                           dag_id_white_list,
+                                                           log_file))
+            tasks_done += 1
+        conn.close()
+
+    @staticmethod
+    def _process_file(file_path, pickle_dags, dag_id_white_list, log_file):
+        """
+        Runs SchedulerJob.process_file() with stdout and stderr directed to the
+        given log file.
+
+        :return: the SimpleDags found in the file, or None if processing failed
+        :rtype: list[SimpleDag]
+        """
+        parent_dir, _ = os.path.split(log_file)
+
+        # Create the parent directory for the log file if necessary.
+        if not os.path.isdir(parent_dir):
+            os.makedirs(parent_dir)
+
+        f = open(log_file, "a")
+        original_stdout = sys.stdout
+        original_stderr = sys.stderr
+
+        sys.stdout = f
+        sys.stderr = f
+
+        try:
+            start_time = time.time()
+            _log.info("Worker (PID=%s) started to work on %s",
+                      os.getpid(),
+                      file_path)
+            scheduler_job = SchedulerJob(dag_ids=dag_id_white_list)
+            result = scheduler_job.process_file(file_path, pickle_dags)
+            _log.info("Processing %s took %.3f seconds",
+                      file_path,
+                      time.time() - start_time)
+            return result
+        except Exception:
+            # Log exceptions through the logging framework.
+            _log.exception("Got an exception while processing %s", file_path)
+            return None
+        finally:
+            sys.stdout = original_stdout
+            sys.stderr = original_stderr
+            f.close()
+
+    def send(self, file_path, pickle_dags, dag_id_white_list, log_file):
+        """
+        Sends a file to process to the worker.
+        """
+        self.busy = True
+        self.tasks_sent += 1
+        self._conn.send((file_path, pickle_dags, dag_id_white_list, log_file))
+
+    @property
+    def exhausted(self):
+        """
+        :return: whether the worker was sent its last file, after which it
+        exits
+        :rtype: bool
+        """
+        return 0 < self._max_tasks <= self.tasks_sent
+
+    def poll(self):
+        """
+        :return: whether the result of the file sent last is available
+        :rtype: bool
+        """
+        return self._conn.poll()
+
+    def recv(self):
+        """
+        :return: the result of the file sent last, or None if processing it
+        failed
+        :rtype: list[SimpleDag]
+        """
+        try:
+            return self._conn.recv()
+        except EOFError:
+            return None
+        finally:
+            self.busy = False
+
+    def is_alive(self):
+        return self._process.is_alive()
+
+    @property
+    def pid(self):
+        return self._process.pid
+
+    @property
+    def exit_code(self):
+        return self._process.exitcode
+
+    def stop(self):
+        """
+        Asks the worker to exit once it is done with the file it is processing.
+        """
+        try:
+            self._conn.send(None)
+        except (IOError, OSError):
+            pass
+
+    def terminate(self, sigkill=False):
+        """
+        Terminate (and then kill) the worker process.
+        :param sigkill: whether to issue a SIGKILL if SIGTERM doesn't work.
+        :type sigkill: bool
+        """
+        self._process.terminate()
+        # Arbitrarily wait 5s for the process to die
+        self._process.join(5)
+        if sigkill and self._process.is_alive():
+            self.logger.warn("Killing PID {}".format(self._process.pid))
+            os.kill(self._process.pid, signal.SIGKILL)
+
+    def join(self, timeout=None):
+        self._process.join(timeout)
+
+
+class DagFileProcessorWorkerPool(LoggingMixin):
+    """
+    A fixed size pool of DagFileProcessorWorkers. The modules commonly needed
+    to parse DAG files are imported before the workers are forked so that
+    they aren't imported again for every file, and workers that exited (e.g.
+    after reaching their task limit) are replaced when a worker is requested.
+    """
+
+    def __init__(self, num_workers, max_tasks_per_worker):
+        """
+        :param num_workers: the number of workers in the pool
+        :type num_workers: int
+        :param max_tasks_per_worker: the number of files a worker processes
+        before it is recycled. 0 or less to never recycle workers
+        :type max_tasks_per_worker: int
+        """
+        self._num_workers = num_workers
+        self._max_tasks_per_worker = max_tasks_per_worker
+        self._workers = []
+        # Counter used to uniquely name the worker processes
+        self._worker_counter = 0
+
+    @staticmethod
+    def preload_modules():
+        """
+        Imports the modules that are used by most DAG files, so that the workers
+        forked afterwards don't have to.
+        """
+        import importlib
+        from airflow import operators
+        modules = ['airflow.models'] + ['airflow.operators.{}'.format(name)
+                                        for name in operators._operators]
+        for module in modules:
+            try:
+                importlib.import_module(module)
+            except Exception as e:
+                # Operators with missing optional dependencies are imported by
+                # the workers if a DAG file needs them, and fail there.
+                _log.debug("Could not preload %s: %s", module, e)
+
+    def _new_worker(self):
+        worker = DagFileProcessorWorker(self._worker_counter,
+                                        self._max_tasks_per_worker)
+        self._worker_counter += 1
+        return worker
+
+    def start(self):
+        """
+        Preloads the modules and starts the workers.
+        """
+        self.preload_modules()
+        self._workers = [self._new_worker() for _ in range(self._num_workers)]
+        self.logger.info("Started {} DAG file processor workers with PIDs {}"
+                         .format(self._num_workers, self.get_all_pids()))
+
+    def acquire(self):
+        """
+        :return: a worker that isn't processing a file, replacing the workers
+        that exited or that are exiting after their last file
+        :rtype: DagFileProcessorWorker
+        """
+        for i, worker in enumerate(self._workers):
+            if worker.busy:
+                continue
+            if worker.exhausted or not worker.is_alive():
+                # An exhausted worker exits right after sending its result
+                worker.join()
+                self.logger.info("DAG file processor worker (PID: {}) exited "
+                                 "with code {} after {} files, starting a new "
+                                 "one".format(worker.pid, worker.exit_code,
+                                              worker.tasks_sent))
+                worker = self._new_worker()
+                self._workers[i] = worker
+            return worker
+        raise AirflowException("All the {} DAG file processor workers are busy"
+                               .format(self._num_workers))
+
+    def get_all_pids(self):
+        """
+        :return: the PIDs of the workers
+        :rtype: list[int]
+        """
+        return [worker.pid for worker in self._workers]
+
+    def terminate(self):
+        """
+        Stops all the workers, killing the ones that don't exit in time.
+        """
+        for worker in self._workers:
+            worker.stop()
+        for worker in self._workers:
+            worker.join(5)
+            if worker.is_alive():
+                worker.terminate(sigkill=True)
+        self._workers = []
+
+
+class PooledDagFileProcessor(AbstractDagFileProcessor):
+    """
+    Helps call SchedulerJob.process_file() in one of the long-lived workers of
+    a DagFileProcessorWorkerPool.
+    """
+
+    def __init__(self, worker_pool, file_path, pickle_dags, dag_id_white_list,
+                 log_file):
+        """
+        :param worker_pool: the pool of workers to process the file with
+        :type worker_pool: DagFileProcessorWorkerPool
+        :param file_path: a Python file containing Airflow DAG definitions
+        :type file_path: unicode
+        :param pickle_dags: whether to serialize the DAG objects to the DB
+        :type pickle_dags: bool
+        :param dag_id_whitelist: If specified, only look at these DAG ID's
+        :type dag_id_whitelist: list[unicode]
+        :param log_file: the path to the file where log lines should be output
+        :type log_file: unicode
+        """
+        self._worker_pool = worker_pool
+        self._file_path = file_path
+        self._pickle_dags = pickle_dags
+        self._dag_id_white_list = dag_id_white_list
+        self._log_file = log_file
+        # The worker the file was sent to.
+        self._worker = None
+        # The result of Scheduler.process_file(file_path).
+        self._result = None
+        # Whether the worker is done processing the file.
+        self._done = False
+        # When the worker started to process the file.
+        self._start_time = None
+
+    @property
+    def file_path(self):
+        return self._file_path
+
+    @property
+    def log_file(self):
+        return self._log_file
+
+    def start(self):
+        """
+        Send the file to a worker of the pool.
+        """
+        self._worker = self._worker_pool.acquire()
+        self._worker.send(self.file_path,
+                          self._pickle_dags,
+                          self._dag_id_white_list,
+                          self.log_file)
+        self._start_time = datetime.now()
+
+    def terminate(self, sigkill=False):
+        """
+        Terminate (and then kill) the worker processing the file. The pool
+        replaces it with a new worker.
+        :param sigkill: whether to issue a SIGKILL if SIGTERM doesn't work.
+        :type sigkill: bool
+        """
+        if self._worker is None:
+            raise AirflowException("Tried to call stop before starting!")
+        self._worker.terminate(sigkill)
+        self._worker.busy = False
+        self._done = True
+
+    @property
+    def pid(self):
+        """
+        :return: the PID of the worker processing the given file
+        :rtype: int
+        """
+        if self._worker is None:
+            raise AirflowException("Tried to get PID before starting!")
+        return self._worker.pid
+
+    @property
+    def exit_code(self):
+        """
+        After the file is processed, this can be called to get the exit code
+        of the worker, which is None if the worker is still alive
+        :return: the exit code of the worker
+        :rtype: int
+        """
+        if not self._done:
+            raise AirflowException("Tried to call retcode before process was finished!")
+        return self._worker.exit_code
+
+    @property
+    def done(self):
+        """
+        Check if the worker is done processing this file.
+        :return: whether the file was processed
+        :rtype: bool
+        """
+        if self._worker is None:
+            raise AirflowException("Tried to see if it's done before starting!")
+
+        if self._done:
+            return True
+
+        if self._worker.poll():
+            self._result = self._worker.recv()
+            self._done = True
+            return True
+
+        # Potential error case when the worker dies
+        if not self._worker.is_alive():
+            self._worker.busy = False
+            self._done = True
+            return True
+
+        return False
+
+    @property
+    def result(self):
+        """
+        :return: result of running SchedulerJob.process_file()
+        :rtype: SimpleDag
+        """
+        if not self.done:
+            raise AirflowException("Tried to get the result before it's done!")
+        return self._result
+
+    @property
+    def start_time(self):
+        """
+        :return: when this started to process the file
+        :rtype: datetime
+        """
+        if self._start_time is None:
+            raise AirflowException("Tried to get start time before it started!")
+        return self._start_time
+
+
 class SchedulerJob(BaseJob):
     """
     This SchedulerJob runs for a specific time interval and schedules the jobs
@@ -465,6 +883,13 @@ class SchedulerJob(BaseJob):
         'polymorphic_identity': 'SchedulerJob'
     }
 
+    # The DagBags parsed by process_file() in this process, shared by the
+    # SchedulerJobs that are created for each file.
+    dag_file_parse_cache = DagFileParseCache(settings.DAGS_FOLDER)
+    # The fingerprints of the files, and of the local modules they loaded,
+    # when their DAGs were last serialized by this process, by file path
+    serialized_dag_fingerprints = {}
+
     def __init__(
             self,
             dag_id=None,
@@ -476,6 +901,7 @@ class SchedulerJob(BaseJob):
             processor_poll_interval=1.0,
             run_duration=None,
             do_pickle=False,
+            profile=False,
             *args, **kwargs):
         """
         :param dag_id: if specified, only schedule tasks with this DAG ID
@@ -494,6 +920,9 @@ class SchedulerJob(BaseJob):
         :param do_pickle: once a DAG object is obtained by executing the Python
         file, whether to serialize the DAG object to the DB
         :type do_pickle: bool
+        :param profile: whether to profile the scheduling loop with cProfile
+        and write snapshots to the profile_dump_dir periodically
+        :type profile: bool
         """
         # for BaseJob compatibility
         self.dag_id = dag_id
@@ -508,6 +937,7 @@ class SchedulerJob(BaseJob):
         self._processor_poll_interval = processor_poll_interval
 
         self.do_pickle = do_pickle
+        self.profile = profile
         super(SchedulerJob, self).__init__(*args, **kwargs)
 
         self.heartrate = conf.getint('scheduler', 'SCHEDULER_HEARTBEAT_SEC')
@@ -532,6 +962,24 @@ class SchedulerJob(BaseJob):
         # Directory where log files for the processes that scheduled the DAGs reside
         self.child_process_log_directory = conf.get('scheduler',
                                                     'child_process_log_directory')
+        # Whether to process the DAG files in a pool of long-lived workers
+        # instead of a new process per file, and how many files each worker
+        # processes before being replaced.
+        self.use_processor_pool = conf.getboolean('scheduler',
+                                                  'dag_file_processor_pool')
+        self.processor_pool_max_tasks_per_worker = conf.getint(
+            'scheduler', 'dag_file_processor_max_tasks_per_worker')
+        # How long the DAGs parsed from a file are reused when the file didn't
+        # change. 0 to parse the files every time.
+        self.dag_file_parse_cache_ttl = conf.getint('scheduler',
+                                                    'dag_file_parse_cache_ttl')
+        # Whether to write the parsed DAGs for the webserver to read
+        self.store_serialized_dags = conf.getboolean('core',
+                                                     'store_serialized_dags')
+        # Where and how often to write the profile snapshots when profiling
+        self.profile_dump_dir = conf.get('scheduler', 'profile_dump_dir')
+        self.profile_dump_interval = conf.getint('scheduler',
+                                                 'profile_dump_interval')
         if run_duration is None:
             self.run_duration = conf.getint('scheduler',
                                             'run_duration')
@@ -798,6 +1246,9 @@ class SchedulerJob(BaseJob):
         """
         session = settings.Session()
 
+        # Load the task exclusions of the DAG once for the whole pass
+        exclusion_index = TaskExclusionIndex.get(dag.dag_id, session=session)
+
         # update the state of the previously active dag runs
         dag_runs = DagRun.find(dag_id=dag.dag_id, state=State.RUNNING, session=session)
         active_dag_runs = []
@@ -831,6 +1282,17 @@ class SchedulerJob(BaseJob):
             # this needs a fresh session sometimes tis get detached
             tis = run.get_task_instances(state=(State.NONE,
                                                 State.UP_FOR_RETRY))
+            if not tis:
+                continue
+
+            # Load the states of all the task instances of the run at once so
+            # that the trigger rule of every task is evaluated in memory
+            # instead of with an aggregate query per task instance.
+            dagrun_ti_states = DagRunTIStates.load(run.dag_id,
+                                                   run.execution_date,
+                                                   session=session)
+            dep_context = DepContext(flag_upstream_failed=True,
+                                     dagrun_ti_states=dagrun_ti_states)
 
             # this loop is quite slow as it uses are_dependencies_met for
             # every task (in ti.is_runnable). This is also called in
@@ -846,14 +1308,14 @@ class SchedulerJob(BaseJob):
                     continue
 
                 if ti.are_dependencies_met(
-                        dep_context=DepContext(flag_upstream_failed=True),
+                        dep_context=dep_context,
                         session=session):
-                    if TaskExclusion.should_exclude_task(
-                            dag_id=ti.dag_id,
+                    if exclusion_index.should_exclude_task(
                             task_id=ti.task_id,
                             execution_date=ti.execution_date):
                         self.logger.debug('Excluding task: {}'.format(ti))
                         ti.set_state(State.EXCLUDED, session)
+                        dagrun_ti_states.set_state(ti.task_id, ti.state)
                     else:
                         self.logger.debug('Queuing task: {}'.format(ti))
                         queue.append(ti.key)
@@ -881,50 +1343,53 @@ class SchedulerJob(BaseJob):
         :type simple_dag_bag: SimpleDagBag
         """
 
-        task_instances_to_change = (
+        if not simple_dag_bag.dag_ids:
+            return
+
+        TI = models.TaskInstance
+        DR = models.DagRun
+        filters = and_(
+            TI.dag_id.in_(simple_dag_bag.dag_ids),
+            TI.state.in_(old_states),
+            exists().where(and_(
+                DR.dag_id == TI.dag_id,
+                DR.execution_date == TI.execution_date)),
+            ~exists().where(and_(
+                DR.dag_id == TI.dag_id,
+                DR.execution_date == TI.execution_date,
+                DR.state == State.RUNNING)))
+
+        # The keys are only fetched for the logs, the update runs with the
+        # same criteria so it can't change a TI whose DagRun started running
+        # in between
+        ti_keys_to_change = (
             session
-            .query(models.TaskInstance)
-            .filter(models.TaskInstance.dag_id.in_(simple_dag_bag.dag_ids))
-            .filter(models.TaskInstance.state.in_(old_states))
+            .query(TI.dag_id, TI.task_id, TI.execution_date)
+            .filter(filters)
             .all()
         )
-        """:type: list[TaskInstance]"""
-
-        for task_instance in task_instances_to_change:
-            dag_runs = DagRun.find(dag_id=task_instance.dag_id,
-                                   execution_date=task_instance.execution_date,
-                                   )
-
-            if len(dag_runs) == 0:
-                self.logger.warn("DagRun for %s %s does not exist",
-                                 task_instance.dag_id,
-                                 task_instance.execution_date)
-                continue
-
-            # There should only be one DAG run. Add some logging info if this
-            # is not the case for later debugging.
-            if len(dag_runs) > 1:
-                self.logger.warn("Multiple DagRuns found for {} {}: {}"
-                                 .format(task_instance.dag_id,
-                                         task_instance.execution_date,
-                                         dag_runs))
-
-            dag_is_running = True
-            for dag_run in dag_runs:
-                if dag_run.state == State.RUNNING:
-                    dag_is_running = True
-                    break
+        if not ti_keys_to_change:
+            return
 
-            if not dag_is_running:
-                self.logger.warn("Setting {} to state={} as it does not have "
-                                 "a DagRun in the {} state"
-                                 .format(task_instance,
-                                         new_state,
-                                         State.RUNNING))
-                task_instance.state = new_state
-                session.merge(task_instance)
+        changed = (
+            session
+            .query(TI)
+            .filter(filters)
+            .update({TI.state: new_state}, synchronize_session=False)
+        )
         session.commit()
 
+        for dag_id, task_id, execution_date in ti_keys_to_change:
+            self.logger.warn("Setting {}.{} execution_date={} to state={} as "
+                             "it does not have a DagRun in the {} state"
+                             .format(dag_id,
+                                     task_id,
+                                     execution_date,
+                                     new_state,
+                                     State.RUNNING))
+        self.logger.info("Set {} task instances in {} to state={}"
+                         .format(changed, old_states, new_state))
+
     @provide_session
     def _execute_task_instances(self,
                                 simple_dag_bag,
@@ -962,13 +1427,27 @@ class SchedulerJob(BaseJob):
             ["{}".format(x) for x in task_instances_to_examine])
         self.logger.info("Tasks up for execution:\n\t{}".format(task_instance_str))
 
-        # Get the pool settings
-        pools = {p.pool: p for p in session.query(models.Pool).all()}
+        # Get the open slots of every pool, the DagRuns of the task instances and
+        # the number of running tasks of their DAGs in one query each, rather than
+        # in a few queries per pool and per task instance.
+        pool_to_open_slots = models.Pool.get_open_slots_by_pool(session=session)
+
+        dag_runs = DagRun.get_runs_for_task_instances(session,
+                                                      task_instances_to_examine)
+
+        # DAG IDs with running tasks that equal the concurrency limit of the dag
+        dag_id_to_running_task_count = DagRun.get_running_tasks_per_dag(
+            session,
+            {dag_id: simple_dag_bag.get_dag(dag_id).task_ids
+             for dag_id in {ti.dag_id for ti in task_instances_to_examine}})
 
         pool_to_task_instances = defaultdict(list)
         for task_instance in task_instances_to_examine:
             pool_to_task_instances[task_instance.pool].append(task_instance)
 
+        # Task instances to send to the executor along with their command
+        task_instances_to_queue = []
+
         # Go through each pool, and queue up a task for execution if there are
         # any open slots in the pool.
         for pool, task_instances in pool_to_task_instances.items():
@@ -977,8 +1456,12 @@ class SchedulerJob(BaseJob):
                 # If queued outside of a pool, trigger no more than
                 # non_pooled_task_slot_count per run
                 open_slots = conf.getint('core', 'non_pooled_task_slot_count')
+            elif pool not in pool_to_open_slots:
+                self.logger.warn("Tasks using non-existent pool '{}' will not "
+                                 "be scheduled".format(pool))
+                continue
             else:
-                open_slots = pools[pool].open_slots(session=session)
+                open_slots = pool_to_open_slots[pool]
 
             num_queued = len(task_instances)
             self.logger.info("Figuring out tasks to run in Pool(name={pool}) "
@@ -991,9 +1474,6 @@ class SchedulerJob(BaseJob):
             priority_sorted_task_instances = sorted(
                 task_instances, key=lambda ti: (-ti.priority_weight, ti.execution_date))
 
-            # DAG IDs with running tasks that equal the concurrency limit of the dag
-            dag_id_to_running_task_count = {}
-
             for task_instance in priority_sorted_task_instances:
                 if open_slots <= 0:
                     self.logger.info("No more slots free")
@@ -1006,7 +1486,8 @@ class SchedulerJob(BaseJob):
                     continue
 
                 # todo: remove this logic when backfills will be part of the scheduler
-                dag_run = task_instance.get_dagrun()
+                dag_run = dag_runs.get((task_instance.dag_id,
+                                        task_instance.execution_date))
                 if dag_run and dag_run.is_backfill:
                     continue
 
@@ -1014,13 +1495,6 @@ class SchedulerJob(BaseJob):
                 # reached.
                 dag_id = task_instance.dag_id
 
-                if dag_id not in dag_id_to_running_task_count:
-                    dag_id_to_running_task_count[dag_id] = \
-                        DagRun.get_running_tasks(
-                            session,
-                            dag_id,
-                            simple_dag_bag.get_dag(dag_id).task_ids)
-
                 current_task_concurrency = dag_id_to_running_task_count[dag_id]
                 task_concurrency_limit = simple_dag_bag.get_dag(dag_id).concurrency
                 self.logger.info("DAG {} has {}/{} running tasks"
@@ -1050,37 +1524,95 @@ class SchedulerJob(BaseJob):
                     file_path=simple_dag_bag.get_dag(task_instance.dag_id).full_filepath,
                     pickle_id=simple_dag_bag.get_dag(task_instance.dag_id).pickle_id)
 
-                priority = task_instance.priority_weight
-                queue = task_instance.queue
-                self.logger.info("Sending to executor {} with priority {} and queue {}"
-                                 .format(task_instance.key, priority, queue))
+                task_instances_to_queue.append((task_instance, command))
+
+                open_slots -= 1
+
+        if not task_instances_to_queue:
+            return
+
+        # Detach the task instances from the session so that they keep their
+        # attributes once the transaction is committed, and set them all to
+        # queued in a single transaction.
+        for task_instance, _ in task_instances_to_queue:
+            make_transient(task_instance)
+
+        queued_keys = self._set_task_instances_to_queued(
+            [task_instance for task_instance, _ in task_instances_to_queue],
+            states,
+            session=session)
+
+        for task_instance, command in task_instances_to_queue:
+            if task_instance.key not in queued_keys:
+                self.logger.info("Not sending {} to the executor since its "
+                                 "state changed in the meantime"
+                                 .format(task_instance.key))
+                continue
+            priority = task_instance.priority_weight
+            queue = task_instance.queue
+            self.logger.info("Sending to executor {} with priority {} and queue {}"
+                             .format(task_instance.key, priority, queue))
+
+            self.executor.queue_command(
+                task_instance,
+                command,
+                priority=priority,
+                queue=queue)
+
+    def _set_task_instances_to_queued(self, task_instances, states, session):
+        """
+        Sets the state of the given task instances to queued with bulk UPDATE
+        statements committed as a single transaction. Task instances that have
+        left the given states in the meantime are not updated.
+
+        :param task_instances: the task instances to set to queued
+        :type task_instances: list[TaskInstance]
+        :param states: the states the task instances are expected to be in
+        :type states: Tuple[State]
+        :return: the keys of the task instances that were set to queued
+        :rtype: set[tuple]
+        """
+        TI = models.TaskInstance
+        now = datetime.now()
+
+        # Stay well below the number of bound parameters databases accept per
+        # statement (e.g. 999 for sqlite) by updating in batches.
+        batch_size = 100
+        queued_keys = set()
+        for i in range(0, len(task_instances), batch_size):
+            keys = [task_instance.key
+                    for task_instance in task_instances[i:i + batch_size]]
+            # Lock the rows that are still in the expected states, so that
+            # they can't change before they are updated.
+            locked_keys = [
+                tuple(row) for row in
+                session
+                .query(TI.dag_id, TI.task_id, TI.execution_date)
+                .filter(TI.filter_for_keys(keys))
+                .filter(TI.state.in_(states))
+                .with_for_update()
+                .all()
+            ]
+            if not locked_keys:
+                continue
+            (
+                session
+                .query(TI)
+                .filter(TI.filter_for_keys(locked_keys))
+                .update({TI.state: State.QUEUED,
+                         TI.queued_dttm: func.coalesce(TI.queued_dttm, now)},
+                        synchronize_session=False)
+            )
+            queued_keys.update(locked_keys)
+        session.commit()
 
-                # Set the state to queued
-                self.logger.info("Setting state of {} to {}".format(
+        for task_instance in task_instances:
+            if task_instance.key in queued_keys:
+                self.logger.info("Set state of {} to {}".format(
                     task_instance.key, State.QUEUED))
                 task_instance.state = State.QUEUED
-                task_instance.queued_dttm = (datetime.now()
-                                             if not task_instance.queued_dttm
-                                             else task_instance.queued_dttm)
-                session.merge(task_instance)
-                session.commit()
-
-                # These attributes will be lost after the object expires, so save them.
-                task_id_ = task_instance.task_id
-                dag_id_ = task_instance.dag_id
-                execution_date_ = task_instance.execution_date
-                make_transient(task_instance)
-                task_instance.task_id = task_id_
-                task_instance.dag_id = dag_id_
-                task_instance.execution_date = execution_date_
-
-                self.executor.queue_command(
-                    task_instance,
-                    command,
-                    priority=priority,
-                    queue=queue)
-
-                open_slots -= 1
+                task_instance.queued_dttm = task_instance.queued_dttm or now
+        return queued_keys
 
     def _process_dags(self, dagbag, dags, tis_out):
         """
@@ -1116,7 +1648,8 @@ class SchedulerJob(BaseJob):
             if dag_run:
                 self.logger.info("Created {}".format(dag_run))
             self._process_task_instances(dag, tis_out)
-            self.manage_slas(dag)
+            with timed_phase('scheduler.process_file.manage_slas'):
+                self.manage_slas(dag)
 
         models.DagStat.clean_dirty([d.dag_id for d in dags])
 
@@ -1255,7 +1788,22 @@ class SchedulerJob(BaseJob):
         self.logger.info("There are {} files in {}"
                          .format(len(known_file_paths), self.subdir))
 
+        processor_pool = None
+        if self.use_processor_pool:
+            self.logger.info("Processing files using a pool of workers that "
+                             "are recycled every {} files"
+                             .format(self.processor_pool_max_tasks_per_worker))
+            processor_pool = DagFileProcessorWorkerPool(
+                self.max_threads, self.processor_pool_max_tasks_per_worker)
+            processor_pool.start()
+
         def processor_factory(file_path, log_file_path):
+            if processor_pool:
+                return PooledDagFileProcessor(processor_pool,
+                                              file_path,
+                                              pickle_dags,
+                                              self.dag_ids,
+                                              log_file_path)
             return DagFileProcessor(file_path,
                                     pickle_dags,
                                     self.dag_ids,
@@ -1306,6 +1854,10 @@ class SchedulerJob(BaseJob):
                         child.kill()
                         child.wait()
 
+            if processor_pool:
+                self.logger.info("Stopping the DAG file processor workers")
+                processor_pool.terminate()
+
     def _execute_helper(self, processor_manager):
         """
         :param processor_manager: manager to use
@@ -1343,6 +1895,13 @@ class SchedulerJob(BaseJob):
         # Use this value initially
         known_file_paths = processor_manager.file_paths
 
+        profiler = None
+        if self.profile:
+            profiler = PeriodicProfiler('scheduler',
+                                        self.profile_dump_dir,
+                                        self.profile_dump_interval)
+            profiler.start()
+
         # For the execute duration, parse and schedule DAGs
         while (datetime.now() - execute_start_time).total_seconds() < \
                 self.run_duration or self.run_duration < 0:
@@ -1365,7 +1924,8 @@ class SchedulerJob(BaseJob):
 
             # Kick of new processes and collect results from finished ones
             self.logger.info("Heartbeating the process manager")
-            simple_dags = processor_manager.heartbeat()
+            with timed_phase('scheduler.loop.processor_heartbeat'):
+                simple_dags = processor_manager.heartbeat()
 
             if self.using_sqlite:
                 # For the sqlite case w/ 1 thread, wait until the processor
@@ -1382,30 +1942,36 @@ class SchedulerJob(BaseJob):
                 # a non-running state. Handle task instances that belong to
                 # DAG runs in those states
 
-                # If a task instance is up for retry but the corresponding DAG run
-                # isn't running, mark the task instance as FAILED so we don't try
-                # to re-run it.
-                self._change_state_for_tis_without_dagrun(simple_dag_bag,
-                                                          [State.UP_FOR_RETRY],
-                                                          State.FAILED)
-                # If a task instance is scheduled or queued, but the corresponding
-                # DAG run isn't running, set the state to NONE so we don't try to
-                # re-run it.
-                self._change_state_for_tis_without_dagrun(simple_dag_bag,
-                                                          [State.QUEUED,
-                                                           State.SCHEDULED],
-                                                          State.NONE)
-
-                self._execute_task_instances(simple_dag_bag,
-                                             (State.SCHEDULED,
-                                              State.UP_FOR_RETRY))
+                with timed_phase('scheduler.loop.'
+                                 'change_state_for_tis_without_dagrun'):
+                    # If a task instance is up for retry but the corresponding
+                    # DAG run isn't running, mark the task instance as FAILED
+                    # so we don't try to re-run it.
+                    self._change_state_for_tis_without_dagrun(
+                        simple_dag_bag,
+                        [State.UP_FOR_RETRY],
+                        State.FAILED)
+                    # If a task instance is scheduled or queued, but the
+                    # corresponding DAG run isn't running, set the state to
+                    # NONE so we don't try to re-run it.
+                    self._change_state_for_tis_without_dagrun(
+                        simple_dag_bag,
+                        [State.QUEUED, State.SCHEDULED],
+                        State.NONE)
+
+                with timed_phase('scheduler.loop.execute_task_instances'):
+                    self._execute_task_instances(simple_dag_bag,
+                                                 (State.SCHEDULED,
+                                                  State.UP_FOR_RETRY))
 
             # Call hearbeats
             self.logger.info("Heartbeating the executor")
-            self.executor.heartbeat()
+            with timed_phase('scheduler.loop.executor_heartbeat'):
+                self.executor.heartbeat()
 
             # Process events from the executor
-            self._process_executor_events()
+            with timed_phase('scheduler.loop.process_executor_events'):
+                self._process_executor_events()
 
             # Heartbeat the scheduler periodically
             time_since_last_heartbeat = (datetime.now() -
@@ -1426,6 +1992,10 @@ class SchedulerJob(BaseJob):
             loop_end_time = time.time()
             self.logger.debug("Ran scheduling loop in {:.2f}s"
                               .format(loop_end_time - loop_start_time))
+            Stats.timing('scheduler.loop.duration',
+                         (loop_end_time - loop_start_time) * 1000)
+            if profiler:
+                profiler.maybe_dump()
             self.logger.debug("Sleeping for {:.2f}s"
                               .format(self._processor_poll_interval))
             time.sleep(self._processor_poll_interval)
@@ -1436,6 +2006,9 @@ class SchedulerJob(BaseJob):
                                  "{} times".format(self.num_runs))
                 break
 
+        if profiler:
+            profiler.stop()
+
         # Stop any processors
         processor_manager.terminate()
 
@@ -1486,25 +2059,50 @@ class SchedulerJob(BaseJob):
         # As DAGs are parsed from this file, they will be converted into SimpleDags
         simple_dags = []
 
-        try:
-            dagbag = models.DagBag(file_path)
-        except Exception:
-            self.logger.exception("Failed at reloading the DAG file {}".format(file_path))
-            Stats.incr('dag_file_refresh_error', 1, 1)
-            return []
-
-        if len(dagbag.dags) > 0:
-            self.logger.info("DAG(s) {} retrieved from {}"
-                             .format(dagbag.dags.keys(),
-                                     file_path))
-        else:
-            self.logger.warn("No viable dags retrieved from {}".format(file_path))
-            return []
+        cached_dag_file = None
+        if self.dag_file_parse_cache_ttl > 0:
+            cached_dag_file = self.dag_file_parse_cache.get(
+                file_path, self.dag_file_parse_cache_ttl)
 
-        # Save individual DAGs in the ORM and update DagModel.last_scheduled_time
         sync_time = datetime.now()
-        for dag in dagbag.dags.values():
-            models.DAG.sync_to_db(dag, dag.owner, sync_time)
+        if cached_dag_file:
+            # The file didn't change, so only the scheduling has to be done
+            dagbag = cached_dag_file.dagbag
+            pickle_ids = cached_dag_file.pickle_ids
+            self.logger.info("DAG(s) {} reused from the last parse of {}"
+                             .format(dagbag.dags.keys(), file_path))
+            Stats.incr('dag_file_parse_cache_hit', 1, 1)
+            with timed_phase('scheduler.process_file.sync_to_db'):
+                self._touch_dags(dagbag, sync_time, session=session)
+        else:
+            fingerprint = self.dag_file_parse_cache.get_fingerprint(file_path)
+            pickle_ids = {}
+            try:
+                with timed_phase('scheduler.process_file.dagbag_load'):
+                    dagbag = models.DagBag(file_path)
+            except Exception:
+                self.logger.exception("Failed at reloading the DAG file {}"
+                                      .format(file_path))
+                Stats.incr('dag_file_refresh_error', 1, 1)
+                return []
+
+            if len(dagbag.dags) > 0:
+                self.logger.info("DAG(s) {} retrieved from {}"
+                                 .format(dagbag.dags.keys(),
+                                         file_path))
+            else:
+                self.logger.warn("No viable dags retrieved from {}".format(file_path))
+                return []
+
+            # Save individual DAGs in the ORM and update DagModel.last_scheduled_time
+            with timed_phase('scheduler.process_file.sync_to_db'):
+                for dag in dagbag.dags.values():
+                    models.DAG.sync_to_db(dag, dag.owner, sync_time)
+
+            if self.store_serialized_dags:
+                with timed_phase('scheduler.process_file.serialize'):
+                    self._write_serialized_dags(file_path, fingerprint, dagbag,
+                                                session=session)
 
         paused_dag_ids = [dag.dag_id for dag in dagbag.dags.values()
                           if dag.is_paused]
@@ -1514,7 +2112,11 @@ class SchedulerJob(BaseJob):
             dag = dagbag.get_dag(dag_id)
             pickle_id = None
             if pickle_dags:
-                pickle_id = dag.pickle(session).id
+                pickle_id = pickle_ids.get(dag_id)
+                if pickle_id is None:
+                    with timed_phase('scheduler.process_file.pickle'):
+                        pickle_id = dag.pickle(session).id
+                    pickle_ids[dag_id] = pickle_id
 
             task_ids = [task.task_id for task in dag.tasks]
 
@@ -1541,7 +2143,12 @@ class SchedulerJob(BaseJob):
         # returns true?)
         ti_keys_to_schedule = []
 
-        self._process_dags(dagbag, dags, ti_keys_to_schedule)
+        with timed_phase('scheduler.process_file.process_dags'):
+            self._process_dags(dagbag, dags, ti_keys_to_schedule)
+            # The paused DAGs are counted too, their task instances can still
+            # finish or be changed from the UI
+            models.TaskStat.update(
+                [dag for dag in dagbag.dags.values() if not dag.parent_dag])
 
         for ti_key in ti_keys_to_schedule:
             dag = dagbag.dags[ti_key[0]]
@@ -1578,12 +2185,71 @@ class SchedulerJob(BaseJob):
         except Exception:
             self.logger.exception("Error logging import errors!")
         try:
-            dagbag.kill_zombies()
+            with timed_phase('scheduler.process_file.kill_zombies'):
+                dagbag.kill_zombies()
         except Exception:
             self.logger.exception("Error killing zombies!")
 
+        if (self.dag_file_parse_cache_ttl > 0 and not cached_dag_file and
+                file_path not in dagbag.import_errors):
+            self.dag_file_parse_cache.put(file_path,
+                                          fingerprint,
+                                          dagbag,
+                                          pickle_ids)
+
         return simple_dags
 
+    @provide_session
+    def _write_serialized_dags(self, file_path, fingerprint, dagbag,
+                               session=None):
+        """
+        Writes the DAGs parsed from a file for the webserver, unless neither
+        the file nor the local modules it loaded changed since this process
+        last wrote them.
+
+        :param fingerprint: the fingerprint of the file before it was parsed
+        :type fingerprint: list
+        """
+        fingerprints = self.dag_file_parse_cache.get_fingerprints(
+            file_path, fingerprint)
+        last_fingerprints = self.serialized_dag_fingerprints.get(file_path)
+        if (last_fingerprints is not None and
+                set(last_fingerprints) == set(fingerprints) and
+                not self.dag_file_parse_cache.get_changed_paths(
+                    last_fingerprints)):
+            self.logger.info("Not serializing the DAG(s) of {} again since it "
+                             "didn't change".format(file_path))
+            return
+        for dag in dagbag.dags.values():
+            write_dag(dag, session=session)
+        self.serialized_dag_fingerprints[file_path] = fingerprints
+
+    @staticmethod
+    @provide_session
+    def _touch_dags(dagbag, sync_time, session=None):
+        """
+        Mark the DAGs of a DagBag that was parsed before as active and
+        sync'ed, like DAG.sync_to_db() does, with a single query. The DAGs
+        whose row is missing are saved with DAG.sync_to_db().
+
+        :param dagbag: the DagBag containing the DAGs
+        :type dagbag: models.DagBag
+        :param sync_time: The time that the DAGs should be marked as sync'ed
+        :type sync_time: datetime
+        """
+        dag_ids = list(dagbag.dags.keys())
+        updated = (
+            session
+            .query(models.DagModel)
+            .filter(models.DagModel.dag_id.in_(dag_ids))
+            .update({models.DagModel.last_scheduler_run: sync_time,
+                     models.DagModel.is_active: True},
+                    synchronize_session=False))
+        session.commit()
+        if updated < len(dag_ids):
+            for dag in dagbag.dags.values():
+                models.DAG.sync_to_db(dag, dag.owner, sync_time, session=session)
+
     @provide_session
     def heartbeat_callback(self, session=None):
         Stats.gauge('scheduler_heartbeat', 1, 1)
@@ -1963,6 +2629,57 @@ class BackfillJob(BaseJob):
         self.logger.info("Backfill done. Exiting.")
 
 
+class ForkedProcess(object):
+    """
+    A child process forked from the current one to call a function, with the
+    part of the subprocess.Popen interface LocalTaskJob uses. The child exits
+    with 0 if the function returned, 1 if it raised.
+    """
+
+    def __init__(self, target):
+        """
+        :param target: the function to call in the child
+        :type target: callable
+        """
+        self.returncode = None
+        self.pid = os.fork()
+        if self.pid == 0:
+            exit_code = 1
+            try:
+                target()
+                exit_code = 0
+            except BaseException:
+                _log.exception("Forked process failed")
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                # Skip the cleanup of the parent's resources, e.g. atexit
+                os._exit(exit_code)
+
+    def _set_returncode(self, status):
+        if os.WIFSIGNALED(status):
+            self.returncode = -os.WTERMSIG(status)
+        else:
+            self.returncode = os.WEXITSTATUS(status)
+
+    def poll(self):
+        if self.returncode is None:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid:
+                self._set_returncode(status)
+        return self.returncode
+
+    def wait(self):
+        if self.returncode is None:
+            _, status = os.waitpid(self.pid, 0)
+            self._set_returncode(status)
+        return self.returncode
+
+    def terminate(self):
+        if self.returncode is None:
+            os.kill(self.pid, signal.SIGTERM)
+
+
 class LocalTaskJob(BaseJob):
 
     __mapper_args__ = {
@@ -2000,6 +2717,9 @@ class LocalTaskJob(BaseJob):
         super(LocalTaskJob, self).__init__(*args, **kwargs)
 
     def _execute(self):
+        if conf.getboolean('core', 'local_task_job_fork'):
+            self._execute_forked()
+            return
         try:
             command = self.task_instance.command(
                 raw=True,
@@ -2056,6 +2776,92 @@ class LocalTaskJob(BaseJob):
             # Kill processes that were left running
             kill_descendant_processes(self.logger)
 
+    def _run_raw_task(self):
+        """
+        Runs the task instance like `airflow run --raw` does, in the process
+        forked by _execute_forked.
+        """
+        # Like `airflow run --raw`, don't keep connections open while the
+        # task runs
+        settings.configure_orm(disable_connection_pool=True)
+        self.task_instance.run(
+            mark_success=self.mark_success,
+            ignore_all_deps=self.ignore_all_deps,
+            ignore_depends_on_past=self.ignore_depends_on_past,
+            ignore_task_deps=self.ignore_task_deps,
+            ignore_ti_state=self.ignore_ti_state,
+            job_id=self.id,
+            pool=self.pool)
+
+    def _execute_forked(self):
+        """
+        Runs the task instance in a fork of this process, which already has
+        airflow and the DAG loaded, instead of in a new `airflow run --raw`
+        process. The main thread waits for the child while another one
+        heartbeats.
+        """
+        heartbeat_error = []
+        child_exited = threading.Event()
+
+        def heartbeat_loop():
+            last_heartbeat_time = time.time()
+            heartbeat_time_limit = conf.getint(
+                'scheduler', 'scheduler_zombie_task_threshold')
+            while not child_exited.wait(self.heartrate):
+                try:
+                    self.heartbeat()
+                    last_heartbeat_time = time.time()
+                except OperationalError:
+                    Stats.incr('local_task_job_heartbeat_failure', 1, 1)
+                    self.logger.exception(
+                        "Exception while trying to heartbeat!")
+                except Exception as e:
+                    heartbeat_error.append(e)
+                    self.process.terminate()
+                    return
+
+                # If it's been too long since we've heartbeat, then it's
+                # possible that the scheduler rescheduled this task, so kill
+                # the task.
+                time_since_last_heartbeat = time.time() - last_heartbeat_time
+                if time_since_last_heartbeat > heartbeat_time_limit:
+                    Stats.incr('local_task_job_prolonged_heartbeat_failure',
+                               1, 1)
+                    self.logger.error("Heartbeat time limited exceeded!")
+                    heartbeat_error.append(AirflowException(
+                        "Time since last heartbeat({:.2f}s) exceeded limit "
+                        "({}s).".format(time_since_last_heartbeat,
+                                        heartbeat_time_limit)))
+                    self.process.terminate()
+                    return
+
+        try:
+            self.process = ForkedProcess(self._run_raw_task)
+            self.logger.info("Forked process PID is {}"
+                             .format(self.process.pid))
+            ti = self.task_instance
+            session = settings.Session()
+            ti.pid = self.process.pid
+            ti.hostname = socket.getfqdn()
+            session.merge(ti)
+            session.commit()
+            session.close()
+
+            heartbeat_thread = threading.Thread(target=heartbeat_loop,
+                                                name='heartbeat')
+            heartbeat_thread.daemon = True
+            heartbeat_thread.start()
+            try:
+                self.process.wait()
+            finally:
+                child_exited.set()
+                heartbeat_thread.join()
+            if heartbeat_error:
+                raise heartbeat_error[0]
+        finally:
+            # Kill processes that were left running
+            kill_descendant_processes(self.logger)
+
     def on_kill(self):
         self.process.terminate()
 
@@ -0,0 +1,42 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""add config_version table
+
+Revision ID: a5ba1e2d6c1f
+Revises: edc0f7e8e831
+Create Date: 2017-03-20 14:37:05.612904
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a5ba1e2d6c1f'
+down_revision = 'edc0f7e8e831'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    config_version = op.create_table(
+        'config_version',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False, default=0),
+        sa.PrimaryKeyConstraint('id'))
+    op.bulk_insert(config_version, [{'id': 1, 'version': 0}])
+
+
+def downgrade():
+    op.drop_table('config_version')
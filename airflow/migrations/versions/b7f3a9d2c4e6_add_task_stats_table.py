@@ -0,0 +1,44 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""add task_stats table
+
+Revision ID: b7f3a9d2c4e6
+Revises: e1b2c5d8f0a7
+Create Date: 2017-03-27 10:12:45.108573
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b7f3a9d2c4e6'
+down_revision = 'e1b2c5d8f0a7'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'task_stats',
+        sa.Column('dag_id', sa.String(length=250), nullable=False),
+        sa.Column('state', sa.String(length=50), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=True),
+        sa.Column('ti_updated_at', sa.DateTime(), nullable=True),
+        sa.Column('dirty', sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint('dag_id', 'state'))
+
+
+def downgrade():
+    op.drop_table('task_stats')
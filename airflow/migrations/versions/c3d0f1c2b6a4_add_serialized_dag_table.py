@@ -0,0 +1,46 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""add serialized_dag table
+
+Revision ID: c3d0f1c2b6a4
+Revises: a5ba1e2d6c1f
+Create Date: 2017-03-22 11:04:52.381027
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c3d0f1c2b6a4'
+down_revision = 'a5ba1e2d6c1f'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+def upgrade():
+    op.create_table(
+        'serialized_dag',
+        sa.Column('dag_id', sa.String(length=250), nullable=False),
+        sa.Column('fileloc', sa.String(length=2000), nullable=True),
+        sa.Column('data', sa.Text().with_variant(mysql.LONGTEXT(), 'mysql'),
+                  nullable=True),
+        sa.Column('data_hash', sa.String(length=40), nullable=True),
+        sa.Column('last_updated', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('dag_id'))
+
+
+def downgrade():
+    op.drop_table('serialized_dag')
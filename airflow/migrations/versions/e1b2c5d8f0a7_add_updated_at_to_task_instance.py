@@ -0,0 +1,42 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""add updated_at to task_instance
+
+Revision ID: e1b2c5d8f0a7
+Revises: c3d0f1c2b6a4
+Create Date: 2017-03-24 15:31:08.614392
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e1b2c5d8f0a7'
+down_revision = 'c3d0f1c2b6a4'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column(
+        'task_instance', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.create_index(
+        'ti_dag_updated_at', 'task_instance', ['dag_id', 'updated_at'],
+        unique=False)
+
+
+def downgrade():
+    op.drop_index('ti_dag_updated_at', table_name='task_instance')
+    op.drop_column('task_instance', 'updated_at')
@@ -0,0 +1,38 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""add task_exclusions_version column to dag
+
+Revision ID: edc0f7e8e831
+Revises: bbb79aef5cac
+Create Date: 2017-03-06 10:12:41.218213
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'edc0f7e8e831'
+down_revision = 'bbb79aef5cac'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('dag', sa.Column('task_exclusions_version', sa.Integer(),
+                                   default=0))
+
+
+def downgrade():
+    op.drop_column('dag', 'task_exclusions_version')
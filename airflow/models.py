@@ -21,8 +21,13 @@ from future.standard_library import install_aliases
 install_aliases()
 from builtins import str
 from builtins import object, bytes
+import bisect
 import copy
-from collections import namedtuple
+from collections import defaultdict, namedtuple
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
 from datetime import datetime, timedelta
 import dill
 import functools
@@ -48,8 +53,8 @@ from urllib.parse import urlparse
 
 from sqlalchemy import (
     Column, Integer, String, DateTime, Text, Boolean, ForeignKey, PickleType,
-    Index, Float)
-from sqlalchemy import func, or_, and_
+    Index, Float, LargeBinary)
+from sqlalchemy import func, or_, and_, type_coerce, union_all
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.dialects.mysql import LONGTEXT
 from sqlalchemy.orm import reconstructor, relationship, synonym
@@ -65,18 +70,22 @@ from airflow.dag.base_dag import BaseDag, BaseDagBag
 from airflow.ti_deps.deps.not_in_retry_period_dep import NotInRetryPeriodDep
 from airflow.ti_deps.deps.prev_dagrun_dep import PrevDagrunDep
 from airflow.ti_deps.deps.trigger_rule_dep import TriggerRuleDep
-from airflow.ti_deps.dep_context import DepContext, QUEUE_DEPS, RUN_DEPS
+from airflow.ti_deps.dep_context import (
+    DagRunTIStates, DepContext, QUEUE_DEPS, RUN_DEPS)
+from airflow.utils.dag_processing import list_py_file_paths
 from airflow.utils.dates import cron_presets, date_range as utils_date_range
-from airflow.utils.db import provide_session
+from airflow.utils.db import provide_session, sql_component
 from airflow.utils.decorators import apply_defaults
 from airflow.utils.email import send_email
 from airflow.utils.helpers import (
-    as_tuple, is_container, is_in, validate_key, pprinttable)
+    as_tuple, is_container, validate_key, pprinttable)
 from airflow.utils.logging import LoggingMixin
+from airflow.utils.lookup_cache import LookupCache
 from airflow.utils.operator_resources import Resources
 from airflow.utils.state import State
 from airflow.utils.timeout import timeout
 from airflow.utils.trigger_rule import TriggerRule
+from airflow.utils import xcom_storage
 
 Base = declarative_base()
 ID_LEN = 250
@@ -394,40 +403,26 @@ class DagBag(BaseDagBag, LoggingMixin):
         if os.path.isfile(dag_folder):
             self.process_file(dag_folder, only_if_updated=only_if_updated)
         elif os.path.isdir(dag_folder):
-            patterns = []
-            for root, dirs, files in os.walk(dag_folder, followlinks=True):
-                ignore_file = [f for f in files if f == '.airflowignore']
-                if ignore_file:
-                    f = open(os.path.join(root, ignore_file[0]), 'r')
-                    patterns += [p for p in f.read().split('\n') if p]
-                    f.close()
-                for f in files:
-                    try:
-                        filepath = os.path.join(root, f)
-                        if not os.path.isfile(filepath):
-                            continue
-                        mod_name, file_ext = os.path.splitext(
-                            os.path.split(filepath)[-1])
-                        if file_ext != '.py' and not zipfile.is_zipfile(filepath):
-                            continue
-                        if not any(
-                                [re.findall(p, filepath) for p in patterns]):
-                            ts = datetime.now()
-                            found_dags = self.process_file(
-                                filepath, only_if_updated=only_if_updated)
-
-                            td = datetime.now() - ts
-                            td = td.total_seconds() + (
-                                float(td.microseconds) / 1000000)
-                            stats.append(FileLoadStat(
-                                filepath.replace(dag_folder, ''),
-                                td,
-                                len(found_dags),
-                                sum([len(dag.tasks) for dag in found_dags]),
-                                str([dag.dag_id for dag in found_dags]),
-                            ))
-                    except Exception as e:
-                        _log.warning(e)
+            for filepath in list_py_file_paths(dag_folder,
+                                               safe_mode=False,
+                                               include_zip_files=True):
+                try:
+                    ts = datetime.now()
+                    found_dags = self.process_file(
+                        filepath, only_if_updated=only_if_updated)
+
+                    td = datetime.now() - ts
+                    td = td.total_seconds() + (
+                        float(td.microseconds) / 1000000)
+                    stats.append(FileLoadStat(
+                        filepath.replace(dag_folder, ''),
+                        td,
+                        len(found_dags),
+                        sum([len(dag.tasks) for dag in found_dags]),
+                        str([dag.dag_id for dag in found_dags]),
+                    ))
+                except Exception as e:
+                    _log.warning(e)
         Stats.gauge(
             'collect_dags', (datetime.now() - start_dttm).total_seconds(), 1)
         Stats.gauge(
@@ -677,6 +672,21 @@ class Connection(Base):
         return obj
 
 
+class SerializedDag(Base):
+    """
+    The structure of a DAG and the attributes of its tasks, as JSON, written
+    by the scheduler when it parses the DAG file so that the webserver can
+    show the DAG without importing the file. See airflow.dag.serialization.
+    """
+    __tablename__ = "serialized_dag"
+
+    dag_id = Column(String(ID_LEN), primary_key=True)
+    fileloc = Column(String(2000))
+    data = Column(LongText)
+    data_hash = Column(String(40))
+    last_updated = Column(DateTime, nullable=False)
+
+
 class DagPickle(Base):
     """
     Dags can originate from different places (user repos, master repo, ...)
@@ -736,9 +746,12 @@ class TaskInstance(Base):
     operator = Column(String(1000))
     queued_dttm = Column(DateTime)
     pid = Column(Integer)
+    # When the row was last changed, for the tree view to fetch the changes
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
     __table_args__ = (
         Index('ti_dag_state', dag_id, state),
+        Index('ti_dag_updated_at', dag_id, updated_at),
         Index('ti_state', state),
         Index('ti_state_lkp', dag_id, task_id, execution_date, state),
         Index('ti_pool', pool, state, priority_weight),
@@ -763,6 +776,8 @@ class TaskInstance(Base):
     def init_on_load(self):
         """ Initialize the attributes that aren't stored in the DB. """
         self.test_mode = False  # can be changed when calling 'run'
+        # XCom values pulled during the current run, see xcom_pull()
+        self._xcom_cache = {}
 
     def state_for_dependents(self):
         """
@@ -980,12 +995,14 @@ class TaskInstance(Base):
         """
         Clears all XCom data from the database for the task instance
         """
-        session.query(XCom).filter(
+        clause = and_(
             XCom.dag_id == self.dag_id,
             XCom.task_id == self.task_id,
-            XCom.execution_date == self.execution_date
-        ).delete()
+            XCom.execution_date == self.execution_date)
+        external_values = XCom.get_external_values(clause, session=session)
+        session.query(XCom).filter(clause).delete(synchronize_session=False)
         session.commit()
+        xcom_storage.remove(external_values)
 
     @property
     def key(self):
@@ -1158,6 +1175,23 @@ class TaskInstance(Base):
 
         return dr
 
+    @staticmethod
+    def filter_for_keys(keys):
+        """
+        Returns a filter clause matching the task instances with the given keys,
+        to act on several task instances with a single statement.
+
+        :param keys: (dag_id, task_id, execution_date) task instance keys
+        :type keys: list[tuple]
+        """
+        TI = TaskInstance
+        return or_(*[
+            and_(TI.dag_id == dag_id,
+                 TI.task_id == task_id,
+                 TI.execution_date == execution_date)
+            for dag_id, task_id, execution_date in keys])
+
+    @sql_component('task_instance.run')
     @provide_session
     def run(
             self,
@@ -1194,6 +1228,7 @@ class TaskInstance(Base):
         task = self.task
         self.pool = pool or task.pool
         self.test_mode = test_mode
+        self._xcom_cache = {}
         self.refresh_from_db(session=session, lock_for_update=True)
         self.job_id = job_id
         self.hostname = socket.getfqdn()
@@ -1562,6 +1597,9 @@ class TaskInstance(Base):
                 'execution_date is {}; received {})'.format(
                     self.execution_date, execution_date))
 
+        self._xcom_cache = dict(
+            (k, v) for k, v in self._xcom_cache.items()
+            if k[:2] != (self.dag_id, self.task_id))
         XCom.set(
             key=key,
             value=value,
@@ -1584,8 +1622,9 @@ class TaskInstance(Base):
 
         If a single task_id string is provided, the result is the value of the
         most recent matching XCom from that task_id. If multiple task_ids are
-        provided, a tuple of matching values is returned. None is returned
-        whenever no matches are found.
+        provided, a read-only sequence of matching values is returned, which
+        compares equal to the tuple of the values and only unpickles a value
+        when it is accessed. None is returned whenever no matches are found.
 
         :param key: A key for the XCom. If provided, only XComs with matching
             keys will be returned. The default key is 'return_value', also
@@ -1603,22 +1642,47 @@ class TaskInstance(Base):
             execution_date are returned. If True, XComs from previous dates
             are returned as well.
         :type include_prior_dates: bool
+
+        The XComs of several task_ids are fetched with one query, and the
+        values found are memoized until the next run of the task instance:
+        a value pulled again in the same run isn't fetched nor unpickled
+        again, and is the same object as the one pulled before. Copy a pulled
+        value before changing it, or the later pulls return the changed one.
         """
 
         if dag_id is None:
             dag_id = self.dag_id
 
-        pull_fn = functools.partial(
-            XCom.get_one,
-            execution_date=self.execution_date,
-            key=key,
-            dag_id=dag_id,
-            include_prior_dates=include_prior_dates)
-
-        if is_container(task_ids):
-            return tuple(pull_fn(task_id=t) for t in task_ids)
-        else:
-            return pull_fn(task_id=task_ids)
+        if task_ids is None:
+            return XCom.get_one(
+                execution_date=self.execution_date,
+                key=key,
+                dag_id=dag_id,
+                include_prior_dates=include_prior_dates)
+
+        single = not is_container(task_ids)
+        task_ids = [task_ids] if single else list(task_ids)
+
+        # Values found earlier in this run are memoized, the others are all
+        # fetched with one query
+        cache_keys = [(dag_id, task_id, key, include_prior_dates)
+                      for task_id in task_ids]
+        missing = [(task_id, key)
+                   for task_id, cache_key in zip(task_ids, cache_keys)
+                   if cache_key not in self._xcom_cache]
+        if missing:
+            found = XCom.get_latest_many(
+                execution_date=self.execution_date,
+                task_id_keys=missing,
+                dag_id=dag_id,
+                include_prior_dates=include_prior_dates)
+            for (task_id, _), value in found.items():
+                self._xcom_cache[
+                    (dag_id, task_id, key, include_prior_dates)] = value
+
+        values = XComValues([self._xcom_cache.get(cache_key)
+                             for cache_key in cache_keys])
+        return values[0] if single else values
 
 
 class TaskFail(Base):
@@ -2083,10 +2147,9 @@ class BaseOperator(object):
 
     @property
     def priority_weight_total(self):
-        return sum([
-            t.priority_weight
-            for t in self.get_flat_relatives(upstream=False)
-        ]) + self.priority_weight
+        if not self.has_dag():
+            return self.priority_weight
+        return self.dag.topology.priority_weight_totals[self.task_id]
 
     def pre_execute(self, context):
         """
@@ -2270,17 +2333,15 @@ class BaseOperator(object):
             TI.execution_date <= end_date,
         ).order_by(TI.execution_date).all()
 
-    def get_flat_relatives(self, upstream=False, l=None):
+    def get_flat_relatives(self, upstream=False):
         """
         Get a flat list of relatives, either upstream or downstream.
         """
-        if not l:
-            l = []
-        for t in self.get_direct_relatives(upstream):
-            if not is_in(t, l):
-                l.append(t)
-                t.get_flat_relatives(upstream, l)
-        return l
+        dag = self.dag
+        return [
+            dag.get_task(tid)
+            for tid in dag.topology.get_flat_relative_ids(
+                self.task_id, upstream=upstream)]
 
     def detect_downstream_cycle(self, task=None):
         """
@@ -2290,12 +2351,18 @@ class BaseOperator(object):
         """
         if not task:
             task = self
-        for t in self.get_direct_relatives():
-            if task is t:
-                msg = "Cycle detected in DAG. Faulty task: {0}".format(task)
-                raise AirflowException(msg)
-            else:
-                t.detect_downstream_cycle(task=task)
+        # Every task downstream from self is only visited once
+        visited = set()
+        stack = [self]
+        while stack:
+            for t in stack.pop().get_direct_relatives():
+                if task is t:
+                    msg = "Cycle detected in DAG. Faulty task: {0}".format(
+                        task)
+                    raise AirflowException(msg)
+                elif t.task_id not in visited:
+                    visited.add(t.task_id)
+                    stack.append(t)
         return False
 
     def run(
@@ -2392,6 +2459,7 @@ class BaseOperator(object):
             else:
                 self.append_only_new(self._downstream_task_ids, task.task_id)
                 task.append_only_new(task._upstream_task_ids, self.task_id)
+        dag.clear_topology()
 
         self.detect_downstream_cycle()
 
@@ -2471,6 +2539,8 @@ class DagModel(Base):
     fileloc = Column(String(2000))
     # String representing the owners
     owners = Column(String(2000))
+    # Bumped every time a task exclusion of the DAG is set or removed
+    task_exclusions_version = Column(Integer, default=0)
 
     def __repr__(self):
         return "<DAG: {self.dag_id}>".format(self=self)
@@ -2485,6 +2555,98 @@ class DagModel(Base):
         return obj
 
 
+class DagTopology(object):
+    """
+    The shape of the task graph of a DAG, computed in one pass over its tasks
+    and dependencies: the direct relatives of every task as sets, a
+    topological order, the transitive upstream and downstream relatives and
+    the total priority weights. The transitive relatives of each task are
+    kept as integers used as bitsets over the topological order, which keeps
+    them small and makes unions cheap even for DAGs with thousands of tasks.
+
+    DAG.topology builds it lazily and drops it whenever a task or a
+    dependency is added to the DAG, so it must not be kept around by callers.
+    """
+
+    def __init__(self, task_dict):
+        """
+        :param task_dict: the tasks of the DAG by task_id
+        :type task_dict: dict[unicode, BaseOperator]
+        """
+        self.upstream = {}
+        self.downstream = {}
+        for task_id, task in task_dict.items():
+            self.upstream[task_id] = set(
+                tid for tid in task._upstream_task_ids if tid in task_dict)
+            self.downstream[task_id] = set(
+                tid for tid in task._downstream_task_ids if tid in task_dict)
+
+        # Kahn's algorithm, visiting the tasks in a stable order
+        in_degree = {
+            task_id: len(ids) for task_id, ids in self.upstream.items()}
+        ready = sorted(
+            (task_id for task_id, n in in_degree.items() if n == 0),
+            reverse=True)
+        self.topological_order = []
+        while ready:
+            task_id = ready.pop()
+            self.topological_order.append(task_id)
+            for tid in sorted(self.downstream[task_id], reverse=True):
+                in_degree[tid] -= 1
+                if in_degree[tid] == 0:
+                    ready.append(tid)
+        if len(self.topological_order) != len(task_dict):
+            raise AirflowException(
+                "Cycle detected in DAG between the tasks {}".format(sorted(
+                    set(task_dict) - set(self.topological_order))))
+
+        self._bit = {
+            task_id: 1 << i
+            for i, task_id in enumerate(self.topological_order)}
+
+        self._upstream_bits = {}
+        for task_id in self.topological_order:
+            bits = 0
+            for tid in self.upstream[task_id]:
+                bits |= self._bit[tid] | self._upstream_bits[tid]
+            self._upstream_bits[task_id] = bits
+
+        self._downstream_bits = {}
+        for task_id in reversed(self.topological_order):
+            bits = 0
+            for tid in self.downstream[task_id]:
+                bits |= self._bit[tid] | self._downstream_bits[tid]
+            self._downstream_bits[task_id] = bits
+
+        # The downstream relatives are counted once per distinct weight, as
+        # DAGs rarely use more than a handful of them
+        weight_masks = defaultdict(int)
+        for task_id, task in task_dict.items():
+            weight_masks[task.priority_weight] |= self._bit[task_id]
+        self.priority_weight_totals = {}
+        for task_id, task in task_dict.items():
+            downstream_bits = self._downstream_bits[task_id]
+            self.priority_weight_totals[task_id] = task.priority_weight + sum(
+                weight * bin(downstream_bits & mask).count('1')
+                for weight, mask in weight_masks.items())
+
+        self._flat_relatives = {}
+
+    def get_flat_relative_ids(self, task_id, upstream=False):
+        """
+        Returns the task_ids of all the relatives of a task, either upstream
+        or downstream, in topological order.
+        """
+        key = (task_id, upstream)
+        if key not in self._flat_relatives:
+            bits = (self._upstream_bits if upstream
+                    else self._downstream_bits)[task_id]
+            self._flat_relatives[key] = [
+                tid for tid in self.topological_order
+                if bits & self._bit[tid]]
+        return self._flat_relatives[key]
+
+
 @functools.total_ordering
 class DAG(BaseDag, LoggingMixin):
     """
@@ -2589,6 +2751,8 @@ class DAG(BaseDag, LoggingMixin):
 
         self._description = description
         self.task_dict = dict()
+        # The DagTopology of the tasks, built when first needed
+        self._topology = None
         self.start_date = start_date
         self.end_date = end_date
         self.schedule_interval = schedule_interval
@@ -2771,6 +2935,23 @@ class DAG(BaseDag, LoggingMixin):
     def task_ids(self):
         return list(self.task_dict.keys())
 
+    @property
+    def topology(self):
+        """
+        Returns the DagTopology of the tasks, computing it again only if a
+        task or a dependency was added since it was last computed.
+        """
+        if getattr(self, '_topology', None) is None:
+            self._topology = DagTopology(self.task_dict)
+        return self._topology
+
+    def clear_topology(self):
+        """
+        Drops the cached DagTopology, to be called whenever the tasks or their
+        dependencies change.
+        """
+        self._topology = None
+
     @property
     def active_task_ids(self):
         return list(k for k, v in self.task_dict.items() if not v.adhoc)
@@ -3037,11 +3218,12 @@ class DAG(BaseDag, LoggingMixin):
         result = cls.__new__(cls)
         memo[id(self)] = result
         for k, v in list(self.__dict__.items()):
-            if k not in ('user_defined_macros', 'params'):
+            if k not in ('user_defined_macros', 'params', '_topology'):
                 setattr(result, k, copy.deepcopy(v, memo))
 
         result.user_defined_macros = self.user_defined_macros
         result.params = self.params
+        result._topology = None
         return result
 
     def sub_dag(self, task_regex, include_downstream=False,
@@ -3054,24 +3236,29 @@ class DAG(BaseDag, LoggingMixin):
 
         dag = copy.deepcopy(self)
 
-        regex_match = [
-            t for t in dag.tasks if re.findall(task_regex, t.task_id)]
-        also_include = []
-        for t in regex_match:
+        topology = dag.topology
+        task_ids = set(
+            t.task_id for t in dag.tasks if re.findall(task_regex, t.task_id))
+        for task_id in list(task_ids):
             if include_downstream:
-                also_include += t.get_flat_relatives(upstream=False)
+                task_ids.update(topology.get_flat_relative_ids(
+                    task_id, upstream=False))
             if include_upstream:
-                also_include += t.get_flat_relatives(upstream=True)
+                task_ids.update(topology.get_flat_relative_ids(
+                    task_id, upstream=True))
 
         # Compiling the unique list of tasks that made the cut
-        dag.task_dict = {t.task_id: t for t in regex_match + also_include}
+        dag.task_dict = {
+            task_id: t for task_id, t in dag.task_dict.items()
+            if task_id in task_ids}
         for t in dag.tasks:
             # Removing upstream/downstream references to tasks that did not
             # made the cut
             t._upstream_task_ids = [
-                tid for tid in t._upstream_task_ids if tid in dag.task_ids]
+                tid for tid in t._upstream_task_ids if tid in task_ids]
             t._downstream_task_ids = [
-                tid for tid in t._downstream_task_ids if tid in dag.task_ids]
+                tid for tid in t._downstream_task_ids if tid in task_ids]
+        dag.clear_topology()
         return dag
 
     def has_task(self, task_id):
@@ -3151,6 +3338,7 @@ class DAG(BaseDag, LoggingMixin):
             self.tasks.append(task)
             self.task_dict[task.task_id] = task
             task.dag = self
+            self.clear_topology()
 
         self.task_count = len(self.tasks)
 
@@ -3400,6 +3588,50 @@ class KnownEvent(Base):
         return self.label
 
 
+class ConfigVersion(Base):
+    """
+    A counter bumped whenever Variables or Connections change, for the
+    processes caching them to know when to drop their caches.
+    """
+    __tablename__ = "config_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+    @staticmethod
+    @provide_session
+    def get(session=None):
+        row = (
+            session.query(ConfigVersion.version)
+            .filter(ConfigVersion.id == 1)
+            .first())
+        return row.version if row else 0
+
+    @staticmethod
+    @provide_session
+    def bump(session=None):
+        updated = (
+            session.query(ConfigVersion)
+            .filter(ConfigVersion.id == 1)
+            .update({ConfigVersion.version: ConfigVersion.version + 1},
+                    synchronize_session=False))
+        if not updated:
+            session.add(ConfigVersion(id=1, version=1))
+        session.flush()
+
+    @staticmethod
+    def get_cache(name):
+        """
+        :return: a LookupCache that is dropped when the version is bumped if
+        [core] lookup_cache_version_check is set
+        :rtype: LookupCache
+        """
+        get_version = None
+        if configuration.getboolean('core', 'lookup_cache_version_check'):
+            get_version = ConfigVersion.get
+        return LookupCache(name, get_version=get_version)
+
+
 class Variable(Base):
     __tablename__ = "variable"
 
@@ -3408,6 +3640,9 @@ class Variable(Base):
     _val = Column('val', Text)
     is_encrypted = Column(Boolean, unique=False, default=False)
 
+    # The values looked up by get(), as (whether it exists, value) by key
+    _cache = ConfigVersion.get_cache('Variables')
+
     def __repr__(self):
         # Hiding the value
         return '{} : {}'.format(self.key, self._val)
@@ -3468,18 +3703,30 @@ class Variable(Base):
 
     @classmethod
     @provide_session
-    def get(cls, key, default_var=None, deserialize_json=False, session=None):
+    def _get_val(cls, key, session=None):
+        """
+        :return: whether the Variable exists, and its value
+        :rtype: tuple
+        """
         obj = session.query(cls).filter(cls.key == key).first()
         if obj is None:
+            return False, None
+        return True, obj.val
+
+    @classmethod
+    def get(cls, key, default_var=None, deserialize_json=False, session=None):
+        exists, val = cls._cache.get(
+            key, lambda: cls._get_val(key, session=session))
+        if not exists:
             if default_var is not None:
                 return default_var
             else:
                 raise KeyError('Variable {} does not exist'.format(key))
         else:
             if deserialize_json:
-                return json.loads(obj.val)
+                return json.loads(val)
             else:
-                return obj.val
+                return val
 
     @classmethod
     @provide_session
@@ -3492,7 +3739,65 @@ class Variable(Base):
 
         session.query(cls).filter(cls.key == key).delete()
         session.add(Variable(key=key, val=stored_value))
-        session.flush()
+        ConfigVersion.bump(session=session)
+        cls._cache.invalidate(key)
+
+
+class LazyXComValue(object):
+    """
+    An XCom value that is unpickled the first time it is accessed.
+    """
+    def __init__(self, pickled_value):
+        self._pickled_value = pickled_value
+        self._value = None
+        self._loaded = False
+
+    def get(self):
+        if not self._loaded:
+            if self._pickled_value is not None:
+                self._value = xcom_storage.resolve(
+                    dill.loads(self._pickled_value))
+            self._pickled_value = None
+            self._loaded = True
+        return self._value
+
+
+class XComValues(Sequence):
+    """
+    The values pulled from several tasks, as a read-only sequence that
+    unpickles each value the first time it is accessed. It compares equal to
+    the tuple of the values.
+    """
+    def __init__(self, lazy_values):
+        """
+        :param lazy_values: the values, None where there is no XCom
+        :type lazy_values: list[LazyXComValue]
+        """
+        self._lazy_values = lazy_values
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return XComValues(self._lazy_values[index])
+        lazy_value = self._lazy_values[index]
+        return lazy_value.get() if lazy_value is not None else None
+
+    def __len__(self):
+        return len(self._lazy_values)
+
+    def __eq__(self, other):
+        if isinstance(other, (XComValues, tuple)):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return repr(tuple(self))
 
 
 class XCom(Base):
@@ -3503,7 +3808,7 @@ class XCom(Base):
 
     id = Column(Integer, primary_key=True)
     key = Column(String(512))
-    value = Column(PickleType(pickler=dill))
+    value = Column(PickleType(pickler=xcom_storage.XComPickler))
     timestamp = Column(
         DateTime, default=func.now(), nullable=False)
     execution_date = Column(DateTime, nullable=False)
@@ -3536,21 +3841,51 @@ class XCom(Base):
         Store an XCom value.
         """
         session.expunge_all()
-
-        # remove any duplicate XComs
-        session.query(cls).filter(
-            cls.key == key,
-            cls.execution_date == execution_date,
-            cls.task_id == task_id,
-            cls.dag_id == dag_id).delete()
-
-        # insert new XCom
-        session.add(XCom(
+        cls.set_many([dict(
             key=key,
             value=value,
             execution_date=execution_date,
             task_id=task_id,
-            dag_id=dag_id))
+            dag_id=dag_id)], session=session)
+
+    @classmethod
+    @provide_session
+    def set_many(cls, xcoms, session=None):
+        """
+        Store several XCom values with one DELETE and one bulk INSERT. The
+        values that are too large are written to the [core] xcom_storage.
+
+        :param xcoms: the XComs to store, as dicts with the key, value,
+            execution_date, task_id and dag_id of each one
+        :type xcoms: list[dict]
+        """
+        if not xcoms:
+            return
+
+        # remove any duplicate XComs, and the values they have in the XCom
+        # storage before the new values are written there
+        clause = or_(*[
+            and_(cls.key == xcom['key'],
+                 cls.execution_date == xcom['execution_date'],
+                 cls.task_id == xcom['task_id'],
+                 cls.dag_id == xcom['dag_id'])
+            for xcom in xcoms])
+        external_values = cls.get_external_values(clause, session=session)
+        session.query(cls).filter(clause).delete(synchronize_session=False)
+        xcom_storage.remove(external_values)
+
+        # insert the new XComs
+        session.bulk_insert_mappings(cls, [dict(
+            key=xcom['key'],
+            value=xcom_storage.externalize(
+                xcom['value'],
+                dag_id=xcom['dag_id'],
+                task_id=xcom['task_id'],
+                execution_date=xcom['execution_date'],
+                key=xcom['key']),
+            execution_date=xcom['execution_date'],
+            task_id=xcom['task_id'],
+            dag_id=xcom['dag_id']) for xcom in xcoms])
 
         session.commit()
 
@@ -3587,7 +3922,7 @@ class XCom(Base):
 
         result = query.first()
         if result:
-            return result.value
+            return xcom_storage.resolve(result.value)
 
     @classmethod
     @provide_session
@@ -3602,6 +3937,9 @@ class XCom(Base):
             session=None):
         """
         Retrieve an XCom value, optionally meeting certain criteria
+
+        The values written to the XCom storage are left as ExternalXComValue
+        references, use xcom_storage.resolve() to load them.
         """
         filters = []
         if key:
@@ -3623,18 +3961,110 @@ class XCom(Base):
 
         return query.all()
 
+    @classmethod
+    @provide_session
+    def get_latest_many(
+            cls,
+            execution_date,
+            task_id_keys,
+            dag_id,
+            include_prior_dates=False,
+            session=None):
+        """
+        Retrieve the most recent XCom of each of several (task_id, key)
+        pairs with one query. A key of None matches any key, like in
+        get_one(). With include_prior_dates, only the XComs of the latest
+        execution date of each (task_id, key) are scanned.
+
+        The values are not unpickled until they are accessed, so that the
+        callers only pay for the values that they use.
+
+        :param task_id_keys: the (task_id, key) pairs to retrieve
+        :type task_id_keys: list[tuple]
+        :return: a LazyXComValue for each pair that has an XCom
+        :rtype: dict[tuple, LazyXComValue]
+        """
+        task_id_keys = list(task_id_keys)
+        if not task_id_keys:
+            return {}
+
+        filters = [
+            cls.dag_id == dag_id,
+            cls.task_id.in_(set(task_id for task_id, _ in task_id_keys)),
+        ]
+        keys = set(key for _, key in task_id_keys)
+        if None not in keys:
+            filters.append(cls.key.in_(keys))
+        # Select the pickled bytes so that they are only unpickled on access
+        query = session.query(
+            cls.task_id,
+            cls.key,
+            type_coerce(cls.value, LargeBinary).label('value'))
+        if include_prior_dates:
+            # Join the XComs with the latest execution date of each
+            # (task_id, key) rather than scanning the whole history
+            filters.append(cls.execution_date <= execution_date)
+            latest = (
+                session.query(
+                    cls.task_id,
+                    cls.key,
+                    func.max(cls.execution_date).label('execution_date'))
+                .filter(and_(*filters))
+                .group_by(cls.task_id, cls.key)
+                .subquery())
+            query = query.join(latest, and_(
+                cls.task_id == latest.c.task_id,
+                cls.key == latest.c.key,
+                cls.execution_date == latest.c.execution_date))
+            filters = [cls.dag_id == dag_id]
+        else:
+            filters.append(cls.execution_date == execution_date)
+        query = (
+            query
+            .filter(and_(*filters))
+            .order_by(cls.execution_date.desc(), cls.timestamp.desc()))
+
+        wanted = set(task_id_keys)
+        results = {}
+        for task_id, key, value in query:
+            for task_id_key in ((task_id, key), (task_id, None)):
+                if task_id_key in wanted and task_id_key not in results:
+                    results[task_id_key] = LazyXComValue(value)
+            if len(results) == len(wanted):
+                break
+        return results
+
+    @classmethod
+    @provide_session
+    def get_external_values(cls, clause, session=None):
+        """
+        :param clause: the filter of the XComs
+        :return: the ExternalXComValues of the matching XComs, to remove from
+            the XCom storage when the XComs are deleted. Empty when no XCom
+            storage is configured.
+        :rtype: list[ExternalXComValue]
+        """
+        if not configuration.get('core', 'xcom_storage'):
+            return []
+        return [
+            value for value, in session.query(cls.value).filter(clause)
+            if isinstance(value, xcom_storage.ExternalXComValue)]
+
     @classmethod
     @provide_session
     def delete(cls, xcoms, session=None):
         if isinstance(xcoms, XCom):
             xcoms = [xcoms]
+        values = []
         for xcom in xcoms:
             if not isinstance(xcom, XCom):
                 raise TypeError(
                     'Expected XCom; received {}'.format(xcom.__class__.__name__)
                 )
+            values.append(xcom.value)
             session.delete(xcom)
         session.commit()
+        xcom_storage.remove(values)
 
 
 class DagStat(Base):
@@ -3693,6 +4123,158 @@ class DagStat(Base):
         session.commit()
 
 
+class TaskStat(Base):
+    """
+    The number of task instances in each state of the running DAG runs of a
+    DAG, or of its latest DAG run if none is running, for the home page.
+
+    The counts of a DAG are updated when its task instances changed since
+    they were counted (as told by their updated_at), or when the state of
+    one of its DAG runs changed.
+    """
+    __tablename__ = "task_stats"
+
+    # The task instances can be changed after they were counted with an
+    # updated_at up to this much earlier than the time they were counted at,
+    # as each writer stamps updated_at with its own clock and some databases
+    # (e.g. MySQL) only keep seconds. Like the tree view's
+    # TREE_CHANGES_OVERLAP, the DAGs are counted again while their latest
+    # updated_at is within this overlap.
+    UPDATED_AT_OVERLAP = timedelta(minutes=1)
+
+    dag_id = Column(String(ID_LEN), primary_key=True)
+    state = Column(String(50), primary_key=True)
+    count = Column(Integer, default=0)
+    # The latest updated_at of the DAG's task instances when they were counted,
+    # or the counting time minus UPDATED_AT_OVERLAP if that is earlier
+    ti_updated_at = Column(DateTime)
+    dirty = Column(Boolean, default=False)
+
+    def __init__(self, dag_id, state, count, ti_updated_at=None, dirty=False):
+        self.dag_id = dag_id
+        self.state = state
+        self.count = count
+        self.ti_updated_at = ti_updated_at
+        self.dirty = dirty
+
+    @staticmethod
+    @provide_session
+    def set_dirty(dag_id, session=None):
+        session.query(TaskStat).filter(TaskStat.dag_id == dag_id).update(
+            {TaskStat.dirty: True}, synchronize_session=False)
+        session.commit()
+
+    @staticmethod
+    @provide_session
+    def update(dags, session=None):
+        """
+        Counts the task instances of the DAGs whose counts are out of date.
+
+        :param dags: the DAGs, whose task instances of tasks that aren't in
+            the DAG anymore are not counted
+        :type dags: list[DAG]
+        :return: the IDs of the DAGs that were counted again
+        :rtype: set
+        """
+        dags = dict((dag.dag_id, dag) for dag in dags)
+        if not dags:
+            return set()
+        TI = TaskInstance
+
+        count_time = datetime.now()
+        ti_updated_at = dict(
+            session.query(TI.dag_id, func.max(TI.updated_at))
+            .filter(TI.dag_id.in_(dags.keys()))
+            .group_by(TI.dag_id))
+        counted_ids = set()
+        stale_ids = set()
+        qry = (
+            session.query(
+                TaskStat.dag_id, TaskStat.ti_updated_at, TaskStat.dirty)
+            .filter(TaskStat.dag_id.in_(dags.keys())))
+        for dag_id, updated_at, dirty in qry:
+            counted_ids.add(dag_id)
+            latest_updated_at = ti_updated_at.get(dag_id)
+            if dirty or (latest_updated_at is not None and
+                         (updated_at is None or
+                          latest_updated_at > updated_at)):
+                stale_ids.add(dag_id)
+        stale_ids |= set(dags) - counted_ids
+        if not stale_ids:
+            return stale_ids
+
+        LastDagRun = (
+            session.query(
+                DagRun.dag_id,
+                func.max(DagRun.execution_date).label('execution_date'))
+            .filter(DagRun.state != State.RUNNING)
+            .filter(DagRun.dag_id.in_(stale_ids))
+            .group_by(DagRun.dag_id)
+            .subquery('last_dag_run')
+        )
+        RunningDagRun = (
+            session.query(DagRun.dag_id, DagRun.execution_date)
+            .filter(DagRun.state == State.RUNNING)
+            .filter(DagRun.dag_id.in_(stale_ids))
+            .subquery('running_dag_run')
+        )
+
+        # Select all task_instances from active dag_runs.
+        # If no dag_run is active, use task instances from most recent dag_run.
+        LastTI = (
+            session.query(
+                TI.dag_id.label('dag_id'), TI.task_id.label('task_id'),
+                TI.state.label('state'))
+            .join(LastDagRun, and_(
+                LastDagRun.c.dag_id == TI.dag_id,
+                LastDagRun.c.execution_date == TI.execution_date))
+        )
+        RunningTI = (
+            session.query(
+                TI.dag_id.label('dag_id'), TI.task_id.label('task_id'),
+                TI.state.label('state'))
+            .join(RunningDagRun, and_(
+                RunningDagRun.c.dag_id == TI.dag_id,
+                RunningDagRun.c.execution_date == TI.execution_date))
+        )
+        UnionTI = union_all(LastTI, RunningTI).alias('union_ti')
+        qry = (
+            session.query(
+                UnionTI.c.dag_id, UnionTI.c.task_id, UnionTI.c.state,
+                func.count())
+            .group_by(UnionTI.c.dag_id, UnionTI.c.task_id, UnionTI.c.state)
+        )
+
+        # The tasks are filtered here rather than with an IN clause of all
+        # their IDs
+        counts = defaultdict(int)
+        for dag_id, task_id, state, count in qry:
+            if task_id in dags[dag_id].task_dict:
+                counts[(dag_id, state)] += count
+
+        watermarks = {}
+        for dag_id in stale_ids:
+            watermark = ti_updated_at.get(dag_id)
+            if watermark is not None:
+                watermark = min(watermark,
+                                count_time - TaskStat.UPDATED_AT_OVERLAP)
+            watermarks[dag_id] = watermark
+
+        session.query(TaskStat).filter(
+            TaskStat.dag_id.in_(stale_ids)).delete(synchronize_session=False)
+        # A row for every state, so that the DAGs without task instances
+        # are known to be counted
+        session.bulk_insert_mappings(TaskStat, [{
+            'dag_id': dag_id,
+            'state': state,
+            'count': counts[(dag_id, state)],
+            'ti_updated_at': watermarks[dag_id],
+            'dirty': False,
+        } for dag_id in stale_ids for state in State.task_states])
+        session.commit()
+        return stale_ids
+
+
 class DagRun(Base):
     """
     DagRun describes an instance of a Dag. It can be created
@@ -3737,6 +4319,7 @@ class DagRun(Base):
             self._state = state
             session = settings.Session()
             DagStat.set_dirty(self.dag_id, session=session)
+            TaskStat.set_dirty(self.dag_id, session=session)
 
     @declared_attr
     def state(self):
@@ -3887,13 +4470,18 @@ class DagRun(Base):
         none_depends_on_past = all(not t.task.depends_on_past for t in unfinished_tasks)
         # small speed up
         if unfinished_tasks and none_depends_on_past:
-            # todo: this can actually get pretty slow: one task costs between 0.01-015s
-            no_dependencies_met = all(not t.are_dependencies_met(session=session)
-                                      for t in unfinished_tasks)
+            # evaluate the trigger rules against the task instances loaded above
+            # rather than with one query per unfinished task
+            dep_context = DepContext(
+                dagrun_ti_states=DagRunTIStates.from_task_instances(
+                    self.dag_id, self.execution_date, tis))
+            no_dependencies_met = all(
+                not t.are_dependencies_met(dep_context=dep_context, session=session)
+                for t in unfinished_tasks)
 
         duration = (datetime.now() - start_dttm).total_seconds() * 1000
-        Stats.timing("dagrun.dependency-check.{}.{}".
-                     format(self.dag_id, self.execution_date), duration)
+        Stats.timing("dagrun.dependency-check.{}".format(self.dag_id),
+                     duration)
 
         # future: remove the check on adhoc tasks (=active_tasks)
         if len(tis) == len(dag.active_tasks):
@@ -3934,27 +4522,40 @@ class DagRun(Base):
         Verifies the DagRun by checking for removed tasks or tasks that are not in the
         database yet. It will set state to removed or add the task if required.
         """
+        TI = TaskInstance
         dag = self.get_dag()
-        tis = self.get_task_instances(session=session)
+        task_ids = set(
+            task_id for task_id, in session.query(TI.task_id).filter(
+                TI.dag_id == self.dag_id,
+                TI.execution_date == self.execution_date,
+            ))
 
         # check for removed tasks
-        task_ids = []
-        for ti in tis:
-            task_ids.append(ti.task_id)
-            try:
-                dag.get_task(ti.task_id)
-            except AirflowException:
-                if self.state is not State.RUNNING:
-                    ti.state = State.REMOVED
-
-        # check for missing tasks
-        for task in dag.tasks:
-            if task.adhoc:
-                continue
-
-            if task.task_id not in task_ids:
-                ti = TaskInstance(task, self.execution_date)
-                session.add(ti)
+        removed_task_ids = task_ids - set(dag.task_dict)
+        if removed_task_ids and self.state is not State.RUNNING:
+            session.query(TI).filter(
+                TI.dag_id == self.dag_id,
+                TI.execution_date == self.execution_date,
+                TI.task_id.in_(removed_task_ids),
+            ).update({TI.state: State.REMOVED}, synchronize_session=False)
+
+        # check for missing tasks, inserted with a single executemany
+        missing_tasks = [
+            task for task_id, task in dag.task_dict.items()
+            if not task.adhoc and task_id not in task_ids]
+        if missing_tasks:
+            unixname = getpass.getuser()
+            session.bulk_insert_mappings(TI, [{
+                'dag_id': self.dag_id,
+                'task_id': task.task_id,
+                'execution_date': self.execution_date,
+                'queue': task.queue,
+                'pool': task.pool,
+                'priority_weight': task.priority_weight_total,
+                'try_number': 0,
+                'unixname': unixname,
+                'hostname': '',
+            } for task in missing_tasks])
 
         session.commit()
 
@@ -3978,6 +4579,66 @@ class DagRun(Base):
         )
         return qry.scalar()
 
+    @staticmethod
+    def get_running_tasks_per_dag(session, dag_id_to_task_ids):
+        """
+        Returns the number of tasks running in each of the given DAGs using a
+        single query.
+
+        :param session: ORM session
+        :param dag_id_to_task_ids: the valid task IDs of each DAG to get the task
+        concurrency of
+        :type dag_id_to_task_ids: dict[unicode, list[unicode]]
+        :return: The number of running tasks of each DAG
+        :rtype: dict[unicode, int]
+        """
+        TI = TaskInstance
+        dag_id_to_task_ids = {dag_id: set(task_ids)
+                              for dag_id, task_ids in dag_id_to_task_ids.items()}
+        running_task_counts = {dag_id: 0 for dag_id in dag_id_to_task_ids}
+        if not dag_id_to_task_ids:
+            return running_task_counts
+
+        qry = (
+            session
+            .query(TI.dag_id, TI.task_id, func.count(TI.task_id))
+            .filter(
+                TI.dag_id.in_(list(dag_id_to_task_ids.keys())),
+                TI.state == State.RUNNING,
+            )
+            .group_by(TI.dag_id, TI.task_id)
+        )
+        for dag_id, task_id, count in qry:
+            if task_id in dag_id_to_task_ids[dag_id]:
+                running_task_counts[dag_id] += count
+        return running_task_counts
+
+    @staticmethod
+    def get_runs_for_task_instances(session, task_instances):
+        """
+        Loads the DagRuns of the given task instances using a single query.
+
+        :param session: ORM session
+        :param task_instances: the task instances to get the DagRuns of
+        :type task_instances: list[TaskInstance]
+        :return: the DagRun of each (dag_id, execution_date) that has one
+        :rtype: dict[tuple, DagRun]
+        """
+        keys = {(ti.dag_id, ti.execution_date) for ti in task_instances}
+        if not keys:
+            return {}
+
+        qry = session.query(DagRun).filter(
+            DagRun.dag_id.in_(list({dag_id for dag_id, _ in keys})),
+            DagRun.execution_date.in_(list({dttm for _, dttm in keys})),
+        )
+        dag_runs = {}
+        for dag_run in qry:
+            key = (dag_run.dag_id, dag_run.execution_date)
+            if key in keys and key not in dag_runs:
+                dag_runs[key] = dag_run
+        return dag_runs
+
     @staticmethod
     def get_run(session, dag_id, execution_date):
         """
@@ -4051,6 +4712,27 @@ class Pool(Base):
         queued_slots = self.queued_slots(session=session)
         return self.slots - used_slots - queued_slots
 
+    @staticmethod
+    @provide_session
+    def get_open_slots_by_pool(session=None):
+        """
+        Returns the number of slots open at the moment in every pool, counting
+        the running and queued task instances of all the pools in one query
+        """
+        TI = TaskInstance
+        open_slots = {p.pool: p.slots for p in session.query(Pool).all()}
+
+        qry = (
+            session
+            .query(TI.pool, TI.state, func.count(TI.task_id))
+            .filter(TI.state.in_([State.RUNNING, State.QUEUED]))
+            .group_by(TI.pool, TI.state)
+        )
+        for pool, _, count in qry:
+            if pool in open_slots:
+                open_slots[pool] -= count
+        return open_slots
+
 
 class SlaMiss(Base):
     """
@@ -4195,6 +4877,7 @@ class TaskExclusion(Base):
             created_by=created_by,
             created_on=datetime.now())
         )
+        cls._bump_version(dag_id, session=session)
 
         session.commit()
 
@@ -4258,9 +4941,22 @@ class TaskExclusion(Base):
             cls.exclusion_start_date == exclusion_start_date,
             cls.exclusion_end_date == exclusion_end_date
         ).delete()
+        cls._bump_version(dag_id, session=session)
 
         session.commit()
 
+    @staticmethod
+    def _bump_version(dag_id, session):
+        """
+        Increments the task exclusions version of the given DAG so that the
+        TaskExclusionIndex instances built for it are reloaded.
+        """
+        DM = DagModel
+        session.query(DM).filter(DM.dag_id == dag_id).update(
+            {DM.task_exclusions_version:
+                func.coalesce(DM.task_exclusions_version, 0) + 1},
+            synchronize_session=False)
+
     @classmethod
     @provide_session
     def should_exclude_task(
@@ -4323,3 +5019,111 @@ class TaskExclusion(Base):
         # No exclusion has been found, so return False.
         return False
 
+
+
+class TaskExclusionIndex(object):
+    """
+    An in-memory index of all the task exclusions of a DAG, loaded with a
+    single query. It answers the same question as
+    TaskExclusion.should_exclude_task without touching the database, which
+    makes it suitable for checking every task instance of a scheduling pass.
+
+    The dated exclusions of each task are merged into sorted, non overlapping
+    intervals that are searched with a bisection. Indexes are cached per DAG
+    and reloaded when the task_exclusions_version of the DAG changes, which
+    TaskExclusion.set and TaskExclusion.remove take care of.
+    """
+
+    # dag_id -> TaskExclusionIndex, shared by the scheduling passes of a process
+    _cache = {}
+
+    def __init__(self, dag_id, version, exclusions):
+        """
+        :param dag_id: The dag_id of the DAG the exclusions belong to.
+        :param version: The task_exclusions_version of the DAG the exclusions
+         were loaded at.
+        :param exclusions: (task_id, exclusion_type, exclusion_start_date,
+         exclusion_end_date) tuples for all the exclusions of the DAG.
+        """
+        self.dag_id = dag_id
+        self.version = version
+        self._indefinite = set()
+        self._intervals = {}
+
+        intervals = defaultdict(list)
+        for task_id, exclusion_type, start_date, end_date in exclusions:
+            if exclusion_type == TaskExclusionType.INDEFINITE:
+                self._indefinite.add(task_id)
+            elif exclusion_type == TaskExclusionType.SINGLE_DATE:
+                intervals[task_id].append((start_date, start_date))
+            elif exclusion_type == TaskExclusionType.DATE_RANGE:
+                intervals[task_id].append((start_date, end_date))
+
+        for task_id, task_intervals in intervals.items():
+            starts = []
+            ends = []
+            for start_date, end_date in sorted(task_intervals):
+                if ends and start_date <= ends[-1]:
+                    ends[-1] = max(ends[-1], end_date)
+                else:
+                    starts.append(start_date)
+                    ends.append(end_date)
+            self._intervals[task_id] = (starts, ends)
+
+    def should_exclude_task(self, task_id, execution_date):
+        """
+        Identify whether any exclusions exist that apply to the given task for
+        the given execution date.
+        :param task_id: The task_id of the task instance to check for
+         exclusions for.
+        :param execution_date: The execution_date of the task instance to check
+         for exclusions for.
+        :return: True if an exclusion exists for the given task instance. False
+         otherwise.
+        """
+        if task_id in self._indefinite:
+            return True
+
+        if task_id not in self._intervals:
+            return False
+
+        starts, ends = self._intervals[task_id]
+        i = bisect.bisect_right(starts, execution_date) - 1
+        return i >= 0 and execution_date <= ends[i]
+
+    @classmethod
+    @provide_session
+    def get(cls, dag_id, session=None):
+        """
+        Returns the exclusion index of the given DAG, reloading it from the
+        database only if its exclusions changed since it was last loaded.
+        :param dag_id: The dag_id of the DAG to get the exclusion index of.
+        :return: TaskExclusionIndex
+        """
+        version = (
+            session
+            .query(func.coalesce(DagModel.task_exclusions_version, 0))
+            .filter(DagModel.dag_id == dag_id)
+            .scalar()
+        )
+
+        index = cls._cache.get(dag_id)
+        if index is not None and version is not None and index.version == version:
+            return index
+
+        TE = TaskExclusion
+        exclusions = (
+            session
+            .query(TE.task_id,
+                   TE.exclusion_type,
+                   TE.exclusion_start_date,
+                   TE.exclusion_end_date)
+            .filter(TE.dag_id == dag_id)
+            .all()
+        )
+        index = cls(dag_id, version, exclusions)
+        # Without a version there is nothing to tell when to reload, so the
+        # index of a DAG that isn't in the dag table yet is never cached.
+        if version is not None:
+            cls._cache[dag_id] = index
+        return index
@@ -11,6 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import airflow
 from airflow.ti_deps.deps.dag_ti_slots_available_dep import DagTISlotsAvailableDep
 from airflow.ti_deps.deps.dag_unpaused_dep import DagUnpausedDep
 from airflow.ti_deps.deps.dagrun_exists_dep import DagrunRunningDep
@@ -19,6 +20,7 @@ from airflow.ti_deps.deps.not_running_dep import NotRunningDep
 from airflow.ti_deps.deps.not_skipped_dep import NotSkippedDep
 from airflow.ti_deps.deps.runnable_exec_date_dep import RunnableExecDateDep
 from airflow.ti_deps.deps.valid_state_dep import ValidStateDep
+from airflow.utils.db import provide_session
 from airflow.utils.state import State
 
 
@@ -54,6 +56,11 @@ class DepContext(object):
     :type ignore_task_deps: boolean
     :param ignore_ti_state: Ignore the task instance's previous failure/success
     :type ignore_ti_state: boolean
+    :param dagrun_ti_states: A snapshot of the states of the task instances of the
+        DagRun being evaluated. When set, dependencies that look at the other task
+        instances of the run (e.g. trigger rules) are evaluated against it instead of
+        querying the database for every task instance.
+    :type dagrun_ti_states: DagRunTIStates
     """
     def __init__(
             self,
@@ -62,13 +69,116 @@ class DepContext(object):
             ignore_all_deps=False,
             ignore_depends_on_past=False,
             ignore_task_deps=False,
-            ignore_ti_state=False):
+            ignore_ti_state=False,
+            dagrun_ti_states=None):
         self.deps = deps or set()
         self.flag_upstream_failed = flag_upstream_failed
         self.ignore_all_deps = ignore_all_deps
         self.ignore_depends_on_past = ignore_depends_on_past
         self.ignore_task_deps = ignore_task_deps
         self.ignore_ti_state = ignore_ti_state
+        self.dagrun_ti_states = dagrun_ti_states
+
+
+class DagRunTIStates(object):
+    """
+    An in-memory snapshot of the states of all the task instances of a single DagRun,
+    keyed by task_id. It allows the dependencies of every task instance in the run to
+    be evaluated against one query instead of one aggregate query per task instance.
+
+    The snapshot is kept up to date by the dependencies that change the state of a task
+    instance while being evaluated (see DepContext.flag_upstream_failed), so that the
+    downstream task instances evaluated afterwards in the same pass see the new state.
+
+    :param dag_id: the dag_id of the DagRun
+    :type dag_id: unicode
+    :param execution_date: the execution date of the DagRun
+    :type execution_date: datetime
+    :param states: the state of each task instance of the DagRun, keyed by task_id
+    :type states: dict[unicode, unicode]
+    """
+    def __init__(self, dag_id, execution_date, states):
+        self.dag_id = dag_id
+        self.execution_date = execution_date
+        self.states = dict(states)
+
+    @classmethod
+    @provide_session
+    def load(cls, dag_id, execution_date, session=None):
+        """
+        Loads the states of all the task instances of a DagRun with a single query.
+
+        :param dag_id: the dag_id of the DagRun
+        :type dag_id: unicode
+        :param execution_date: the execution date of the DagRun
+        :type execution_date: datetime
+        :param session: database session
+        :type session: Session
+        :rtype: DagRunTIStates
+        """
+        TI = airflow.models.TaskInstance
+        rows = (
+            session
+            .query(TI.task_id, TI.state)
+            .filter(
+                TI.dag_id == dag_id,
+                TI.execution_date == execution_date,
+            )
+            .all()
+        )
+        return cls(dag_id, execution_date, rows)
+
+    @classmethod
+    def from_task_instances(cls, dag_id, execution_date, tis):
+        """
+        Builds a snapshot from task instances that have already been loaded.
+
+        :param tis: all the task instances of the DagRun
+        :type tis: list[TaskInstance]
+        :rtype: DagRunTIStates
+        """
+        return cls(dag_id, execution_date, ((ti.task_id, ti.state) for ti in tis))
+
+    def covers(self, ti):
+        """
+        Returns whether the given task instance belongs to the DagRun of this snapshot.
+        """
+        return (ti.dag_id == self.dag_id and
+                ti.execution_date == self.execution_date)
+
+    def get_state(self, task_id):
+        return self.states.get(task_id)
+
+    def set_state(self, task_id, state):
+        self.states[task_id] = state
+
+    def count_states(self, task_ids):
+        """
+        Counts the states of the given task instances in the same buckets as the
+        trigger rule aggregate query.
+
+        :param task_ids: the task ids to count the states of
+        :type task_ids: list[unicode]
+        :return: the number of successes, excluded, skipped, failed, upstream_failed
+            and done task instances
+        :rtype: tuple(int)
+        """
+        successes = excluded = skipped = failed = upstream_failed = 0
+        for task_id in set(task_ids):
+            state = self.states.get(task_id)
+            if state == State.SUCCESS:
+                successes += 1
+            elif state == State.EXCLUDED:
+                excluded += 1
+            elif state == State.SKIPPED:
+                skipped += 1
+            elif state == State.FAILED:
+                failed += 1
+            elif state == State.UPSTREAM_FAILED:
+                upstream_failed += 1
+        done = successes + excluded + skipped + failed + upstream_failed
+        return successes, excluded, skipped, failed, upstream_failed, done
+
 
 # In order to be able to get queued a task must have one of these states
 QUEUEABLE_STATES = {
@@ -30,7 +30,6 @@ class TriggerRuleDep(BaseTIDep):
 
     @provide_session
     def _get_dep_statuses(self, ti, session, dep_context):
-        TI = airflow.models.TaskInstance
         TR = airflow.models.TriggerRule
 
         # Checking that all upstream dependencies have succeeded
@@ -43,9 +42,53 @@ class TriggerRuleDep(BaseTIDep):
             yield self._passing_status(reason="The task had a dummy trigger rule set.")
             raise StopIteration
 
-        # TODO(unknown): this query becomes quite expensive with dags that have many
-        # tasks. It should be refactored to let the task report to the dag run and get the
-        # aggregates from there.
+        dagrun_ti_states = dep_context.dagrun_ti_states
+        if dagrun_ti_states is not None and dagrun_ti_states.covers(ti):
+            successes, excluded, skipped, failed, upstream_failed, done = (
+                dagrun_ti_states.count_states(ti.task.upstream_task_ids))
+        else:
+            dagrun_ti_states = None
+            successes, excluded, skipped, failed, upstream_failed, done = (
+                self._get_upstream_state_counts(ti, session))
+
+        # Add excluded tasks into successful tasks as they are equivalent for
+        # dependency purposes. This is done in this way, not using the
+        # state_for_dependents function, due to the constraints of SQLAlchemy
+        # queries.
+        successes = successes + excluded
+
+        dep_statuses = list(self._evaluate_trigger_rule(
+            ti=ti,
+            successes=successes,
+            skipped=skipped,
+            failed=failed,
+            upstream_failed=upstream_failed,
+            done=done,
+            flag_upstream_failed=dep_context.flag_upstream_failed,
+            session=session))
+
+        # Keep the snapshot in line with the state flag_upstream_failed may have set,
+        # so that the downstream task instances are evaluated against it. This has to
+        # happen before yielding as callers stop iterating at the first failure.
+        if dagrun_ti_states is not None:
+            dagrun_ti_states.set_state(ti.task_id, ti.state)
+
+        for dep_status in dep_statuses:
+            yield dep_status
+
+    @staticmethod
+    def _get_upstream_state_counts(ti, session):
+        """
+        Returns the number of successes, excluded, skipped, failed, upstream_failed and
+        done upstream task instances of the given task instance using an aggregate query.
+
+        :param ti: the task instance to count the upstream task instances of
+        :type ti: TaskInstance
+        :param session: database session
+        :type session: Session
+        """
+        TI = airflow.models.TaskInstance
+
         qry = (
             session
             .query(
@@ -70,25 +113,7 @@ class TriggerRuleDep(BaseTIDep):
                     State.UPSTREAM_FAILED, State.SKIPPED]),
             )
         )
-
-        successes, excluded, skipped, failed, upstream_failed, done = qry.first()
-
-        # Add excluded tasks into successful tasks as they are equivalent for
-        # dependency purposes. This is done in this way, not using the
-        # state_for_dependents function, due to the constraints of SQLAlchemy
-        # queries.
-        successes = successes + excluded
-
-        for dep_status in self._evaluate_trigger_rule(
-                ti=ti,
-                successes=successes,
-                skipped=skipped,
-                failed=failed,
-                upstream_failed=upstream_failed,
-                done=done,
-                flag_upstream_failed=dep_context.flag_upstream_failed,
-                session=session):
-            yield dep_status
+        return qry.first()
 
     @provide_session
     def _evaluate_trigger_rule(
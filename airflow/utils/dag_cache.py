@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+from stat import S_IWGRP, S_IWOTH
+
+import dill
+
+from builtins import object
+
+from airflow.utils.dag_processing import DagFileParseCache
+
+_log = logging.getLogger(__name__)
+
+# DagBag loads the DAG files as modules with this prefix
+DAG_MODULE_PREFIX = 'unusual_prefix_'
+
+
+class DagPickleCache(object):
+    """
+    A cache of the DAGs parsed from DAG files, pickled to a directory so that
+    the processes of a worker (e.g. the `airflow run` commands) don't have to
+    parse a file that another one already parsed.
+
+    An entry is only used while the DAG file, and the modules under the DAG
+    folder that were loaded when it was parsed, are unchanged, as told by the
+    fingerprints of DagFileParseCache. Entries are written to a temporary file
+    and renamed, so readers never see partial entries, and the ones that can't
+    be loaded are deleted. The least recently used entries are evicted to keep
+    at most max_entries of them.
+
+    The functions defined in the DAG files are pickled by value, as the
+    modules of the DAG files don't exist in the processes loading the
+    entries. The files defining classes their DAGs use aren't cached.
+
+    Unpickling runs code, so the entries are only loaded when the directory
+    and the entry are owned by the current user and are not writable by
+    others.
+    """
+
+    SUFFIX = '.dags.pickle'
+
+    def __init__(self, directory, dags_folder, max_entries):
+        """
+        :param directory: where to write the entries
+        :type directory: unicode
+        :param dags_folder: the folder containing the DAG files and the local
+        modules they import
+        :type dags_folder: unicode
+        :param max_entries: the number of DAG files to keep the DAGs of
+        :type max_entries: int
+        """
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_entries = max_entries
+        self._fingerprints = DagFileParseCache(dags_folder)
+
+    def _get_entry_path(self, file_path):
+        key = hashlib.sha1(
+            os.path.abspath(file_path).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get_fingerprint(self, file_path):
+        """
+        :return: the fingerprint of the file, to take before parsing it
+        :rtype: list
+        """
+        return self._fingerprints.get_fingerprint(file_path)
+
+    @staticmethod
+    def _is_trusted(path):
+        """
+        :return: whether the file or directory is owned by the current user
+        and can't be written by others
+        :rtype: bool
+        """
+        stat = os.stat(path)
+        return (stat.st_uid == os.getuid() and
+                not stat.st_mode & (S_IWGRP | S_IWOTH))
+
+    def get(self, file_path):
+        """
+        :param file_path: the path to the DAG file
+        :type file_path: unicode
+        :return: the DAGs of the file by DAG ID, or None if the file has to be
+        parsed
+        :rtype: dict[unicode, airflow.models.DAG]
+        """
+        entry_path = self._get_entry_path(file_path)
+        try:
+            if not (self._is_trusted(self.directory) and
+                    self._is_trusted(entry_path)):
+                _log.warning("Not using the DAG cache entry {} as it, or its "
+                             "directory, can be written by other users"
+                             .format(entry_path))
+                return None
+            with open(entry_path, 'rb') as f:
+                fingerprints, dags = dill.load(f)
+        except (IOError, OSError):
+            return None
+        except Exception:
+            _log.exception("Removing the DAG cache entry {} of {} as it "
+                           "can't be loaded".format(entry_path, file_path))
+            self.invalidate(file_path)
+            return None
+
+        changed_paths = self._fingerprints.get_changed_paths(fingerprints)
+        if changed_paths:
+            _log.info("Not using the DAG cache entry of {} as {} changed"
+                      .format(file_path, ", ".join(changed_paths)))
+            self.invalidate(file_path)
+            return None
+
+        # Mark the entry as recently used
+        try:
+            os.utime(entry_path, None)
+        except OSError:
+            pass
+        return dags
+
+    def _dump(self, obj, f):
+        """
+        Pickles the DAGs with the modules of the DAG files hidden, so that
+        dill pickles their functions by value rather than by reference.
+        """
+        dag_modules = dict(
+            (name, module) for name, module in list(sys.modules.items())
+            if name.startswith(DAG_MODULE_PREFIX))
+        recurse = dill.settings['recurse']
+        try:
+            for name in dag_modules:
+                del sys.modules[name]
+            # Only pickle the globals the functions use
+            dill.settings['recurse'] = True
+            dill.dump(obj, f)
+        finally:
+            dill.settings['recurse'] = recurse
+            sys.modules.update(dag_modules)
+
+    def put(self, file_path, fingerprint, dags):
+        """
+        :param file_path: the path to the DAG file
+        :type file_path: unicode
+        :param fingerprint: the get_fingerprint() of the file before it was
+        parsed, so that changes made while it was parsed are detected
+        :type fingerprint: list
+        :param dags: the DAGs parsed from the file by DAG ID
+        :type dags: dict[unicode, airflow.models.DAG]
+        """
+        fingerprints = self._fingerprints.get_fingerprints(
+            file_path, fingerprint)
+
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory, 0o700)
+            except OSError:
+                # Created by another process in the meantime
+                if not os.path.isdir(self.directory):
+                    raise
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self._dump((fingerprints, dags), f)
+            os.rename(tmp_path, self._get_entry_path(file_path))
+        except Exception:
+            _log.exception("Could not cache the DAGs of {}".format(file_path))
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self._evict()
+
+    def invalidate(self, file_path):
+        """
+        Removes the entry of a DAG file, if any.
+        """
+        try:
+            os.remove(self._get_entry_path(file_path))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """
+        Removes the least recently used entries above max_entries.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((os.stat(path).st_mtime, path))
+            except OSError:
+                continue
+        entries.sort(reverse=True)
+        for _, path in entries[self.max_entries:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -17,15 +17,19 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import hashlib
 import logging
 import os
 import re
+import sys
 import time
+import zipfile
 
 from abc import ABCMeta, abstractmethod
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from datetime import datetime
 
+from airflow import configuration as conf
 from airflow.exceptions import AirflowException
 from airflow.dag.base_dag import BaseDag, BaseDagBag
 from airflow.utils.logging import LoggingMixin
@@ -158,58 +162,496 @@ class SimpleDagBag(BaseDagBag):
         return self.dag_id_to_simple_dag[dag_id]
 
 
-def list_py_file_paths(directory, safe_mode=True):
+class DagFolderIndex(LoggingMixin):
     """
-    Traverse a directory and look for Python files.
+    Keeps the listing of a DAG folder in memory: the directories, their
+    compiled .airflowignore patterns and the files along with whether they
+    are zip files and may contain DAGs. Refreshing the index only stats the
+    known directories and files, and only lists a directory or reads a file
+    again when its mtime or size changed. When inotify is enabled, only the
+    directories where events were received are looked at.
+
+    The patterns of an .airflowignore file apply to the files in its directory
+    and in the subdirectories.
+    """
+
+    # Map from directory to the DagFolderIndex for it, shared by the callers
+    # in this process.
+    _indexes = {}
+
+    IGNORE_FILE = '.airflowignore'
+
+    def __init__(self, directory, use_inotify=False):
+        """
+        :param directory: the directory to index
+        :type directory: unicode
+        :param use_inotify: whether to watch the directory with inotify (needs
+        pyinotify), instead of looking at all of it on every refresh
+        :type use_inotify: bool
+        """
+        self._directory = directory
+        # Map from directory to [(mtime, size) of the directory, list of
+        # subdirectories, list of files, (mtime, size) of the ignore file,
+        # compiled ignore patterns]
+        self._dirs = {}
+        # Map from file path to [(mtime, size), is a zip file, might contain
+        # a DAG or None if not checked yet]
+        self._files = {}
+        # Directories to look at on the next refresh when using inotify, or
+        # None to look at all of them
+        self._dirty_dirs = None
+        self._notifier = None
+        if use_inotify:
+            self._start_watching()
+
+    @classmethod
+    def get(cls, directory):
+        """
+        :return: the refreshed index of the directory
+        :rtype: DagFolderIndex
+        """
+        index = cls._indexes.get(directory)
+        if index is None:
+            index = cls(directory,
+                        conf.getboolean('core', 'dag_folder_use_inotify'))
+            cls._indexes[directory] = index
+        index.refresh()
+        return index
+
+    def _start_watching(self):
+        try:
+            import pyinotify
+        except ImportError:
+            self.logger.warning("pyinotify isn't installed, polling {} instead"
+                                .format(self._directory))
+            return
+
+        index = self
+
+        class EventHandler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                if event.mask & pyinotify.IN_Q_OVERFLOW:
+                    index._dirty_dirs = None
+                elif index._dirty_dirs is not None:
+                    index._dirty_dirs.add(event.path)
+
+        mask = (pyinotify.IN_CREATE | pyinotify.IN_DELETE |
+                pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MODIFY |
+                pyinotify.IN_ATTRIB | pyinotify.IN_MOVED_FROM |
+                pyinotify.IN_MOVED_TO | pyinotify.IN_DELETE_SELF)
+        watch_manager = pyinotify.WatchManager()
+        watch_manager.add_watch(self._directory, mask, rec=True,
+                                auto_add=True)
+        self._notifier = pyinotify.Notifier(watch_manager,
+                                            default_proc_fun=EventHandler(),
+                                            timeout=0)
+
+    def stop_watching(self):
+        if self._notifier:
+            self._notifier.stop()
+            self._notifier = None
+        self._dirty_dirs = None
+
+    @staticmethod
+    def _get_stat(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    @staticmethod
+    def _get_stable_stat(stat):
+        """
+        :return: the stat to remember for a directory or file. Changes made in
+        the same second as the last one may not change the mtime on some file
+        systems, so recently modified entries are looked at again next time.
+        """
+        if stat is not None and time.time() - stat[0] < 1:
+            return None
+        return stat
+
+    @staticmethod
+    def _read_ignore_patterns(ignore_file_path):
+        patterns = []
+        try:
+            with open(ignore_file_path, 'r') as f:
+                for pattern in f.read().split('\n'):
+                    if not pattern:
+                        continue
+                    try:
+                        patterns.append(re.compile(pattern))
+                    except re.error:
+                        _log.warning("Ignoring invalid pattern %s in %s",
+                                     pattern, ignore_file_path)
+        except (IOError, OSError):
+            _log.exception("Error while reading %s", ignore_file_path)
+        return patterns
+
+    def _forget_dir(self, directory):
+        entry = self._dirs.pop(directory, None)
+        if entry is None:
+            return
+        for f in entry[2]:
+            self._files.pop(os.path.join(directory, f), None)
+        for d in entry[1]:
+            self._forget_dir(os.path.join(directory, d))
+
+    def _scan_dir(self, directory, recursive):
+        """
+        Update the index for a directory, listing it again only if it changed.
+
+        :param recursive: whether to also scan the known subdirectories. New
+        subdirectories are always scanned.
+        :type recursive: bool
+        """
+        stat = self._get_stat(directory)
+        if stat is None or not os.path.isdir(directory):
+            self._forget_dir(directory)
+            return
+
+        entry = self._dirs.get(directory)
+        known_subdirs = set()
+        if entry is None or entry[0] != stat:
+            subdirs = []
+            files = []
+            try:
+                names = sorted(os.listdir(directory))
+            except OSError:
+                self.logger.exception("Error while listing {}".format(directory))
+                names = []
+            for name in names:
+                if os.path.isdir(os.path.join(directory, name)):
+                    subdirs.append(name)
+                else:
+                    files.append(name)
+            if entry is None:
+                entry = [self._get_stable_stat(stat), subdirs, files, None, []]
+                self._dirs[directory] = entry
+            else:
+                known_subdirs = set(entry[1])
+                for d in known_subdirs - set(subdirs):
+                    self._forget_dir(os.path.join(directory, d))
+                for f in set(entry[2]) - set(files):
+                    self._files.pop(os.path.join(directory, f), None)
+                entry[0] = self._get_stable_stat(stat)
+                entry[1], entry[2] = subdirs, files
+        else:
+            known_subdirs = set(entry[1])
+
+        ignore_file_stat = None
+        if self.IGNORE_FILE in entry[2]:
+            ignore_file_path = os.path.join(directory, self.IGNORE_FILE)
+            ignore_file_stat = self._get_stat(ignore_file_path)
+            if ignore_file_stat is None or ignore_file_stat != entry[3]:
+                entry[4] = self._read_ignore_patterns(ignore_file_path)
+        else:
+            entry[4] = []
+        entry[3] = self._get_stable_stat(ignore_file_stat)
+
+        for f in entry[2]:
+            file_path = os.path.join(directory, f)
+            file_stat = self._get_stat(file_path)
+            file_entry = self._files.get(file_path)
+            if (file_entry is not None and file_entry[0] is not None and
+                    file_entry[0] == file_stat):
+                continue
+            if file_stat is None:
+                self._files.pop(file_path, None)
+                continue
+            is_zip = False
+            if os.path.splitext(f)[1] != '.py':
+                try:
+                    is_zip = zipfile.is_zipfile(file_path)
+                except (IOError, OSError):
+                    pass
+            self._files[file_path] = [self._get_stable_stat(file_stat),
+                                      is_zip,
+                                      None]
+
+        for d in entry[1]:
+            if recursive or d not in known_subdirs:
+                self._scan_dir(os.path.join(directory, d), recursive)
+
+    def refresh(self):
+        """
+        Bring the index up to date with the file system.
+        """
+        if not os.path.isdir(self._directory):
+            self._dirs = {}
+            self._files = {}
+            return
+        if self._notifier:
+            if self._notifier.check_events(timeout=0):
+                self._notifier.read_events()
+                self._notifier.process_events()
+            if self._dirty_dirs is not None and self._dirs:
+                dirty_dirs = self._dirty_dirs
+                self._dirty_dirs = set()
+                for directory in sorted(dirty_dirs):
+                    if directory in self._dirs:
+                        self._scan_dir(directory, recursive=False)
+                return
+            self._dirty_dirs = set()
+        self._scan_dir(self._directory, recursive=True)
+
+    def _might_contain_dag(self, file_path, file_entry):
+        # Heuristic that guesses whether a Python file contains an
+        # Airflow DAG definition.
+        if file_entry[2] is None:
+            try:
+                with open(file_path, 'rb') as f:
+                    content = f.read()
+                file_entry[2] = all([s in content for s in (b'DAG', b'airflow')])
+            except (IOError, OSError):
+                _log.exception("Error while examining %s", file_path)
+                return False
+        return file_entry[2]
+
+    def list_file_paths(self, safe_mode=True, include_zip_files=False):
+        """
+        :param safe_mode: whether to use a heuristic to determine whether a
+        Python file contains Airflow DAG definitions
+        :type safe_mode: bool
+        :param include_zip_files: whether to include the zip files
+        :type include_zip_files: bool
+        :return: the paths to the Python (and zip) files in the directory that
+        aren't ignored
+        :rtype: list[unicode]
+        """
+        file_paths = []
+        stack = [(self._directory, [])]
+        while stack:
+            directory, patterns = stack.pop()
+            entry = self._dirs.get(directory)
+            if entry is None:
+                continue
+            patterns = patterns + entry[4]
+            for f in entry[2]:
+                file_path = os.path.join(directory, f)
+                file_entry = self._files.get(file_path)
+                if file_entry is None:
+                    continue
+                if os.path.splitext(f)[1] != '.py':
+                    if not (include_zip_files and file_entry[1]):
+                        continue
+                elif safe_mode and not self._might_contain_dag(file_path,
+                                                               file_entry):
+                    continue
+                if any(p.search(file_path) for p in patterns):
+                    continue
+                file_paths.append(file_path)
+            for d in reversed(entry[1]):
+                stack.append((os.path.join(directory, d), patterns))
+        return file_paths
+
+
+def list_py_file_paths(directory, safe_mode=True, include_zip_files=False):
+    """
+    Look for Python files in a directory, using the DagFolderIndex of the
+    directory.
 
     :param directory: the directory to traverse
     :type directory: unicode
     :param safe_mode: whether to use a heuristic to determine whether a file
     contains Airflow DAG definitions
+    :param include_zip_files: whether to also return the zip files
+    :type include_zip_files: bool
     :return: a list of paths to Python files in the specified directory
     :rtype: list[unicode]
     """
-    file_paths = []
     if directory is None:
         return []
     elif os.path.isfile(directory):
         return [directory]
     elif os.path.isdir(directory):
-        patterns = []
-        for root, dirs, files in os.walk(directory, followlinks=True):
-            ignore_file = [f for f in files if f == '.airflowignore']
-            if ignore_file:
-                f = open(os.path.join(root, ignore_file[0]), 'r')
-                patterns += [p for p in f.read().split('\n') if p]
-                f.close()
-            for f in files:
-                try:
-                    file_path = os.path.join(root, f)
-                    if not os.path.isfile(file_path):
-                        continue
-                    mod_name, file_ext = os.path.splitext(
-                        os.path.split(file_path)[-1])
-                    if file_ext != '.py':
-                        continue
-                    if any([re.findall(p, file_path) for p in patterns]):
-                        continue
+        index = DagFolderIndex.get(directory)
+        return index.list_file_paths(safe_mode=safe_mode,
+                                     include_zip_files=include_zip_files)
+    return []
 
-                    # Heuristic that guesses whether a Python file contains an
-                    # Airflow DAG definition.
-                    might_contain_dag = True
-                    if safe_mode:
-                        with open(file_path, 'rb') as f:
-                            content = f.read()
-                            might_contain_dag = all([s in content
-                                                     for s in (b'DAG', b'airflow')])
 
-                    if not might_contain_dag:
-                        continue
+# A DagBag parsed from a file, along with what's needed to tell whether the
+# file changed since. fingerprints maps the path of the file and of the local
+# modules that were loaded when it was parsed to a [(mtime, size), sha1] list.
+CachedDagFile = namedtuple('CachedDagFile',
+                           ['dagbag', 'pickle_ids', 'fingerprints', 'parse_time'])
+
+
+class DagFileParseCache(LoggingMixin):
+    """
+    Keeps the DagBags parsed from DAG files so that a file only has to be
+    executed again when it, or one of the modules under the DAG folder that
+    were loaded when it was parsed, changed, or when the entry is older than
+    the given TTL. A file is considered changed when its mtime or size changed
+    and its content hash doesn't match anymore.
+    """
 
-                    file_paths.append(file_path)
-                except Exception:
-                    _log.exception("Error while examining %s", f)
-    return file_paths
+    def __init__(self, dags_folder):
+        """
+        :param dags_folder: the folder containing the DAG files and the local
+        modules they import
+        :type dags_folder: unicode
+        """
+        self._dags_folder = os.path.abspath(os.path.expanduser(dags_folder))
+        # Map from file path to CachedDagFile
+        self._entries = {}
+
+    @staticmethod
+    def _get_stat(file_path):
+        """
+        :return: the (mtime, size) of the file, or None if it doesn't exist
+        :rtype: tuple
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    @staticmethod
+    def _get_content_hash(file_path):
+        """
+        :return: the SHA1 of the content of the file, or None if it can't be
+        read
+        :rtype: unicode
+        """
+        sha1 = hashlib.sha1()
+        try:
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 16), b''):
+                    sha1.update(chunk)
+        except (IOError, OSError):
+            return None
+        return sha1.hexdigest()
+
+    def get_fingerprint(self, file_path):
+        """
+        :return: what's used to tell whether the file changed later on. Should
+        be taken before parsing the file, so that changes made while it's
+        parsed are detected.
+        :rtype: list
+        """
+        return [self._get_stat(file_path), self._get_content_hash(file_path)]
+
+    def get_fingerprints(self, file_path, fingerprint):
+        """
+        :param fingerprint: the get_fingerprint() of the file before it was
+        parsed
+        :type fingerprint: list
+        :return: the fingerprints of the file and of the modules under the DAG
+        folder that are loaded, by path
+        :rtype: dict[unicode, list]
+        """
+        fingerprints = dict((path, self.get_fingerprint(path))
+                            for path in self._get_local_module_paths())
+        fingerprints[os.path.abspath(file_path)] = fingerprint
+        return fingerprints
+
+    def _get_local_module_paths(self):
+        """
+        :return: the paths of the loaded modules that are under the DAG
+        folder, except the modules created from the DAG files themselves and
+        the modules loaded from zip files
+        :rtype: list[unicode]
+        """
+        paths = []
+        for name, module in list(sys.modules.items()):
+            path = getattr(module, '__file__', None)
+            # DagBag loads DAG files as modules with this prefix
+            if not path or name.startswith('unusual_prefix_'):
+                continue
+            if path.endswith(('.pyc', '.pyo')):
+                path = path[:-1]
+            path = os.path.abspath(path)
+            if (path.startswith(self._dags_folder + os.sep) and
+                    os.path.isfile(path)):
+                paths.append(path)
+        return paths
+
+    def get_changed_paths(self, fingerprints):
+        """
+        :return: the paths whose content doesn't match the given fingerprints
+        :rtype: list[unicode]
+        """
+        changed_paths = []
+        for path, fingerprint in fingerprints.items():
+            stat = self._get_stat(path)
+            if stat is not None and stat == fingerprint[0]:
+                continue
+            content_hash = self._get_content_hash(path)
+            if content_hash is not None and content_hash == fingerprint[1]:
+                # Only touched, no need to hash it again next time
+                fingerprint[0] = stat
+            else:
+                changed_paths.append(path)
+        return changed_paths
+
+    def _unload_modules(self, paths):
+        """
+        Remove the modules loaded from the given paths from sys.modules so
+        that they are imported again when the files importing them are parsed.
+        """
+        paths = set(paths)
+        for name, module in list(sys.modules.items()):
+            path = getattr(module, '__file__', None)
+            if not path:
+                continue
+            if path.endswith(('.pyc', '.pyo')):
+                path = path[:-1]
+            if os.path.abspath(path) in paths:
+                self.logger.info("Unloading module {} as {} changed"
+                                 .format(name, path))
+                del sys.modules[name]
+
+    def get(self, file_path, ttl):
+        """
+        :param file_path: the path to the DAG file
+        :type file_path: unicode
+        :param ttl: the number of seconds after which the file has to be
+        parsed again, even if nothing changed
+        :type ttl: float
+        :return: the result of the last parse of the file, or None if the
+        file has to be parsed
+        :rtype: CachedDagFile
+        """
+        entry = self._entries.get(file_path)
+        if entry is None:
+            return None
+        if time.time() - entry.parse_time > ttl:
+            del self._entries[file_path]
+            return None
+        changed_paths = self.get_changed_paths(entry.fingerprints)
+        if changed_paths:
+            self.logger.info("Parsing {} again as {} changed"
+                             .format(file_path, ", ".join(changed_paths)))
+            del self._entries[file_path]
+            self._unload_modules([path for path in changed_paths
+                                  if path != os.path.abspath(file_path)])
+            return None
+        return entry
+
+    def put(self, file_path, fingerprint, dagbag, pickle_ids):
+        """
+        :param file_path: the path to the DAG file
+        :type file_path: unicode
+        :param fingerprint: the fingerprint of the file, as returned by
+        get_fingerprint() before the file was parsed
+        :type fingerprint: list
+        :param dagbag: the DagBag parsed from the file
+        :type dagbag: models.DagBag
+        :param pickle_ids: map from DAG ID to the ID of its pickle, for the DAGs
+        that were pickled
+        :type pickle_ids: dict[unicode, int]
+        """
+        fingerprints = self.get_fingerprints(file_path, fingerprint)
+        self._entries[file_path] = CachedDagFile(dagbag,
+                                                 pickle_ids,
+                                                 fingerprints,
+                                                 time.time())
+
+    def clear(self):
+        self._entries = {}
 
 
 class AbstractDagFileProcessor(object):
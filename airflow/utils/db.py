@@ -21,12 +21,16 @@ from datetime import datetime
 from functools import wraps
 import logging
 import os
+import threading
+import time
+import traceback
 
 from alembic.config import Config
 from alembic import command
 from alembic.migration import MigrationContext
 
 from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
 from sqlalchemy.pool import Pool
 
 from airflow import settings
@@ -102,6 +106,110 @@ def checkout(dbapi_connection, connection_record, connection_proxy):
         )
 
 
+# Number of statements run by this process so far
+_query_count = 0
+
+# Whether to time the statements, attribute them to the sql_component blocks
+# they're run in and log the slow ones
+SQL_INSTRUMENTATION = configuration.getboolean('core', 'sql_instrumentation')
+SQL_SLOW_QUERY_THRESHOLD = configuration.getfloat(
+    'core', 'sql_slow_query_threshold')
+
+# The [name, query count, seconds] of the sql_component blocks the current
+# thread is in, innermost last
+_components = threading.local()
+
+
+# The listeners are set on the Engine class rather than on settings.engine, as
+# settings.configure_orm() replaces the engine in the processes it forks and
+# in the task processes
+@event.listens_for(Engine, "before_cursor_execute")
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    global _query_count
+    _query_count += 1
+    if SQL_INSTRUMENTATION:
+        conn.info.setdefault('query_start_time', []).append(time.time())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def time_query(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get('query_start_time')
+    if not SQL_INSTRUMENTATION or not start_times:
+        return
+    duration = time.time() - start_times.pop()
+    for component in getattr(_components, 'stack', ()):
+        component[1] += 1
+        component[2] += duration
+    if duration >= SQL_SLOW_QUERY_THRESHOLD:
+        _log.warning("Slow query ({:.3f}s) from {}: {}".format(
+            duration, _get_call_site(), statement))
+
+
+@event.listens_for(Engine, "handle_error")
+def forget_failed_query(context):
+    start_times = context.connection.info.get('query_start_time')
+    if start_times:
+        start_times.pop()
+
+
+def _get_call_site():
+    """
+    Returns where the query being run was made from, skipping the frames of
+    SQLAlchemy and of this module.
+    """
+    this_file = os.path.splitext(__file__)[0]
+    for filename, lineno, func, _ in reversed(traceback.extract_stack()):
+        if (os.path.splitext(filename)[0] != this_file and
+                '{0}sqlalchemy{0}'.format(os.sep) not in filename):
+            return "{}:{} in {}".format(filename, lineno, func)
+    return "unknown"
+
+
+def get_query_count():
+    """
+    Returns the number of statements run by this process so far, to tell how
+    many queries a piece of code makes.
+    """
+    return _query_count
+
+
+class sql_component(object):
+    """
+    To be used in a ``with`` block, or as a decorator, to count the queries
+    made by its content and the time they took, reported as the
+    ``sql.<name>.queries`` and ``sql.<name>.time`` metrics when it ends.
+    Blocks can be nested, the outer ones include the queries of the inner
+    ones. Does nothing unless [core] sql_instrumentation is on.
+    """
+    def __init__(self, name):
+        self.name = name
+        self._component = None
+
+    def __enter__(self):
+        if SQL_INSTRUMENTATION:
+            self._component = [self.name, 0, 0.0]
+            if not hasattr(_components, 'stack'):
+                _components.stack = []
+            _components.stack.append(self._component)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if self._component is None:
+            return
+        _components.stack.remove(self._component)
+        name, queries, duration = self._component
+        self._component = None
+        settings.Stats.incr('sql.{}.queries'.format(name), queries)
+        settings.Stats.timing('sql.{}.time'.format(name), duration * 1000)
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with sql_component(self.name):
+                return func(*args, **kwargs)
+        return wrapper
+
+
 def initdb():
     session = settings.Session()
 
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+import time
+
+from builtins import object
+
+from airflow import configuration
+
+_log = logging.getLogger(__name__)
+
+LOOKUP_CACHE_TTL = configuration.getint('core', 'lookup_cache_ttl')
+LOOKUP_CACHE_VERSION_CHECK_INTERVAL = configuration.getint(
+    'core', 'lookup_cache_version_check_interval')
+
+
+class LookupCache(object):
+    """
+    A process-local read-through cache of values looked up in the database,
+    like Variables and Connections.
+
+    Entries expire after ttl seconds. If get_version is given, all the
+    entries are also dropped when the version it returns changes, which is
+    checked at most every version_check_interval seconds. A ttl of 0 disables
+    the cache.
+    """
+    def __init__(self, name, ttl=None, get_version=None,
+                 version_check_interval=None):
+        """
+        :param name: what is cached, for the logs
+        :type name: unicode
+        :param ttl: how long to keep the entries, in seconds
+        :type ttl: int
+        :param get_version: returns the current version of the cached values
+        :type get_version: function
+        :param version_check_interval: how often to call get_version, in
+        seconds
+        :type version_check_interval: int
+        """
+        self.name = name
+        self.ttl = LOOKUP_CACHE_TTL if ttl is None else ttl
+        self.get_version = get_version
+        if version_check_interval is None:
+            version_check_interval = LOOKUP_CACHE_VERSION_CHECK_INTERVAL
+        self.version_check_interval = version_check_interval
+        self._entries = {}
+        self._version = None
+        self._next_version_check = 0
+
+    def get(self, key, load):
+        """
+        :param key: the key of the value
+        :param load: called to look the value up when it isn't cached
+        :type load: function
+        :return: the cached value, or the one returned by load()
+        """
+        if self.ttl <= 0:
+            return load()
+
+        now = time.time()
+        self._check_version(now)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        value = load()
+        self._entries[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self, key=None):
+        """
+        Drops the entry of a key, or all the entries if key is None.
+        """
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def _check_version(self, now):
+        if self.get_version is None or now < self._next_version_check:
+            return
+        self._next_version_check = now + self.version_check_interval
+        try:
+            version = self.get_version()
+        except Exception:
+            _log.exception("Could not get the version of the cached {}"
+                           .format(self.name))
+            version = None
+        if version is None or version != self._version:
+            if self._entries:
+                _log.debug("Dropping the cached {}".format(self.name))
+            self.invalidate()
+        self._version = version
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cProfile
+import logging
+import os
+import time
+
+from builtins import object
+
+from airflow.settings import Stats
+from airflow.utils.db import get_query_count, sql_component
+
+_log = logging.getLogger(__name__)
+
+
+class timed_phase(object):
+    """
+    To be used in a ``with`` block to report how long its content took and
+    how many queries it made, as the ``<name>.duration`` (in milliseconds)
+    and ``<name>.queries`` timers. The block is also a sql_component.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.duration = None
+        self.queries = None
+        self._sql_component = sql_component(name)
+
+    def __enter__(self):
+        self._sql_component.__enter__()
+        self._start_time = time.time()
+        self._start_query_count = get_query_count()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self._sql_component.__exit__(type, value, traceback)
+        self.duration = time.time() - self._start_time
+        self.queries = get_query_count() - self._start_query_count
+        Stats.timing(self.name + '.duration', self.duration * 1000)
+        Stats.timing(self.name + '.queries', self.queries)
+
+
+class PeriodicProfiler(object):
+    """
+    Profiles the current process with cProfile and writes what was recorded
+    since the last snapshot to a pstats file every ``interval`` seconds. The
+    files are named ``<name>-<pid>-<timestamp>.prof`` and can be read with the
+    ``pstats`` module or tools like snakeviz.
+    """
+    def __init__(self, name, directory, interval):
+        """
+        :param name: prefix of the snapshot files
+        :type name: unicode
+        :param directory: where to write the snapshots
+        :type directory: unicode
+        :param interval: how often to write a snapshot, in seconds
+        :type interval: int
+        """
+        self.name = name
+        self.directory = directory
+        self.interval = interval
+        self._profile = None
+        self._last_dump_time = None
+
+    def start(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        _log.info("Profiling to {} every {}s".format(self.directory,
+                                                     self.interval))
+        self._profile = cProfile.Profile()
+        self._last_dump_time = time.time()
+        self._profile.enable()
+
+    def maybe_dump(self):
+        """
+        Writes a snapshot if the last one is older than the interval.
+        """
+        if (self._profile is not None and
+                time.time() - self._last_dump_time >= self.interval):
+            self.dump()
+
+    def dump(self):
+        """
+        Writes a snapshot and starts recording the next one.
+        """
+        if self._profile is None:
+            return
+        self._profile.disable()
+        path = os.path.join(self.directory, "{}-{}-{}.prof".format(
+            self.name, os.getpid(), time.strftime('%Y%m%dT%H%M%S')))
+        try:
+            self._profile.dump_stats(path)
+            _log.info("Wrote profile snapshot {}".format(path))
+        except (IOError, OSError):
+            _log.exception("Error while writing profile snapshot {}"
+                           .format(path))
+        self._profile = cProfile.Profile()
+        self._last_dump_time = time.time()
+        self._profile.enable()
+
+    def stop(self):
+        """
+        Writes the last snapshot and stops profiling.
+        """
+        self.dump()
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile = None
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import errno
+import logging
+import os
+import tempfile
+
+import dill
+
+from builtins import object
+from future.standard_library import install_aliases
+install_aliases()
+from urllib.parse import quote, urlparse
+
+from airflow import configuration
+from airflow.exceptions import AirflowException
+
+_log = logging.getLogger(__name__)
+
+
+class ExternalXComValue(object):
+    """
+    What is stored in the xcom table in place of a value that was written to
+    an XCom storage.
+    """
+    def __init__(self, url, size):
+        """
+        :param url: where the pickled value is stored
+        :type url: unicode
+        :param size: the size of the pickled value, in bytes
+        :type size: int
+        """
+        self.url = url
+        self.size = size
+
+    def open(self):
+        """
+        :return: a binary file object streaming the pickled value
+        """
+        return get_xcom_storage(self.url).open(self.url)
+
+    def load(self):
+        """
+        :return: the value, unpickled while it is streamed from the storage
+        """
+        f = self.open()
+        try:
+            return dill.load(f)
+        finally:
+            f.close()
+
+    def __repr__(self):
+        return '<ExternalXComValue {} ({} bytes)>'.format(self.url, self.size)
+
+
+class PickledXComValue(object):
+    """
+    A value that externalize() already pickled to measure it, which
+    XComPickler stores without pickling it again.
+    """
+    def __init__(self, data):
+        self.data = data
+
+
+class XComPickler(object):
+    """
+    The pickler of the value column of the xcom table.
+    """
+    @staticmethod
+    def dumps(value, protocol=None):
+        if isinstance(value, PickledXComValue):
+            return value.data
+        return dill.dumps(value, protocol)
+
+    @staticmethod
+    def loads(data):
+        return dill.loads(data)
+
+
+class BaseXComStorage(object):
+    """
+    A place to store the pickled values of XComs that are too large to be
+    kept in the metadata database.
+    """
+    def __init__(self, base_url, conn_id=None):
+        """
+        :param base_url: the location under which the values are written
+        :type base_url: unicode
+        :param conn_id: the connection to the storage, if it needs one
+        :type conn_id: unicode
+        """
+        self.base_url = base_url.rstrip('/')
+        self.conn_id = conn_id
+
+    def get_url(self, dag_id, task_id, execution_date, key):
+        """
+        :return: where to write the value of an XCom. Pushing the XCom again
+        overwrites it, so that replaced values don't pile up.
+        :rtype: unicode
+        """
+        return '/'.join([
+            self.base_url,
+            quote(dag_id, safe=''),
+            quote(task_id, safe=''),
+            execution_date.isoformat(),
+            quote(key, safe='')])
+
+    def write(self, url, data):
+        """
+        Writes the pickled value of an XCom.
+
+        :param url: from get_url()
+        :type url: unicode
+        :param data: the pickled value
+        :type data: bytes
+        """
+        raise NotImplementedError()
+
+    def open(self, url):
+        """
+        :param url: from get_url()
+        :type url: unicode
+        :return: a binary file object to stream the pickled value from
+        """
+        raise NotImplementedError()
+
+    def delete(self, url):
+        """
+        Deletes the pickled value of an XCom, if it exists.
+
+        :param url: from get_url()
+        :type url: unicode
+        """
+        raise NotImplementedError()
+
+
+class LocalXComStorage(BaseXComStorage):
+    """
+    Stores the values in a local (or mounted) folder, given as a file:// URL
+    or a path.
+    """
+    @staticmethod
+    def _get_path(url):
+        return urlparse(url).path if url.startswith('file:/') else url
+
+    def write(self, url, data):
+        path = self._get_path(url)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by another process in the meantime
+                if not os.path.isdir(directory):
+                    raise
+        # Rename a complete file so that readers never see a partial value
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmp_path, path)
+        except:
+            os.remove(tmp_path)
+            raise
+
+    def open(self, url):
+        return open(self._get_path(url), 'rb')
+
+    def delete(self, url):
+        try:
+            os.remove(self._get_path(url))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+class S3XComStorage(BaseXComStorage):
+    """
+    Stores the values in S3, using an S3Hook. Requires airflow[s3].
+    """
+    def __init__(self, base_url, conn_id=None):
+        super(S3XComStorage, self).__init__(base_url, conn_id)
+        from airflow.hooks.S3_hook import S3Hook
+        self.hook = S3Hook(conn_id)
+
+    def write(self, url, data):
+        self.hook.load_string(data, key=url, replace=True)
+
+    def open(self, url):
+        key = self.hook.get_key(url)
+        if key is None:
+            raise AirflowException(
+                "The XCom value {} doesn't exist".format(url))
+        # boto keys can't be unpickled from as they have no readline(), so
+        # download in chunks to a temporary file rather than in memory
+        tmp = tempfile.TemporaryFile()
+        key.get_contents_to_file(tmp)
+        tmp.seek(0)
+        return tmp
+
+    def delete(self, url):
+        key = self.hook.get_key(url)
+        if key is not None:
+            key.delete()
+
+
+class GCSXComStorage(BaseXComStorage):
+    """
+    Stores the values in Google Cloud Storage, using a
+    GoogleCloudStorageHook. Requires airflow[gcp_api].
+    """
+    def __init__(self, base_url, conn_id=None):
+        super(GCSXComStorage, self).__init__(base_url, conn_id)
+        from airflow.contrib.hooks.gcs_hook import GoogleCloudStorageHook
+        if conn_id:
+            self.hook = GoogleCloudStorageHook(
+                google_cloud_storage_conn_id=conn_id)
+        else:
+            self.hook = GoogleCloudStorageHook()
+
+    @staticmethod
+    def _parse_url(url):
+        parsed = urlparse(url)
+        return parsed.netloc, parsed.path.lstrip('/')
+
+    def write(self, url, data):
+        bucket, blob = self._parse_url(url)
+        with tempfile.NamedTemporaryFile() as tmp:
+            tmp.write(data)
+            tmp.flush()
+            self.hook.upload(bucket, blob, tmp.name)
+
+    def open(self, url):
+        from apiclient.http import MediaIoBaseDownload
+        bucket, blob = self._parse_url(url)
+        request = self.hook.get_conn().objects().get_media(
+            bucket=bucket, object=blob)
+        # Download in chunks to a temporary file rather than in memory
+        tmp = tempfile.TemporaryFile()
+        downloader = MediaIoBaseDownload(tmp, request)
+        done = False
+        while not done:
+            _, done = downloader.next_chunk()
+        tmp.seek(0)
+        return tmp
+
+    def delete(self, url):
+        from apiclient.errors import HttpError
+        bucket, blob = self._parse_url(url)
+        try:
+            self.hook.get_conn().objects().delete(
+                bucket=bucket, object=blob).execute()
+        except HttpError as e:
+            if e.resp['status'] != '404':
+                raise
+
+
+def get_xcom_storage(url):
+    """
+    :param url: a location under the storage
+    :type url: unicode
+    :return: the storage of the location
+    :rtype: BaseXComStorage
+    """
+    conn_id = configuration.get('core', 'xcom_storage_conn_id') or None
+    if url.startswith('s3:/'):
+        return S3XComStorage(url, conn_id)
+    elif url.startswith('gs:/'):
+        return GCSXComStorage(url, conn_id)
+    elif url.startswith('file:/') or url.startswith('/'):
+        return LocalXComStorage(url, conn_id)
+    raise AirflowException('Unsupported XCom storage: {}'.format(url))
+
+
+def externalize(value, dag_id, task_id, execution_date, key):
+    """
+    Writes the value of an XCom to the configured XCom storage if its pickle
+    is larger than [core] xcom_storage_threshold bytes.
+
+    :return: the ExternalXComValue to store in the xcom table instead of the
+    value, the PickledXComValue of the value if it is small, or the value
+    itself if there is no XCom storage
+    """
+    base_url = configuration.get('core', 'xcom_storage')
+    if not base_url:
+        return value
+    data = dill.dumps(value)
+    if len(data) <= configuration.getint('core', 'xcom_storage_threshold'):
+        return PickledXComValue(data)
+
+    storage = get_xcom_storage(base_url)
+    url = storage.get_url(dag_id, task_id, execution_date, key)
+    storage.write(url, data)
+    _log.debug("Wrote the {} bytes of XCom {} to {}".format(
+        len(data), key, url))
+    return ExternalXComValue(url, len(data))
+
+
+def resolve(value):
+    """
+    :return: the value stored in the XCom storage if the value is an
+    ExternalXComValue, or the value itself
+    """
+    if isinstance(value, ExternalXComValue):
+        return value.load()
+    return value
+
+
+def remove(values):
+    """
+    Deletes the values written to an XCom storage among the given values of
+    XComs, e.g. because their rows are deleted. The failures are logged
+    rather than raised, so that the rows are deleted anyway.
+
+    :param values: the values of the xcom table
+    :type values: list
+    """
+    for value in values:
+        if not isinstance(value, ExternalXComValue):
+            continue
+        try:
+            get_xcom_storage(value.url).delete(value.url)
+            _log.debug("Deleted XCom value {}".format(value.url))
+        except Exception:
+            _log.exception("Failed to delete XCom value {}".format(value.url))
@@ -16,7 +16,7 @@ import logging
 import socket
 import six
 
-from flask import Flask
+from flask import Flask, g, request
 from flask_admin import Admin, base
 from flask_cache import Cache
 from flask_wtf.csrf import CsrfProtect
@@ -30,6 +30,7 @@ from airflow.www.blueprints import routes
 from airflow import jobs
 from airflow import settings
 from airflow import configuration
+from airflow.utils.db import sql_component
 
 _log = logging.getLogger(__name__)
 
@@ -146,6 +147,18 @@ def create_app(config=None, testing=False):
                 'hostname': socket.getfqdn(),
             }
 
+        @app.before_request
+        def start_sql_component():
+            g.sql_component = sql_component(
+                'webserver.{}'.format(request.endpoint or 'unknown'))
+            g.sql_component.__enter__()
+
+        @app.teardown_request
+        def end_sql_component(exception=None):
+            component = g.pop('sql_component', None)
+            if component:
+                component.__exit__(None, None, None)
+
         @app.teardown_appcontext
         def shutdown_session(exception=None):
             settings.Session.remove()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+The data of the duration, tries and landing times charts of a DAG, fetched
+with one query for the task instances and one for the task failures of the
+whole date window, whatever the number of tasks and runs.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import func
+
+from airflow import models
+from airflow.www.utils import epoch
+
+CHART_KINDS = ('duration', 'tries', 'landing_times')
+
+
+def get_date_window(dag, base_date=None, num_runs=25):
+    """
+    :return: the first and last execution dates of the num_runs schedules up
+    to base_date, which defaults to the latest execution date of the DAG
+    :rtype: tuple[datetime]
+    """
+    if not base_date:
+        base_date = dag.latest_execution_date or datetime.now()
+    dates = dag.date_range(base_date, num=-abs(num_runs))
+    min_date = dates[0] if dates else datetime(2000, 1, 1)
+    return min_date, base_date
+
+
+def get_task_instances(session, dag, start_date, end_date):
+    """
+    :return: the task_id, execution_date, duration, try_number and end_date
+    of the task instances of the DAG's tasks in the date window, oldest first
+    """
+    TI = models.TaskInstance
+    rows = (
+        session.query(TI.task_id, TI.execution_date, TI.duration,
+                      TI.try_number, TI.end_date)
+        .filter(TI.dag_id == dag.dag_id,
+                TI.execution_date >= start_date,
+                TI.execution_date <= end_date)
+        .order_by(TI.execution_date)
+        .all())
+    # The tasks that aren't in the DAG (anymore, or outside of a sub_dag)
+    # are filtered out here rather than with a long IN clause
+    return [row for row in rows if row.task_id in dag.task_dict]
+
+
+def get_fail_durations(session, dag, start_date, end_date):
+    """
+    :return: the total duration of the failed tries of each task instance
+    in the date window
+    :rtype: dict[tuple, float]
+    """
+    TF = models.TaskFail
+    rows = (
+        session.query(TF.task_id, TF.execution_date, func.sum(TF.duration))
+        .filter(TF.dag_id == dag.dag_id,
+                TF.execution_date >= start_date,
+                TF.execution_date <= end_date)
+        .group_by(TF.task_id, TF.execution_date)
+        .all())
+    return dict(((task_id, execution_date), duration or 0)
+                for task_id, execution_date, duration in rows)
+
+
+def _build_series(dag, points):
+    """
+    :param points: (x, y) lists by task ID
+    :return: a series per task that has points, in the order of dag.tasks
+    """
+    series = []
+    for task in dag.tasks:
+        if points.get(task.task_id):
+            x, y = zip(*points[task.task_id])
+            series.append({'name': task.task_id, 'x': list(x), 'y': list(y)})
+    return series
+
+
+def get_chart_data(session, dag, kind, start_date, end_date):
+    """
+    :param kind: one of CHART_KINDS
+    :return: the series of the chart, as dicts with the name, x and y values,
+    under 'series' (and 'cum_series' for the cumulated durations), and the
+    latest execution date that has task instances under 'max_date'
+    :rtype: dict
+    """
+    tis = get_task_instances(session, dag, start_date, end_date)
+    data = {'max_date': tis[-1].execution_date if tis else None}
+
+    points = defaultdict(list)
+    if kind == 'duration':
+        fail_durations = get_fail_durations(session, dag, start_date, end_date)
+        cum_points = defaultdict(list)
+        for ti in tis:
+            if ti.duration:
+                x = epoch(ti.execution_date)
+                fails_total = fail_durations.get(
+                    (ti.task_id, ti.execution_date), 0)
+                points[ti.task_id].append(
+                    (x, float(ti.duration) / (60 * 60)))
+                cum_points[ti.task_id].append(
+                    (x, float(ti.duration + fails_total) / (60 * 60)))
+        data['cum_series'] = _build_series(dag, cum_points)
+    elif kind == 'tries':
+        for ti in tis:
+            points[ti.task_id].append(
+                (epoch(ti.execution_date), ti.try_number))
+    elif kind == 'landing_times':
+        following_schedules = {}
+        for ti in tis:
+            if not ti.end_date:
+                continue
+            ts = ti.execution_date
+            if dag.schedule_interval:
+                if ts not in following_schedules:
+                    following_schedules[ts] = dag.following_schedule(ts)
+                ts = following_schedules[ts]
+            points[ti.task_id].append((
+                epoch(ti.execution_date),
+                (ti.end_date - ts).total_seconds() / (60 * 60)))
+    else:
+        raise ValueError("Unknown chart {}".format(kind))
+    data['series'] = _build_series(dag, points)
+    return data
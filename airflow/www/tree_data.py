@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+The data of the tree view, in two halves: the structure of the tree, which
+only changes when the DAG is parsed again and is cached, and the states of
+the DAG runs and task instances, which can be fetched as the changes since
+a previous fetch.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from airflow import models
+from airflow.utils.state import State
+
+# How many tree structures are kept, by DAG and root tasks
+TREE_STRUCTURE_CACHE_SIZE = 100
+# The changes are fetched from a bit before the requested time, so that the
+# task instances written by a machine whose clock is late aren't missed
+TREE_CHANGES_OVERLAP = timedelta(minutes=1)
+
+# (DAG, structure) by (dag_id, root)
+_structures = OrderedDict()
+
+
+def get_tree_structure(dag, root=None):
+    """
+    :param dag: the DAG, as loaded by the DagBag
+    :type dag: airflow.models.DAG
+    :param root: the regex of the root tasks, to show only their upstream
+    :type root: unicode
+    :return: the nodes of the tree, without their task instances. It is
+    cached until the DagBag loads another version of the DAG.
+    :rtype: dict
+    """
+    key = (dag.dag_id, root or None)
+    cached = _structures.pop(key, None)
+    if cached is None or cached[0] is not dag:
+        cached = (dag, _build_tree_structure(dag, root))
+    _structures[key] = cached
+    while len(_structures) > TREE_STRUCTURE_CACHE_SIZE:
+        _structures.popitem(last=False)
+    return cached[1]
+
+
+def _build_tree_structure(dag, root=None):
+    if root:
+        dag = dag.sub_dag(
+            task_regex=root,
+            include_downstream=False,
+            include_upstream=True)
+
+    expanded = set()
+    # The default recursion traces every path so that tree view has full
+    # expand/collapse functionality. After 5,000 nodes we stop and fall
+    # back on a quick DFS search for performance. See PR #320.
+    node_count = [0]
+    node_limit = 5000 / max(1, len(dag.roots))
+
+    def recurse_nodes(task, visited):
+        visited.add(task)
+        node_count[0] += 1
+
+        children = [
+            recurse_nodes(t, visited) for t in task.upstream_list
+            if node_count[0] < node_limit or t not in visited]
+
+        # D3 tree uses children vs _children to define what is
+        # expanded or not. The following block makes it such that
+        # repeated nodes are collapsed by default.
+        children_key = 'children'
+        if task.task_id not in expanded:
+            expanded.add(task.task_id)
+        elif children:
+            children_key = "_children"
+
+        return {
+            'name': task.task_id,
+            children_key: children,
+            'num_dep': len(task.upstream_list),
+            'operator': task.task_type,
+            'retries': task.retries,
+            'owner': task.owner,
+            'start_date': task.start_date,
+            'end_date': task.end_date,
+            'depends_on_past': task.depends_on_past,
+            'ui_color': task.ui_color,
+        }
+
+    return {
+        'name': '[DAG]',
+        'children': [recurse_nodes(t, set()) for t in dag.roots],
+    }
+
+
+def _isoformat(dttm):
+    return dttm.isoformat() if dttm else None
+
+
+def get_tree_instances(session, dag, start_date, end_date, since=None):
+    """
+    :param dag: the DAG, or its sub_dag for the root tasks
+    :type dag: airflow.models.DAG
+    :param since: the timestamp of a previous fetch, to only get the task
+    instances that changed since then
+    :type since: datetime
+    :return: the DAG runs of the window, their task instances (or those that
+    changed) and the timestamp to fetch the next changes from
+    :rtype: dict
+    """
+    DR = models.DagRun
+    dag_runs = (
+        session.query(DR)
+        .filter(
+            DR.dag_id == dag.dag_id,
+            DR.execution_date <= end_date,
+            DR.execution_date >= start_date)
+        .order_by(DR.execution_date)
+        .all())
+
+    TI = models.TaskInstance
+    qry = (
+        session.query(
+            TI.task_id, TI.execution_date, TI.state, TI.try_number,
+            TI.start_date, TI.end_date, TI.duration, TI.operator,
+            TI.updated_at)
+        .filter(
+            TI.dag_id == dag.dag_id,
+            TI.execution_date <= end_date,
+            TI.execution_date >= start_date))
+    if since:
+        qry = qry.filter(TI.updated_at >= since - TREE_CHANGES_OVERLAP)
+
+    now = datetime.now()
+    timestamp = since
+    task_instances = []
+    for ti in qry:
+        if ti.task_id not in dag.task_dict:
+            continue
+        if ti.updated_at and (timestamp is None or ti.updated_at > timestamp):
+            timestamp = ti.updated_at
+        duration = ti.duration
+        if ti.state == State.RUNNING and ti.start_date:
+            duration = (now - ti.start_date).total_seconds()
+        task_instances.append({
+            'task_id': ti.task_id,
+            'execution_date': ti.execution_date.isoformat(),
+            'state': ti.state,
+            'try_number': ti.try_number,
+            'start_date': _isoformat(ti.start_date),
+            'end_date': _isoformat(ti.end_date),
+            'duration': duration,
+            'operator': ti.operator,
+        })
+
+    return {
+        'dag_runs': [{
+            'id': dr.id,
+            'run_id': dr.run_id,
+            'execution_date': dr.execution_date.isoformat(),
+            'state': dr.state,
+            'start_date': _isoformat(dr.start_date),
+            'end_date': _isoformat(dr.end_date),
+            'external_trigger': dr.external_trigger,
+        } for dr in dag_runs],
+        'task_instances': task_instances,
+        'since': _isoformat(since),
+        'timestamp': _isoformat(timestamp),
+    }
@@ -13,7 +13,6 @@
 # limitations under the License.
 #
 
-from past.utils import old_div
 from past.builtins import basestring, unicode
 
 import os
@@ -33,7 +32,7 @@ from textwrap import dedent
 import traceback
 
 import sqlalchemy as sqla
-from sqlalchemy import or_, desc, and_, union_all
+from sqlalchemy import or_, desc
 
 from flask import (
     redirect, url_for, request, Markup, Response, current_app, render_template, make_response)
@@ -65,22 +64,38 @@ from airflow.models import XCom, DagRun, TaskExclusion, TaskExclusionType
 from airflow.ti_deps.dep_context import DepContext, QUEUE_DEPS, SCHEDULER_DEPS
 
 from airflow.models import BaseOperator
-from airflow.operators.subdag_operator import SubDagOperator
+from airflow.dag.serialization import SerializedDagBag
 
 from airflow.utils.logging import LoggingMixin
+from airflow.utils.lookup_cache import LookupCache
 from airflow.utils.json import json_ser
 from airflow.utils.state import State
 from airflow.utils.db import provide_session
 from airflow.utils.helpers import alchemy_to_dict
 from airflow.utils import logging as log_utils
+from airflow.utils import xcom_storage
+from airflow.www import chart_data
+from airflow.www import tree_data
 from airflow.www import utils as wwwutils
 from airflow.www.forms import DateTimeForm, DateTimeWithNumRunsForm
 from airflow.configuration import AirflowConfigException
 
 QUERY_LIMIT = 100000
 CHART_LIMIT = 200000
+# How many runs the run selector of the graph view lists at first
+DAG_RUN_CHOICES_LIMIT = 25
+# How long the browsers may reuse the chart series without revalidating them
+CHART_DATA_MAX_AGE = 60
 
-dagbag = models.DagBag(os.path.expanduser(conf.get('core', 'DAGS_FOLDER')))
+# The payloads of /dag_stats and /task_stats, shared by the home pages
+# loaded at the same time
+dashboard_stats_cache = LookupCache(
+    'dashboard stats', ttl=conf.getint('webserver', 'dashboard_stats_ttl'))
+
+if conf.getboolean('core', 'store_serialized_dags'):
+    dagbag = SerializedDagBag()
+else:
+    dagbag = models.DagBag(os.path.expanduser(conf.get('core', 'DAGS_FOLDER')))
 
 login_required = airflow.login.login_required
 current_user = airflow.login.current_user
@@ -222,7 +237,8 @@ attr_renderer = {
     'doc_yaml': lambda x: render(x, lexers.YamlLexer),
     'doc_md': wrapped_markdown,
     'python_callable': lambda x: render(
-        inspect.getsource(x), lexers.PythonLexer),
+        x if isinstance(x, basestring) else inspect.getsource(x),
+        lexers.PythonLexer),
 }
 
 
@@ -264,7 +280,8 @@ def recurse_tasks(tasks, task_ids, dag_ids, task_id_to_dag):
         for task in tasks:
             recurse_tasks(task, task_ids, dag_ids, task_id_to_dag)
         return
-    if isinstance(tasks, SubDagOperator):
+    # Check the class name, the tasks of serialized DAGs only have the name
+    if tasks.__class__.__name__ == 'SubDagOperator':
         subtasks = tasks.subdag.tasks
         dag_ids.append(tasks.subdag.dag_id)
         for subtask in subtasks:
@@ -276,6 +293,19 @@ def recurse_tasks(tasks, task_ids, dag_ids, task_id_to_dag):
         task_id_to_dag[tasks.task_id] = tasks.dag
 
 
+def get_dag_runs(session, dag_id, before=None, limit=DAG_RUN_CHOICES_LIMIT):
+    """
+    :return: the latest runs of the DAG, optionally only the ones before an
+    execution date
+    :rtype: list[airflow.models.DagRun]
+    """
+    DR = models.DagRun
+    qry = session.query(DR).filter(DR.dag_id == dag_id)
+    if before:
+        qry = qry.filter(DR.execution_date < before)
+    return qry.order_by(desc(DR.execution_date)).limit(limit).all()
+
+
 def should_hide_value_for_key(key_name):
     return any(s in key_name for s in DEFAULT_SENSITIVE_VARIABLE_FIELDS) \
            and conf.getboolean('admin', 'hide_sensitive_variable_fields')
@@ -467,6 +497,10 @@ class Airflow(BaseView):
 
     @expose('/dag_stats')
     def dag_stats(self):
+        return wwwutils.json_response(
+            dashboard_stats_cache.get('dag_stats', self._get_dag_stats))
+
+    def _get_dag_stats(self):
         ds = models.DagStat
         session = Session()
 
@@ -479,6 +513,8 @@ class Airflow(BaseView):
             if dag_id not in data:
                 data[dag_id] = {}
             data[dag_id][state] = count
+        session.commit()
+        session.close()
 
         payload = {}
         for dag in dagbag.dags.values():
@@ -495,60 +531,29 @@ class Airflow(BaseView):
                     'color': State.color(state)
                 }
                 payload[dag.safe_dag_id].append(d)
-        return wwwutils.json_response(payload)
+        return payload
 
     @expose('/task_stats')
     def task_stats(self):
-        task_ids = []
-        dag_ids = []
-        for dag in dagbag.dags.values():
-            task_ids += dag.task_ids
-            if not dag.is_subdag:
-                dag_ids.append(dag.dag_id)
+        return wwwutils.json_response(
+            dashboard_stats_cache.get('task_stats', self._get_task_stats))
 
-        TI = models.TaskInstance
-        DagRun = models.DagRun
+    def _get_task_stats(self):
+        """
+        Reads the counts of the task instances in the task_stats table, after
+        counting again those of the DAGs whose task instances changed since
+        they were counted, e.g. by a backfill while no scheduler is running.
+        """
+        ts = models.TaskStat
         session = Session()
 
-        LastDagRun = (
-            session.query(DagRun.dag_id, sqla.func.max(DagRun.execution_date).label('execution_date'))
-            .filter(DagRun.state != State.RUNNING)
-            .group_by(DagRun.dag_id)
-            .subquery('last_dag_run')
-        )
-        RunningDagRun = (
-            session.query(DagRun.dag_id, DagRun.execution_date)
-            .filter(DagRun.state == State.RUNNING)
-            .subquery('running_dag_run')
-        )
-
-        # Select all task_instances from active dag_runs.
-        # If no dag_run is active, return task instances from most recent dag_run.
-        LastTI = (
-            session.query(TI.dag_id.label('dag_id'), TI.state.label('state'))
-            .join(LastDagRun, and_(
-                LastDagRun.c.dag_id == TI.dag_id,
-                LastDagRun.c.execution_date == TI.execution_date))
-            .filter(TI.task_id.in_(task_ids))
-            .filter(TI.dag_id.in_(dag_ids))
-        )
-        RunningTI = (
-            session.query(TI.dag_id.label('dag_id'), TI.state.label('state'))
-            .join(RunningDagRun, and_(
-                RunningDagRun.c.dag_id == TI.dag_id,
-                RunningDagRun.c.execution_date == TI.execution_date))
-            .filter(TI.task_id.in_(task_ids))
-            .filter(TI.dag_id.in_(dag_ids))
-        )
-
-        UnionTI = union_all(LastTI, RunningTI).alias('union_ti')
-        qry = (
-            session.query(UnionTI.c.dag_id, UnionTI.c.state, sqla.func.count())
-            .group_by(UnionTI.c.dag_id, UnionTI.c.state)
-        )
+        all_dags = dagbag.dags
+        dags = [dag for dag in all_dags.values() if not dag.is_subdag]
+        models.TaskStat.update(dags, session=session)
 
         data = {}
-        for dag_id, state, count in qry:
+        for dag_id, state, count in session.query(
+                ts.dag_id, ts.state, ts.count):
             if dag_id not in data:
                 data[dag_id] = {}
             data[dag_id][state] = count
@@ -556,7 +561,7 @@ class Airflow(BaseView):
         session.close()
 
         payload = {}
-        for dag in dagbag.dags.values():
+        for dag in all_dags.values():
             payload[dag.safe_dag_id] = []
             for state in State.task_states:
                 try:
@@ -570,7 +575,7 @@ class Airflow(BaseView):
                     'color': State.color(state)
                 }
                 payload[dag.safe_dag_id].append(d)
-        return wwwutils.json_response(payload)
+        return payload
 
     @expose('/code')
     @login_required
@@ -579,8 +584,13 @@ class Airflow(BaseView):
         dag = dagbag.get_dag(dag_id)
         title = dag_id
         try:
-            m = importlib.import_module(dag.module_name)
-            code = inspect.getsource(m)
+            if hasattr(dag, 'module_name'):
+                m = importlib.import_module(dag.module_name)
+                code = inspect.getsource(m)
+            else:
+                # Serialized DAGs aren't imported, read their file instead
+                with open(dag.fileloc) as f:
+                    code = f.read()
             html_code = highlight(
                 code, lexers.PythonLexer(), HtmlFormatter(linenos=True))
         except IOError as e:
@@ -672,6 +682,10 @@ class Airflow(BaseView):
         dttm = dateutil.parser.parse(execution_date)
         form = DateTimeForm(data={'execution_date': dttm})
         dag = dagbag.get_dag(dag_id)
+        if isinstance(dagbag, SerializedDagBag):
+            # Rendering the templates needs the DAG's macros and operators
+            dag = models.DagBag(dag.fileloc, include_examples=False).get_dag(
+                dag_id) or dag
         task = copy.copy(dag.get_task(task_id))
         ti = models.TaskInstance(task=task, execution_date=dttm)
         try:
@@ -1064,11 +1078,13 @@ class Airflow(BaseView):
             .group_by(DR.dag_id)
             .all()
         )
+        # Read once, as the serialized DAG bag queries the DAGs on each access
+        webserver_dags = dagbag.dags
         payload = []
         for dag_id, active_dag_runs in dags:
             max_active_runs = 0
-            if dag_id in dagbag.dags:
-                max_active_runs = dagbag.dags[dag_id].max_active_runs
+            if dag_id in webserver_dags:
+                max_active_runs = webserver_dags[dag_id].max_active_runs
             payload.append({
                 'dag_id': dag_id,
                 'active_dag_run': active_dag_runs,
@@ -1247,130 +1263,104 @@ class Airflow(BaseView):
 
         return redirect(origin)
 
-    @expose('/tree')
-    @login_required
-    @wwwutils.gzipped
-    @wwwutils.action_logging
-    def tree(self):
+    def _get_tree_args(self):
+        """
+        :return: the DAG, its sub_dag for the root tasks, the date window and
+        the number of runs of the tree view's request arguments
+        """
         dag_id = request.args.get('dag_id')
-        blur = conf.getboolean('webserver', 'demo_mode')
         dag = dagbag.get_dag(dag_id)
         root = request.args.get('root')
+        sub_dag = dag
         if root:
-            dag = dag.sub_dag(
+            sub_dag = dag.sub_dag(
                 task_regex=root,
                 include_downstream=False,
                 include_upstream=True)
 
-        session = settings.Session()
-
         base_date = request.args.get('base_date')
+        base_date = dateutil.parser.parse(base_date) if base_date else None
         num_runs = request.args.get('num_runs')
         num_runs = int(num_runs) if num_runs else 25
+        min_date, base_date = chart_data.get_date_window(
+            dag, base_date, num_runs)
+        return dag, sub_dag, min_date, base_date, num_runs
 
-        if base_date:
-            base_date = dateutil.parser.parse(base_date)
-        else:
-            base_date = dag.latest_execution_date or datetime.now()
-
-        dates = dag.date_range(base_date, num=-abs(num_runs))
-        min_date = dates[0] if dates else datetime(2000, 1, 1)
-
-        DR = models.DagRun
-        dag_runs = (
-            session.query(DR)
-            .filter(
-                DR.dag_id==dag.dag_id,
-                DR.execution_date<=base_date,
-                DR.execution_date>=min_date)
-            .all()
-        )
-        dag_runs = {
-            dr.execution_date: alchemy_to_dict(dr) for dr in dag_runs}
-
-        dates = sorted(list(dag_runs.keys()))
-        max_date = max(dates) if dates else None
-
-        tis = dag.get_task_instances(
-                session, start_date=min_date, end_date=base_date)
-        task_instances = {}
-        for ti in tis:
-            tid = alchemy_to_dict(ti)
-            dr = dag_runs.get(ti.execution_date)
-            tid['external_trigger'] = dr['external_trigger'] if dr else False
-            task_instances[(ti.task_id, ti.execution_date)] = tid
-
-        expanded = []
-        # The default recursion traces every path so that tree view has full
-        # expand/collapse functionality. After 5,000 nodes we stop and fall
-        # back on a quick DFS search for performance. See PR #320.
-        node_count = [0]
-        node_limit = 5000 / max(1, len(dag.roots))
-
-        def recurse_nodes(task, visited):
-            visited.add(task)
-            node_count[0] += 1
-
-            children = [
-                recurse_nodes(t, visited) for t in task.upstream_list
-                if node_count[0] < node_limit or t not in visited]
-
-            # D3 tree uses children vs _children to define what is
-            # expanded or not. The following block makes it such that
-            # repeated nodes are collapsed by default.
-            children_key = 'children'
-            if task.task_id not in expanded:
-                expanded.append(task.task_id)
-            elif children:
-                children_key = "_children"
-
-            def set_duration(tid):
-                if isinstance(tid, dict) and tid.get("state") == State.RUNNING:
-                    d = datetime.now() - dateutil.parser.parse(tid["start_date"])
-                    tid["duration"] = d.total_seconds()
-                return tid
-
-            return {
-                'name': task.task_id,
-                'instances': [
-                        set_duration(task_instances.get((task.task_id, d))) or {
-                            'execution_date': d.isoformat(),
-                            'task_id': task.task_id
-                        }
-                    for d in dates],
-                children_key: children,
-                'num_dep': len(task.upstream_list),
-                'operator': task.task_type,
-                'retries': task.retries,
-                'owner': task.owner,
-                'start_date': task.start_date,
-                'end_date': task.end_date,
-                'depends_on_past': task.depends_on_past,
-                'ui_color': task.ui_color,
-            }
-        data = {
-            'name': '[DAG]',
-            'children': [recurse_nodes(t, set()) for t in dag.roots],
-            'instances': [
-                dag_runs.get(d) or {'execution_date': d.isoformat()}
-                for d in dates],
-        }
+    @expose('/tree')
+    @login_required
+    @wwwutils.gzipped
+    @wwwutils.action_logging
+    def tree(self):
+        blur = conf.getboolean('webserver', 'demo_mode')
+        root = request.args.get('root')
+        dag, sub_dag, min_date, base_date, num_runs = self._get_tree_args()
 
-        data = json.dumps(data, indent=4, default=json_ser)
+        session = settings.Session()
+        instances = tree_data.get_tree_instances(
+            session, sub_dag, start_date=min_date, end_date=base_date)
         session.commit()
         session.close()
 
+        dates = [dr['execution_date'] for dr in instances['dag_runs']]
+        max_date = dateutil.parser.parse(dates[-1]) if dates else None
         form = DateTimeWithNumRunsForm(data={'base_date': max_date,
                                              'num_runs': num_runs})
         return self.render(
             'airflow/tree.html',
             operators=sorted(
-                list(set([op.__class__ for op in dag.tasks])),
+                list(set([op.__class__ for op in sub_dag.tasks])),
                 key=lambda x: x.__name__
             ),
             root=root,
             form=form,
-            dag=dag, data=data, blur=blur)
+            dag=sub_dag,
+            data=json.dumps(
+                tree_data.get_tree_structure(dag, root),
+                indent=4, default=json_ser),
+            instances=json.dumps(instances),
+            base_date=request.args.get('base_date', ''),
+            num_runs=num_runs,
+            refresh_rate=conf.getint('webserver', 'tree_refresh_rate'),
+            blur=blur)
+
+    @expose('/object/tree_structure')
+    @login_required
+    @wwwutils.gzipped
+    def tree_structure(self):
+        """
+        The nodes of the tree view of a DAG, without their task instances.
+        They are cached until the DAG is parsed again, and the response has
+        an ETag for the browsers to revalidate it.
+        """
+        dag = dagbag.get_dag(request.args.get('dag_id'))
+        structure = tree_data.get_tree_structure(
+            dag, request.args.get('root'))
+        response = wwwutils.json_response(structure)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.add_etag()
+        return response.make_conditional(request)
+
+    @expose('/object/tree_instances')
+    @login_required
+    @wwwutils.gzipped
+    def tree_instances(self):
+        """
+        The DAG runs and task instances of the tree view of a DAG. With
+        `since`, the timestamp of a previous response, only the task
+        instances that changed since then are returned.
+        """
+        _, sub_dag, min_date, base_date, _ = self._get_tree_args()
+        since = request.args.get('since')
+        since = dateutil.parser.parse(since) if since else None
+
+        session = settings.Session()
+        instances = tree_data.get_tree_instances(
+            session, sub_dag, start_date=min_date, end_date=base_date,
+            since=since)
+        session.commit()
+        session.close()
+        return wwwutils.json_response(instances)
 
     @expose('/graph')
     @login_required
@@ -1381,7 +1371,7 @@ class Airflow(BaseView):
         dag_id = request.args.get('dag_id')
         blur = conf.getboolean('webserver', 'demo_mode')
         dag = dagbag.get_dag(dag_id)
-        if dag_id not in dagbag.dags:
+        if not dag:
             flash('DAG "{0}" seems to be missing.'.format(dag_id), "error")
             return redirect('/admin/')
 
@@ -1394,8 +1384,10 @@ class Airflow(BaseView):
 
         arrange = request.args.get('arrange', dag.orientation)
 
+        # One pass over the tasks, every edge is the upstream edge of a task
         nodes = []
         edges = []
+        seen_edges = set()
         for task in dag.tasks:
             nodes.append({
                 'id': task.task_id,
@@ -1405,19 +1397,11 @@ class Airflow(BaseView):
                     'style': "fill:{0};".format(task.ui_color),
                 }
             })
-
-        def get_upstream(task):
-            for t in task.upstream_list:
-                edge = {
-                    'u': t.task_id,
-                    'v': task.task_id,
-                }
-                if edge not in edges:
-                    edges.append(edge)
-                    get_upstream(t)
-
-        for t in dag.roots:
-            get_upstream(t)
+            for upstream_task_id in task.upstream_task_ids:
+                edge = (upstream_task_id, task.task_id)
+                if edge not in seen_edges:
+                    seen_edges.add(edge)
+                    edges.append({'u': upstream_task_id, 'v': task.task_id})
 
         dttm = request.args.get('execution_date')
         if dttm:
@@ -1425,12 +1409,18 @@ class Airflow(BaseView):
         else:
             dttm = dag.latest_execution_date or datetime.now().date()
 
+        # Only the latest runs are listed, the older ones are loaded by the
+        # page from /object/dag_runs when asked for
         DR = models.DagRun
-        drs = (
-            session.query(DR)
-            .filter_by(dag_id=dag_id)
-            .order_by(desc(DR.execution_date)).all()
-        )
+        drs = get_dag_runs(session, dag_id, limit=DAG_RUN_CHOICES_LIMIT)
+        older_drs_before = None
+        if len(drs) >= DAG_RUN_CHOICES_LIMIT:
+            older_drs_before = drs[-1].execution_date.isoformat()
+        if dttm not in [dr.execution_date for dr in drs]:
+            drs += (
+                session.query(DR)
+                .filter(DR.dag_id == dag_id, DR.execution_date == dttm)
+                .all())
         dr_choices = []
         dr_state = None
         for dr in drs:
@@ -1488,26 +1478,23 @@ class Airflow(BaseView):
             tasks=json.dumps(tasks, indent=2),
             nodes=json.dumps(nodes, indent=2),
             edges=json.dumps(edges, indent=2),
+            older_drs_before=older_drs_before,
+            dag_run_choices_limit=DAG_RUN_CHOICES_LIMIT,
             refresh_rate=refresh_rate)
 
-    @expose('/duration')
-    @login_required
-    @wwwutils.action_logging
-    def duration(self):
-        session = settings.Session()
+    def _get_chart_data(self, session, kind):
+        """
+        :return: the DAG (or its sub_dag for the root tasks), the number of
+        runs and the chart data of the request's arguments
+        """
         dag_id = request.args.get('dag_id')
         dag = dagbag.get_dag(dag_id)
         base_date = request.args.get('base_date')
+        base_date = dateutil.parser.parse(base_date) if base_date else None
         num_runs = request.args.get('num_runs')
         num_runs = int(num_runs) if num_runs else 25
-
-        if base_date:
-            base_date = dateutil.parser.parse(base_date)
-        else:
-            base_date = dag.latest_execution_date or datetime.now()
-
-        dates = dag.date_range(base_date, num=-abs(num_runs))
-        min_date = dates[0] if dates else datetime(2000, 1, 1)
+        min_date, base_date = chart_data.get_date_window(
+            dag, base_date, num_runs)
 
         root = request.args.get('root')
         if root:
@@ -1516,40 +1503,29 @@ class Airflow(BaseView):
                 include_upstream=True,
                 include_downstream=False)
 
+        data = chart_data.get_chart_data(
+            session, dag, kind, start_date=min_date, end_date=base_date)
+        return dag, num_runs, data
+
+    @expose('/duration')
+    @login_required
+    @wwwutils.action_logging
+    def duration(self):
+        session = settings.Session()
+        dag, num_runs, data = self._get_chart_data(session, 'duration')
+        session.commit()
+        session.close()
+
         chart = nvd3.lineChart(
             name="lineChart", x_is_date=True, height=600, width="1200")
         cum_chart = nvd3.lineChart(
             name="cumLineChart", x_is_date=True, height=600, width="1200")
+        for serie in data['series']:
+            chart.add_serie(**serie)
+        for serie in data['cum_series']:
+            cum_chart.add_serie(**serie)
 
-        for task in dag.tasks:
-            y = []
-            x = []
-            cum_y = []
-            for ti in task.get_task_instances(session, start_date=min_date,
-                                              end_date=base_date):
-                if ti.duration:
-                    dttm = wwwutils.epoch(ti.execution_date)
-                    x.append(dttm)
-                    y.append(float(ti.duration) / (60*60))
-                    fails = session.query(models.TaskFail).filter_by(
-                        task_id=ti.task_id,
-                        dag_id=ti.dag_id,
-                        execution_date=ti.execution_date).all()
-                    fails_total = sum([f.duration for f in fails])
-                    cum_y.append(float(ti.duration + fails_total) / (60*60))
-            if x:
-                chart.add_serie(name=task.task_id, x=x, y=y)
-                cum_chart.add_serie(name=task.task_id, x=x, y=cum_y)
-
-        tis = dag.get_task_instances(
-            session, start_date=min_date, end_date=base_date)
-        dates = sorted(list({ti.execution_date for ti in tis}))
-        max_date = max([ti.execution_date for ti in tis]) if dates else None
-
-        session.commit()
-        session.close()
-
-        form = DateTimeWithNumRunsForm(data={'base_date': max_date,
+        form = DateTimeWithNumRunsForm(data={'base_date': data['max_date'],
                                              'num_runs': num_runs})
         chart.buildhtml()
         cum_chart.buildhtml()
@@ -1564,7 +1540,7 @@ class Airflow(BaseView):
             'airflow/duration_chart.html',
             dag=dag,
             demo_mode=conf.getboolean('webserver', 'demo_mode'),
-            root=root,
+            root=request.args.get('root'),
             form=form,
             chart=chart,
             cum_chart=html.tostring(cum_chart_body)
@@ -1575,50 +1551,16 @@ class Airflow(BaseView):
     @wwwutils.action_logging
     def tries(self):
         session = settings.Session()
-        dag_id = request.args.get('dag_id')
-        dag = dagbag.get_dag(dag_id)
-        base_date = request.args.get('base_date')
-        num_runs = request.args.get('num_runs')
-        num_runs = int(num_runs) if num_runs else 25
-
-        if base_date:
-            base_date = dateutil.parser.parse(base_date)
-        else:
-            base_date = dag.latest_execution_date or datetime.now()
-
-        dates = dag.date_range(base_date, num=-abs(num_runs))
-        min_date = dates[0] if dates else datetime(2000, 1, 1)
-
-        root = request.args.get('root')
-        if root:
-            dag = dag.sub_dag(
-                task_regex=root,
-                include_upstream=True,
-                include_downstream=False)
+        dag, num_runs, data = self._get_chart_data(session, 'tries')
+        session.commit()
+        session.close()
 
         chart = nvd3.lineChart(
             name="lineChart", x_is_date=True, y_axis_format='d', height=600, width="1200")
+        for serie in data['series']:
+            chart.add_serie(**serie)
 
-        for task in dag.tasks:
-            y = []
-            x = []
-            for ti in task.get_task_instances(session, start_date=min_date,
-                                              end_date=base_date):
-                dttm = wwwutils.epoch(ti.execution_date)
-                x.append(dttm)
-                y.append(ti.try_number)
-            if x:
-                chart.add_serie(name=task.task_id, x=x, y=y)
-
-        tis = dag.get_task_instances(
-            session, start_date=min_date, end_date=base_date)
-        tries = sorted(list({ti.try_number for ti in tis}))
-        max_date = max([ti.execution_date for ti in tis]) if tries else None
-
-        session.commit()
-        session.close()
-
-        form = DateTimeWithNumRunsForm(data={'base_date': max_date,
+        form = DateTimeWithNumRunsForm(data={'base_date': data['max_date'],
                                              'num_runs': num_runs})
 
         chart.buildhtml()
@@ -1627,7 +1569,7 @@ class Airflow(BaseView):
             'airflow/chart.html',
             dag=dag,
             demo_mode=conf.getboolean('webserver', 'demo_mode'),
-            root=root,
+            root=request.args.get('root'),
             form=form,
             chart=chart
         )
@@ -1637,54 +1579,16 @@ class Airflow(BaseView):
     @wwwutils.action_logging
     def landing_times(self):
         session = settings.Session()
-        dag_id = request.args.get('dag_id')
-        dag = dagbag.get_dag(dag_id)
-        base_date = request.args.get('base_date')
-        num_runs = request.args.get('num_runs')
-        num_runs = int(num_runs) if num_runs else 25
-
-        if base_date:
-            base_date = dateutil.parser.parse(base_date)
-        else:
-            base_date = dag.latest_execution_date or datetime.now()
-
-        dates = dag.date_range(base_date, num=-abs(num_runs))
-        min_date = dates[0] if dates else datetime(2000, 1, 1)
-
-        root = request.args.get('root')
-        if root:
-            dag = dag.sub_dag(
-                task_regex=root,
-                include_upstream=True,
-                include_downstream=False)
+        dag, num_runs, data = self._get_chart_data(session, 'landing_times')
+        session.commit()
+        session.close()
 
         chart = nvd3.lineChart(
             name="lineChart", x_is_date=True, height=600, width="1200")
-        for task in dag.tasks:
-            y = []
-            x = []
-            for ti in task.get_task_instances(session, start_date=min_date,
-                                              end_date=base_date):
-                ts = ti.execution_date
-                if dag.schedule_interval:
-                    ts = dag.following_schedule(ts)
-                if ti.end_date:
-                    dttm = wwwutils.epoch(ti.execution_date)
-                    secs = old_div((ti.end_date - ts).total_seconds(), 60*60)
-                    x.append(dttm)
-                    y.append(secs)
-            if x:
-                chart.add_serie(name=task.task_id, x=x, y=y)
-
-        tis = dag.get_task_instances(
-                session, start_date=min_date, end_date=base_date)
-        dates = sorted(list({ti.execution_date for ti in tis}))
-        max_date = max([ti.execution_date for ti in tis]) if dates else None
+        for serie in data['series']:
+            chart.add_serie(**serie)
 
-        session.commit()
-        session.close()
-
-        form = DateTimeWithNumRunsForm(data={'base_date': max_date,
+        form = DateTimeWithNumRunsForm(data={'base_date': data['max_date'],
                                              'num_runs': num_runs})
         return self.render(
             'airflow/chart.html',
@@ -1692,10 +1596,35 @@ class Airflow(BaseView):
             chart=chart,
             height="700px",
             demo_mode=conf.getboolean('webserver', 'demo_mode'),
-            root=root,
+            root=request.args.get('root'),
             form=form,
         )
 
+    @expose('/object/chart_series')
+    @login_required
+    def chart_series(self):
+        """
+        The series of the duration, tries or landing_times chart (given by
+        `kind`) of a DAG as JSON. The response has an ETag, so that browsers
+        and proxies revalidate it rather than download it again.
+        """
+        kind = request.args.get('kind')
+        if kind not in chart_data.CHART_KINDS:
+            return wwwutils.json_response({
+                'error': "kind must be one of {}".format(
+                    ', '.join(chart_data.CHART_KINDS))}), 400
+
+        session = settings.Session()
+        _, _, data = self._get_chart_data(session, kind)
+        session.commit()
+        session.close()
+
+        response = wwwutils.json_response(data)
+        response.cache_control.private = True
+        response.cache_control.max_age = CHART_DATA_MAX_AGE
+        response.add_etag()
+        return response.make_conditional(request)
+
     @expose('/paused')
     @login_required
     @wwwutils.action_logging
@@ -1828,6 +1757,28 @@ class Airflow(BaseView):
 
         return json.dumps(task_instances)
 
+    @expose('/object/dag_runs')
+    @login_required
+    def dag_runs(self):
+        """
+        The runs of a DAG older than the `before` execution date, latest
+        first, for the run selector of the graph view.
+        """
+        session = settings.Session()
+        dag_id = request.args.get('dag_id')
+        before = request.args.get('before')
+        before = dateutil.parser.parse(before) if before else None
+        limit = min(int(request.args.get('limit', DAG_RUN_CHOICES_LIMIT)),
+                    QUERY_LIMIT)
+
+        drs = get_dag_runs(session, dag_id, before=before, limit=limit)
+        session.close()
+        return wwwutils.json_response([{
+            'execution_date': dr.execution_date.isoformat(),
+            'run_id': dr.run_id,
+            'state': dr.state,
+        } for dr in drs])
+
     @expose('/variables/<form>', methods=["GET", "POST"])
     @login_required
     @wwwutils.action_logging
@@ -2274,6 +2225,12 @@ class VariableView(wwwutils.DataProfilingMixin, AirflowModelView):
         if should_hide_value_for_key(form.key.data):
             form.val.data = '*' * 8
 
+    def after_model_change(self, form, model, is_created):
+        models.ConfigVersion.bump()
+
+    def after_model_delete(self, model):
+        models.ConfigVersion.bump()
+
 
 class XComView(wwwutils.LoginMixin, AirflowModelView):
     verbose_name = "XCom"
@@ -2295,6 +2252,9 @@ class XComView(wwwutils.LoginMixin, AirflowModelView):
     column_filters = ('key', 'timestamp', 'execution_date', 'task_id', 'dag_id')
     column_searchable_list = ('key', 'timestamp', 'execution_date', 'task_id', 'dag_id')
 
+    def after_model_delete(self, model):
+        xcom_storage.remove([model.value])
+
 
 class JobModelView(ModelViewOnly):
     verbose_name_plural = "jobs"
@@ -2568,6 +2528,12 @@ class ConnectionModelView(wwwutils.SuperUserMixin, AirflowModelView):
                 for key in self.form_extra_fields.keys() if key in formdata}
             model.extra = json.dumps(extra)
 
+    def after_model_change(self, form, model, is_created):
+        models.ConfigVersion.bump()
+
+    def after_model_delete(self, model):
+        models.ConfigVersion.bump()
+
     @classmethod
     def alert_fernet_key(cls):
         fk = None
@@ -126,6 +126,7 @@ gcp_api = [
     'PyOpenSSL',
 ]
 hdfs = ['snakebite>=2.7.8']
+inotify = ['pyinotify>=0.9.6']
 webhdfs = ['hdfs[dataframe,avro,kerberos]>=2.0.4']
 hive = [
     'hive-thrift-py>=0.0.1',
@@ -239,6 +240,7 @@ def do_setup():
             'github_enterprise': github_enterprise,
             'hdfs': hdfs,
             'hive': hive,
+            'inotify': inotify,
             'jdbc': jdbc,
             'kerberos': kerberos,
             'ldap': ldap,
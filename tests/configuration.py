@@ -14,8 +14,12 @@
 
 from __future__ import print_function
 import os
+import subprocess
+import sys
 import unittest
 
+from configparser import ConfigParser
+
 from airflow import configuration
 from airflow.configuration import conf
 
@@ -52,3 +56,14 @@ class ConfTest(unittest.TestCase):
         cfg_dict = conf.as_dict(display_sensitive=True, display_source=True)
         self.assertEqual(
             cfg_dict['testsection']['testkey'], ('testvalue', 'env var'))
+
+    def test_default_configs_parse(self):
+        # Duplicated options make the strict parser fail at import time
+        for config in (configuration.DEFAULT_CONFIG,
+                       configuration.TEST_CONFIG):
+            parser = ConfigParser(strict=True)
+            parser.read_string(configuration.parameterized_config(config))
+
+    def test_import_configuration(self):
+        subprocess.check_call(
+            [sys.executable, '-c', 'import airflow.configuration'])
@@ -15,6 +15,7 @@
 from __future__ import print_function
 
 import doctest
+import json
 import os
 import unittest
 import logging
@@ -55,6 +56,7 @@ from airflow.settings import Session
 from airflow.utils.state import State
 from airflow.utils.dates import round_time
 from airflow.utils.logging import LoggingMixin
+from airflow.utils.lookup_cache import LookupCache
 from lxml import html
 from airflow.exceptions import AirflowException
 from airflow.configuration import AirflowConfigException
@@ -640,6 +642,20 @@ class CoreTest(unittest.TestCase):
         job = jobs.LocalTaskJob(task_instance=ti, ignore_ti_state=True)
         job.run()
 
+    def test_local_task_job_forked(self):
+        TI = models.TaskInstance
+        ti = TI(
+            task=self.runme_0, execution_date=DEFAULT_DATE)
+        configuration.set("core", "local_task_job_fork", "True")
+        try:
+            job = jobs.LocalTaskJob(task_instance=ti, ignore_ti_state=True)
+            job.run()
+        finally:
+            configuration.set("core", "local_task_job_fork", "False")
+        ti.refresh_from_db()
+        self.assertEqual(ti.state, State.SUCCESS)
+        self.assertEqual(job.process.returncode, 0)
+
     @mock.patch('airflow.utils.dag_processing.datetime', FakeDatetime)
     def test_scheduler_job(self):
         FakeDatetime.now = classmethod(lambda cls: datetime(2016, 1, 1))
@@ -690,6 +706,30 @@ class CoreTest(unittest.TestCase):
                                              default_var=default_value,
                                              deserialize_json=True)
 
+    def test_variable_cache(self):
+        cache = Variable._cache
+        Variable._cache = LookupCache('Variables', ttl=60,
+                                      get_version=models.ConfigVersion.get,
+                                      version_check_interval=0)
+        try:
+            Variable.set("tested_var_cache_id", "cached")
+            assert "cached" == Variable.get("tested_var_cache_id")
+
+            # a change made by another process is seen once the config
+            # version is bumped
+            session = settings.Session()
+            session.query(Variable).filter(
+                Variable.key == "tested_var_cache_id").delete()
+            session.commit()
+            assert "cached" == Variable.get("tested_var_cache_id")
+            models.ConfigVersion.bump(session=session)
+            session.commit()
+            session.close()
+            assert "default" == Variable.get("tested_var_cache_id",
+                                             default_var="default")
+        finally:
+            Variable._cache = cache
+
     def test_variable_setdefault_round_trip(self):
         key = "tested_var_setdefault_1_id"
         value = "Monday morning breakfast in Paris"
@@ -1369,6 +1409,42 @@ class WebUiTests(unittest.TestCase):
             "sql=SELECT+COUNT%281%29+as+TEST+FROM+task_instance")
         assert "TEST" in response.data.decode('utf-8')
 
+    def test_task_stats_follow_changes(self):
+        """
+        Test that the task counts follow the task instances changed while no
+        scheduler is running
+        """
+        def get_counts():
+            response = self.app.get('/admin/airflow/task_stats')
+            stats = json.loads(response.data.decode('utf-8'))
+            return dict((stat['state'], stat['count'])
+                        for stat in stats['example_bash_operator'])
+
+        session = Session()
+        execution_date = datetime(2016, 1, 1)
+        dr = self.dag_bash.create_dagrun(
+            run_id='test_task_stats_follow_changes',
+            state=State.RUNNING,
+            execution_date=execution_date,
+            start_date=execution_date,
+            session=session)
+        try:
+            counts = get_counts()
+            ti = dr.get_task_instance('runme_0', session=session)
+            ti.state = State.SUCCESS
+            session.merge(ti)
+            session.commit()
+            self.assertEqual(get_counts()[State.SUCCESS],
+                             counts[State.SUCCESS] + 1)
+        finally:
+            TI = models.TaskInstance
+            session.query(TI).filter(
+                TI.dag_id == self.dag_bash.dag_id,
+                TI.execution_date == execution_date).delete()
+            session.delete(dr)
+            session.commit()
+            session.close()
+
     def test_health(self):
         response = self.app.get('/health')
         assert 'The server is healthy!' in response.data.decode('utf-8')
@@ -1510,6 +1586,86 @@ class WebUiTests(unittest.TestCase):
             '/admin/airflow/dag_details?dag_id=example_branch_operator')
         assert "run_this_first" in response.data.decode('utf-8')
 
+    def test_fetch_dag_runs(self):
+        dag = self.dagbag.dags['example_branch_operator']
+        for i in range(3):
+            dag.create_dagrun(
+                run_id="test_fetch_dag_runs_{}".format(i),
+                execution_date=DEFAULT_DATE + timedelta(days=i),
+                start_date=datetime.now(),
+                state=State.SUCCESS)
+        url = (
+            "/admin/airflow/object/dag_runs?"
+            "dag_id=example_branch_operator&limit=1&"
+            "before={}".format(
+                (DEFAULT_DATE + timedelta(days=2)).isoformat()))
+        response = json.loads(self.app.get(url).data.decode('utf-8'))
+        self.assertEqual([dr['run_id'] for dr in response],
+                         ["test_fetch_dag_runs_1"])
+
+        session = Session()
+        session.query(models.DagRun).filter(
+            models.DagRun.run_id.like("test_fetch_dag_runs_%")).delete(
+                synchronize_session=False)
+        session.commit()
+        session.close()
+
+    def test_fetch_tree_instances(self):
+        execution_date = DEFAULT_DATE + timedelta(days=10)
+        self.dag_bash.create_dagrun(
+            run_id="test_fetch_tree_instances",
+            execution_date=execution_date,
+            start_date=datetime.now(),
+            state=State.RUNNING)
+        url = (
+            "/admin/airflow/object/tree_instances?"
+            "dag_id=example_bash_operator&num_runs=1&"
+            "base_date={}".format(execution_date.isoformat()))
+        data = json.loads(self.app.get(url).data.decode('utf-8'))
+        self.assertEqual([dr['run_id'] for dr in data['dag_runs']],
+                         ["test_fetch_tree_instances"])
+        self.assertIn('runme_0', [ti['task_id'] for ti in data['task_instances']])
+
+        self.assertIsNotNone(data['timestamp'])
+        since = datetime.now() + timedelta(hours=1)
+        data = json.loads(self.app.get(
+            url + "&since={}".format(since.isoformat())).data.decode('utf-8'))
+        self.assertEqual(len(data['dag_runs']), 1)
+        self.assertEqual(data['task_instances'], [])
+
+        response = self.app.get(
+            "/admin/airflow/object/tree_structure?"
+            "dag_id=example_bash_operator")
+        assert "runme_0" in response.data.decode('utf-8')
+
+        session = Session()
+        session.query(models.TaskInstance).filter(
+            models.TaskInstance.dag_id == 'example_bash_operator',
+            models.TaskInstance.execution_date == execution_date).delete()
+        session.query(models.DagRun).filter(
+            models.DagRun.run_id == "test_fetch_tree_instances").delete()
+        session.commit()
+        session.close()
+
+    def test_fetch_chart_series(self):
+        url = (
+            "/admin/airflow/object/chart_series?"
+            "dag_id=example_bash_operator&kind={}&"
+            "base_date={}".format('tries', DEFAULT_DATE_ISO))
+        response = self.app.get(url)
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertIn('series', data)
+        self.assertIn('max_date', data)
+
+        response = self.app.get(
+            url, headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.app.get(
+            "/admin/airflow/object/chart_series?"
+            "dag_id=example_bash_operator&kind=nope")
+        self.assertEqual(response.status_code, 400)
+
     def test_fetch_task_instance(self):
         url = (
             "/admin/airflow/object/task_instances?"
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import mock
+
+from airflow.executors.base_executor import BaseExecutor
+
+
+class RecordingExecutor(BaseExecutor):
+    """
+    Records the keys it is asked to execute, in order.
+    """
+    def __init__(self, parallelism):
+        super(RecordingExecutor, self).__init__(parallelism=parallelism)
+        self.executed = []
+
+    def execute_async(self, key, command, queue=None):
+        self.executed.append(key)
+
+
+def make_ti(task_id):
+    return mock.Mock(key=('dag_id', task_id, None))
+
+
+class BaseExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(BaseExecutor, '_get_running_keys',
+                                    return_value=set())
+        self.get_running_keys = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_heartbeat_dispatches_by_priority(self):
+        executor = RecordingExecutor(parallelism=10)
+        for task_id, priority in [('low', 1), ('high_1', 5), ('mid', 3),
+                                  ('high_2', 5)]:
+            executor.queue_command(make_ti(task_id), 'command',
+                                   priority=priority)
+
+        executor.heartbeat()
+
+        # By priority, then in the order they were queued
+        self.assertEqual([key[1] for key in executor.executed],
+                         ['high_1', 'high_2', 'mid', 'low'])
+        self.assertEqual(executor.queued_tasks, {})
+
+    def test_heartbeat_fills_open_slots(self):
+        executor = RecordingExecutor(parallelism=2)
+        for task_id, priority in [('low', 1), ('high', 5), ('mid', 3)]:
+            executor.queue_command(make_ti(task_id), 'command',
+                                   priority=priority)
+
+        executor.heartbeat()
+        self.assertEqual([key[1] for key in executor.executed],
+                         ['high', 'mid'])
+        self.assertEqual(list(executor.queued_tasks),
+                         [('dag_id', 'low', None)])
+
+    def test_queue_command_ignores_duplicates(self):
+        executor = RecordingExecutor(parallelism=10)
+        ti = make_ti('task')
+        executor.queue_command(ti, 'command', priority=1)
+        executor.queue_command(ti, 'command', priority=10)
+        self.assertEqual(len(executor.queued_tasks), 1)
+
+        executor.heartbeat()
+        self.assertEqual(executor.executed, [ti.key])
+
+        # Already running in this executor
+        executor.queue_command(ti, 'command', priority=1)
+        self.assertEqual(executor.queued_tasks, {})
+
+    def test_heartbeat_skips_running_keys(self):
+        executor = RecordingExecutor(parallelism=10)
+        running_ti = make_ti('running')
+        executor.queue_command(running_ti, 'command', priority=5)
+        executor.queue_command(make_ti('other'), 'command', priority=1)
+        self.get_running_keys.return_value = {running_ti.key}
+
+        with mock.patch('airflow.executors.base_executor.Stats') as stats:
+            executor.heartbeat()
+
+        # The running keys are checked with one call
+        self.get_running_keys.assert_called_once_with(
+            [running_ti.key, ('dag_id', 'other', None)])
+        self.assertEqual(executor.executed, [('dag_id', 'other', None)])
+        self.assertNotIn(running_ti.key, executor.running)
+        stats.gauge.assert_any_call('executor.open_slots', 10)
+        stats.gauge.assert_any_call('executor.queued_tasks', 0)
+        stats.gauge.assert_any_call('executor.running_tasks', 1)
+        stats.incr.assert_any_call('executor.launched_tasks', 1)
+        stats.incr.assert_any_call('executor.skipped_tasks', 1)
+
+    def test_heartbeat_skips_removed_tasks(self):
+        executor = RecordingExecutor(parallelism=10)
+        removed_ti = make_ti('removed')
+        executor.queue_command(removed_ti, 'command', priority=5)
+        executor.queue_command(make_ti('kept'), 'command', priority=1)
+        # Removed from queued_tasks without going through the heap
+        executor.queued_tasks.pop(removed_ti.key)
+
+        executor.heartbeat()
+        self.assertEqual(executor.executed, [('dag_id', 'kept', None)])
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import mock
+from celery import states as celery_states
+from celery.backends.base import KeyValueStoreBackend
+from celery.backends.database import DatabaseBackend
+
+from airflow.executors import celery_executor
+from airflow.executors.celery_executor import (
+    CeleryExecutor, fetch_celery_task_states)
+from airflow.utils.state import State
+
+
+def make_result(task_id, backend, state=celery_states.PENDING):
+    return mock.Mock(task_id=task_id, backend=backend, state=state)
+
+
+class FetchCeleryTaskStatesTest(unittest.TestCase):
+
+    def test_database_backend(self):
+        backend = mock.MagicMock(spec=DatabaseBackend)
+        backend.task_cls = mock.MagicMock()
+        session = backend.ResultSession.return_value
+        session.query.return_value.filter.return_value.all.return_value = [
+            ('task_1', celery_states.SUCCESS)]
+
+        states = fetch_celery_task_states([
+            make_result('task_1', backend), make_result('task_2', backend)])
+
+        # The tasks without a row yet are pending
+        self.assertEqual(states, {'task_1': celery_states.SUCCESS,
+                                  'task_2': celery_states.PENDING})
+        self.assertEqual(session.query.call_count, 1)
+        session.close.assert_called_once_with()
+
+    def test_key_value_store_backend(self):
+        backend = mock.MagicMock(spec=KeyValueStoreBackend)
+        backend.get_key_for_task.side_effect = lambda task_id: 'key_' + task_id
+        backend.mget.return_value = [celery_states.FAILURE, None]
+        backend.decode.side_effect = lambda value: {'status': value}
+
+        states = fetch_celery_task_states([
+            make_result('task_1', backend), make_result('task_2', backend)])
+
+        self.assertEqual(states, {'task_1': celery_states.FAILURE,
+                                  'task_2': celery_states.PENDING})
+        backend.mget.assert_called_once_with(['key_task_1', 'key_task_2'])
+
+    @mock.patch.object(celery_executor, 'STATE_FETCH_BATCH_SIZE', 2)
+    def test_batches(self):
+        backend = mock.MagicMock(spec=KeyValueStoreBackend)
+        backend.get_key_for_task.side_effect = lambda task_id: task_id
+        backend.mget.side_effect = lambda keys: [celery_states.STARTED] * len(
+            keys)
+        backend.decode.side_effect = lambda value: {'status': value}
+
+        results = [make_result('task_{}'.format(i), backend) for i in range(3)]
+        states = fetch_celery_task_states(results)
+
+        self.assertEqual(len(states), 3)
+        self.assertEqual(backend.mget.call_count, 2)
+
+    def test_fallback_to_each_task(self):
+        backend = mock.MagicMock(spec=KeyValueStoreBackend)
+        backend.mget.side_effect = Exception('Unavailable')
+        other_backend = mock.Mock()
+
+        states = fetch_celery_task_states([
+            make_result('task_1', backend, celery_states.SUCCESS),
+            make_result('task_2', other_backend, celery_states.STARTED)])
+
+        self.assertEqual(states, {'task_1': celery_states.SUCCESS,
+                                  'task_2': celery_states.STARTED})
+
+
+class CeleryExecutorTest(unittest.TestCase):
+
+    @mock.patch('airflow.executors.celery_executor.fetch_celery_task_states')
+    def test_sync(self, fetch_mock):
+        executor = CeleryExecutor()
+        executor.start()
+        keys = [('dag_id', 'task_{}'.format(i), None) for i in range(3)]
+        for i, key in enumerate(keys):
+            executor.running[key] = 'command'
+            executor.tasks[key] = make_result('celery_{}'.format(i), None)
+            executor.last_state[key] = celery_states.PENDING
+
+        fetch_mock.return_value = {'celery_0': celery_states.SUCCESS,
+                                   'celery_1': celery_states.FAILURE,
+                                   'celery_2': celery_states.STARTED}
+        executor.sync()
+
+        self.assertEqual(executor.get_event_buffer(),
+                         {keys[0]: State.SUCCESS, keys[1]: State.FAILED})
+        self.assertEqual(list(executor.tasks), [keys[2]])
+        # The finished tasks are forgotten
+        self.assertEqual(executor.last_state,
+                         {keys[2]: celery_states.STARTED})
+
+        fetch_mock.return_value = {'celery_2': celery_states.REVOKED}
+        executor.sync()
+        self.assertEqual(executor.get_event_buffer(), {keys[2]: State.FAILED})
+        self.assertEqual(executor.tasks, {})
+        self.assertEqual(executor.last_state, {})
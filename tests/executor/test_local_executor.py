@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import patch
+
+from airflow import configuration
+from airflow.bin.cli import CLIFactory
+from airflow.executors.local_executor import (
+    LocalExecutor, LocalWorker, LocalWorkerPoolState)
+from airflow.models import DagBag
+from airflow.utils.state import State
+
+
+class LocalWorkerPoolStateTest(unittest.TestCase):
+
+    def test_release_idle_worker(self):
+        pool_state = LocalWorkerPoolState(min_workers=1, idle_timeout=1)
+        pool_state.worker_started()
+        pool_state.worker_started()
+        self.assertTrue(pool_state.release_idle_worker())
+        # The last worker is kept
+        self.assertFalse(pool_state.release_idle_worker())
+        self.assertEqual(pool_state.live_workers, 1)
+
+    def test_no_release_when_stopping(self):
+        pool_state = LocalWorkerPoolState(min_workers=0, idle_timeout=1)
+        pool_state.worker_started()
+        self.assertEqual(pool_state.stop(), 1)
+        self.assertFalse(pool_state.release_idle_worker())
+
+    def test_queued_tasks(self):
+        pool_state = LocalWorkerPoolState(min_workers=0, idle_timeout=1)
+        pool_state.task_queued()
+        pool_state.task_queued()
+        pool_state.task_started()
+        self.assertEqual(pool_state.queued_tasks, 1)
+        self.assertEqual(pool_state.busy_workers, 1)
+        pool_state.task_finished()
+        self.assertEqual(pool_state.busy_workers, 0)
+
+
+class LocalExecutorTest(unittest.TestCase):
+
+    def execute(self, executor, commands):
+        for i, command in enumerate(commands):
+            key = ('test_local_executor', 'task_{}'.format(i), None)
+            executor.running[key] = command
+            executor.execute_async(key, command)
+
+    def wait_for(self, executor, condition, timeout=30):
+        start = time.time()
+        while not condition():
+            if time.time() - start > timeout:
+                self.fail("Timed out waiting for the LocalExecutor")
+            time.sleep(0.1)
+            executor.sync()
+
+    @patch('airflow.executors.local_executor.MIN_WORKERS', '')
+    def test_min_workers_default_to_parallelism(self):
+        executor = LocalExecutor(parallelism=3)
+        executor.start()
+        self.assertEqual(len(executor.workers), 3)
+        self.assertEqual(executor.pool_state.min_workers, 3)
+        executor.end()
+
+    @patch('airflow.executors.local_executor.MIN_WORKERS', '10')
+    def test_min_workers_capped_to_parallelism(self):
+        executor = LocalExecutor(parallelism=3)
+        executor.start()
+        self.assertEqual(len(executor.workers), 3)
+        executor.end()
+
+    @patch('airflow.executors.local_executor.WORKER_IDLE_TIMEOUT', 300)
+    @patch('airflow.executors.local_executor.MIN_WORKERS', '1')
+    def test_scale_up(self):
+        executor = LocalExecutor(parallelism=3)
+        executor.start()
+        self.assertEqual(len(executor.workers), 1)
+
+        self.execute(executor, ['sleep 2'] * 4)
+        # One worker per queued task, up to the parallelism
+        self.assertEqual(len(executor.workers), 3)
+        self.assertEqual(executor.pool_state.live_workers, 3)
+
+        self.wait_for(executor, lambda: not executor.running)
+        self.assertEqual(
+            set(executor.get_event_buffer().values()), {State.SUCCESS})
+        executor.end()
+
+    @patch('airflow.executors.local_executor.WORKER_IDLE_TIMEOUT', 300)
+    @patch('airflow.executors.local_executor.MIN_WORKERS', '1')
+    def test_no_scale_up_for_finished_tasks(self):
+        """
+        Test that the tasks whose results weren't synced yet don't start
+        workers
+        """
+        executor = LocalExecutor(parallelism=3)
+        executor.start()
+        self.execute(executor, ['true'])
+        # Wait for the task to finish without syncing its result
+        start = time.time()
+        while (executor.pool_state.queued_tasks or
+               executor.pool_state.busy_workers):
+            self.assertLess(time.time() - start, 30)
+            time.sleep(0.1)
+        key = ('test_local_executor', 'task_1', None)
+        executor.running[key] = 'true'
+        executor.execute_async(key, 'true')
+        # The idle worker takes the new task
+        self.assertEqual(len(executor.workers), 1)
+        executor.end()
+
+    @patch('airflow.executors.local_executor.WORKER_IDLE_TIMEOUT', 1)
+    @patch('airflow.executors.local_executor.MIN_WORKERS', '1')
+    def test_idle_workers_exit(self):
+        executor = LocalExecutor(parallelism=3)
+        executor.start()
+        self.execute(executor, ['sleep 1'] * 3)
+        self.assertEqual(len(executor.workers), 3)
+
+        # The workers above min_workers exit once idle
+        self.wait_for(executor,
+                      lambda: not executor.running and
+                      len(executor.workers) == 1)
+        self.assertEqual(executor.pool_state.live_workers, 1)
+        time.sleep(2)
+        executor.sync()
+        self.assertEqual(len(executor.workers), 1)
+        executor.end()
+
+
+class LocalWorkerTest(unittest.TestCase):
+
+    def run_forked(self, func):
+        worker = LocalWorker(None, None, fork_tasks=True)
+        args = argparse.Namespace(func=func)
+        with patch.object(CLIFactory, 'get_parser') as get_parser, \
+                patch.object(worker, '_get_dag', return_value='dag'):
+            get_parser.return_value.parse_args.return_value = args
+            return worker._run_forked('airflow run dag_id task_id 2016-01-01')
+
+    def test_run_forked(self):
+        def run(args, dag):
+            # The raw task is forked too, and the DAG parsed by the worker is
+            # passed on
+            assert configuration.getboolean('core', 'local_task_job_fork')
+            assert dag == 'dag'
+
+        self.assertEqual(self.run_forked(run), State.SUCCESS)
+        # Only the forked process has its configuration changed
+        self.assertFalse(
+            configuration.getboolean('core', 'local_task_job_fork'))
+
+    def test_run_forked_failure(self):
+        def run(args, dag):
+            raise Exception('Task failed')
+
+        self.assertEqual(self.run_forked(run), State.FAILED)
+
+    def test_run_forked_invalid_command(self):
+        worker = LocalWorker(None, None, fork_tasks=True)
+        self.assertEqual(worker._run_forked('airflow run'), State.FAILED)
+
+    def test_get_dag(self):
+        """
+        Test that the DAG file is only parsed again when it changed
+        """
+        dag_directory = tempfile.mkdtemp()
+        dag_file = os.path.join(dag_directory, 'test_local_worker_dag.py')
+        with open(dag_file, 'w') as f:
+            f.write(
+                "from datetime import datetime\n"
+                "from airflow.models import DAG\n"
+                "dag = DAG('test_local_worker_dag',\n"
+                "          start_date=datetime(2016, 1, 1))\n")
+        worker = LocalWorker(None, None, fork_tasks=True)
+        args = argparse.Namespace(pickle=None, subdir=dag_file,
+                                  dag_id='test_local_worker_dag')
+        try:
+            with patch('airflow.models.DagBag', wraps=DagBag) as dagbag_mock:
+                dag = worker._get_dag(args)
+                self.assertEqual(dag.dag_id, 'test_local_worker_dag')
+                self.assertIs(worker._get_dag(args), dag)
+                self.assertEqual(dagbag_mock.call_count, 1)
+
+                with open(dag_file, 'a') as f:
+                    f.write("# changed\n")
+                self.assertIsNot(worker._get_dag(args), dag)
+                self.assertEqual(dagbag_mock.call_count, 2)
+
+            # Pickled DAGs are loaded by the task
+            args.pickle = 1
+            self.assertIsNone(worker._get_dag(args))
+        finally:
+            shutil.rmtree(dag_directory)
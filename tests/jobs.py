@@ -20,13 +20,15 @@ from __future__ import unicode_literals
 import datetime
 import logging
 import os
+import shutil
+import tempfile
 import unittest
 
 from airflow import AirflowException, settings
 from airflow import models
 from airflow.bin import cli
 from airflow.executors import DEFAULT_EXECUTOR
-from airflow.jobs import BackfillJob, SchedulerJob
+from airflow.jobs import BackfillJob, DagFileProcessorWorkerPool, SchedulerJob
 from airflow.models import DAG, DagModel, DagBag, DagRun, Pool, TaskInstance as TI
 from airflow.operators.dummy_operator import DummyOperator
 from airflow.utils.db import provide_session
@@ -832,6 +834,235 @@ class SchedulerJobTest(unittest.TestCase):
 
         self.assertEquals(len(scheduler.executor.queued_tasks), 1)
 
+    def test_execute_task_instances_sets_state_to_queued(self):
+        """
+        Test that the task instances sent to the executor are set to queued in the DB
+        """
+        dag = DAG(
+            dag_id='test_execute_task_instances_sets_state_to_queued',
+            start_date=DEFAULT_DATE)
+
+        for i in range(3):
+            DummyOperator(
+                task_id='dummy_{}'.format(i),
+                dag=dag,
+                owner='airflow')
+
+        session = settings.Session()
+        orm_dag = DagModel(dag_id=dag.dag_id)
+        orm_dag.is_paused = False
+        session.merge(orm_dag)
+        session.commit()
+
+        scheduler = SchedulerJob()
+        dag.clear()
+
+        dr = scheduler.create_dag_run(dag)
+        self.assertIsNotNone(dr)
+        tis = dr.get_task_instances(session=session)
+        for ti in tis:
+            ti.state = State.SCHEDULED
+        # Running task instances must be left alone
+        tis[0].state = State.RUNNING
+        running_task_id = tis[0].task_id
+        scheduled_task_ids = [ti.task_id for ti in tis[1:]]
+        session.commit()
+
+        scheduler._execute_task_instances(SimpleDagBag([dag]),
+                                          (State.SCHEDULED,
+                                           State.UP_FOR_RETRY))
+
+        self.assertEquals(len(scheduler.executor.queued_tasks), 2)
+        states = {ti.task_id: (ti.state, ti.queued_dttm)
+                  for ti in dr.get_task_instances(session=session)}
+        self.assertEquals(states[running_task_id][0], State.RUNNING)
+        for task_id in scheduled_task_ids:
+            self.assertEquals(states[task_id][0], State.QUEUED)
+            self.assertIsNotNone(states[task_id][1])
+        session.close()
+
+    def test_execute_task_instances_skips_state_changed_before_update(self):
+        """
+        Test that a task instance whose state changes before it is set to
+        queued isn't sent to the executor
+        """
+        dag = DAG(
+            dag_id='test_execute_task_instances_skips_state_changed_before_update',
+            start_date=DEFAULT_DATE)
+
+        for i in range(2):
+            DummyOperator(
+                task_id='dummy_{}'.format(i),
+                dag=dag,
+                owner='airflow')
+
+        session = settings.Session()
+        orm_dag = DagModel(dag_id=dag.dag_id)
+        orm_dag.is_paused = False
+        session.merge(orm_dag)
+        session.commit()
+
+        scheduler = SchedulerJob()
+        dag.clear()
+
+        dr = scheduler.create_dag_run(dag)
+        self.assertIsNotNone(dr)
+        for ti in dr.get_task_instances(session=session):
+            ti.state = State.SCHEDULED
+        session.commit()
+
+        set_task_instances_to_queued = scheduler._set_task_instances_to_queued
+
+        def change_state_then_set_to_queued(task_instances, states, session):
+            # Another scheduler or a user changes the state of the first task
+            # instance after it was picked, before it is set to queued
+            other_session = settings.Session()
+            ti = other_session.query(TI).filter(
+                TI.dag_id == dag.dag_id,
+                TI.task_id == 'dummy_0').one()
+            ti.state = State.RUNNING
+            other_session.commit()
+            other_session.close()
+            return set_task_instances_to_queued(task_instances, states, session)
+
+        with patch.object(scheduler, '_set_task_instances_to_queued',
+                          side_effect=change_state_then_set_to_queued):
+            scheduler._execute_task_instances(SimpleDagBag([dag]),
+                                              (State.SCHEDULED,
+                                               State.UP_FOR_RETRY))
+
+        self.assertEquals(
+            [key[1] for key in scheduler.executor.queued_tasks], ['dummy_1'])
+        states = {ti.task_id: ti.state
+                  for ti in dr.get_task_instances(session=session)}
+        self.assertEquals(states['dummy_0'], State.RUNNING)
+        self.assertEquals(states['dummy_1'], State.QUEUED)
+        session.close()
+
+    def test_change_state_for_tis_without_dagrun(self):
+        """
+        Test that only the task instances whose DagRun exists but isn't
+        running are changed
+        """
+        dag = DAG(
+            dag_id='test_change_state_for_tis_without_dagrun',
+            start_date=DEFAULT_DATE)
+        DummyOperator(task_id='dummy', dag=dag, owner='airflow')
+        dag.clear()
+
+        session = settings.Session()
+        dr1 = dag.create_dagrun(run_id='dr1',
+                                state=State.RUNNING,
+                                execution_date=DEFAULT_DATE,
+                                start_date=DEFAULT_DATE,
+                                session=session)
+        dr2 = dag.create_dagrun(run_id='dr2',
+                                state=State.SUCCESS,
+                                execution_date=DEFAULT_DATE +
+                                datetime.timedelta(days=1),
+                                start_date=DEFAULT_DATE,
+                                session=session)
+        # Task instance without a DagRun
+        ti3 = TI(dag.get_task('dummy'),
+                 DEFAULT_DATE + datetime.timedelta(days=2))
+        session.merge(ti3)
+        for ti in dr1.get_task_instances(session=session) + \
+                dr2.get_task_instances(session=session):
+            ti.state = State.SCHEDULED
+        session.query(TI).filter(
+            TI.dag_id == dag.dag_id,
+            TI.execution_date == ti3.execution_date).update(
+            {TI.state: State.SCHEDULED}, synchronize_session=False)
+        session.commit()
+
+        scheduler = SchedulerJob(**self.default_scheduler_args)
+        scheduler._change_state_for_tis_without_dagrun(
+            SimpleDagBag([dag]),
+            [State.QUEUED, State.SCHEDULED],
+            State.NONE,
+            session=session)
+
+        states = {ti.execution_date: ti.state
+                  for ti in session.query(TI).filter(TI.dag_id == dag.dag_id)}
+        self.assertEqual(states[dr1.execution_date], State.SCHEDULED)
+        self.assertEqual(states[dr2.execution_date], State.NONE)
+        self.assertEqual(states[ti3.execution_date], State.SCHEDULED)
+        session.close()
+
+    def test_process_file_reuses_unchanged_dag_file(self):
+        """
+        Test that a DAG file is only parsed again when it changed
+        """
+        dag_file_content = (
+            "from datetime import datetime\n"
+            "from airflow.models import DAG\n"
+            "from airflow.operators.dummy_operator import DummyOperator\n"
+            "dag = DAG('test_parse_cache', start_date=datetime(2016, 1, 1))\n"
+            "DummyOperator(task_id='dummy', dag=dag)\n")
+        dag_directory = tempfile.mkdtemp()
+        dag_file = os.path.join(dag_directory, 'test_parse_cache.py')
+        with open(dag_file, 'w') as f:
+            f.write(dag_file_content)
+
+        scheduler = SchedulerJob(**self.default_scheduler_args)
+        scheduler.dag_file_parse_cache_ttl = 60
+        try:
+            with patch('airflow.jobs.models.DagBag',
+                       wraps=models.DagBag) as mock_dagbag:
+                simple_dags = scheduler.process_file(dag_file)
+                self.assertEqual(mock_dagbag.call_count, 1)
+                self.assertIn('test_parse_cache',
+                              [dag.dag_id for dag in simple_dags])
+
+                # Touching the file without changing it doesn't parse it again
+                os.utime(dag_file, (0, 0))
+                simple_dags = scheduler.process_file(dag_file)
+                self.assertEqual(mock_dagbag.call_count, 1)
+                self.assertIn('test_parse_cache',
+                              [dag.dag_id for dag in simple_dags])
+
+                with open(dag_file, 'a') as f:
+                    f.write("DummyOperator(task_id='dummy2', dag=dag)\n")
+                scheduler.process_file(dag_file)
+                self.assertEqual(mock_dagbag.call_count, 2)
+        finally:
+            scheduler.dag_file_parse_cache.clear()
+            shutil.rmtree(dag_directory)
+
+    def test_process_file_serializes_changed_dag_file(self):
+        """
+        Test that the DAGs of a file are only serialized again when it changed
+        """
+        dag_file_content = (
+            "from datetime import datetime\n"
+            "from airflow.models import DAG\n"
+            "from airflow.operators.dummy_operator import DummyOperator\n"
+            "dag = DAG('test_serialize_changed', start_date=datetime(2016, 1, 1))\n"
+            "DummyOperator(task_id='dummy', dag=dag)\n")
+        dag_directory = tempfile.mkdtemp()
+        dag_file = os.path.join(dag_directory, 'test_serialize_changed.py')
+        with open(dag_file, 'w') as f:
+            f.write(dag_file_content)
+
+        scheduler = SchedulerJob(**self.default_scheduler_args)
+        scheduler.store_serialized_dags = True
+        try:
+            with patch('airflow.jobs.write_dag') as mock_write_dag:
+                scheduler.process_file(dag_file)
+                self.assertEqual(mock_write_dag.call_count, 1)
+
+                # The file is parsed again, but didn't change
+                scheduler.process_file(dag_file)
+                self.assertEqual(mock_write_dag.call_count, 1)
+
+                with open(dag_file, 'a') as f:
+                    f.write("DummyOperator(task_id='dummy2', dag=dag)\n")
+                scheduler.process_file(dag_file)
+                self.assertEqual(mock_write_dag.call_count, 2)
+        finally:
+            SchedulerJob.serialized_dag_fingerprints.pop(dag_file, None)
+            shutil.rmtree(dag_directory)
+
     def test_scheduler_auto_align(self):
         """
         Test if the schedule_interval will be auto aligned with the start_date
@@ -983,6 +1214,61 @@ class SchedulerJobTest(unittest.TestCase):
         self.assertEqual(
             len(session.query(TI).filter(TI.dag_id == dag_id).all()), 1)
 
+    def test_dag_with_system_exit_in_processor_pool(self):
+        """
+        Test that a DAG with a system.exit() doesn't break the scheduler when
+        files are processed by a pool of workers.
+        """
+        dag_id = 'exit_test_dag'
+        dag_directory = os.path.join(models.DAGS_FOLDER,
+                                     "..",
+                                     "dags_with_system_exit")
+
+        session = settings.Session()
+        session.query(TI).filter(TI.dag_id == dag_id).delete()
+        session.query(DagRun).filter(DagRun.dag_id == dag_id).delete()
+        session.commit()
+
+        configuration.set('scheduler', 'dag_file_processor_pool', 'True')
+        configuration.set('scheduler',
+                          'dag_file_processor_max_tasks_per_worker', '1')
+        try:
+            scheduler = SchedulerJob(dag_ids=[dag_id],
+                                     subdir=dag_directory,
+                                     num_runs=1,
+                                     **self.default_scheduler_args)
+            scheduler.run()
+        finally:
+            configuration.set('scheduler', 'dag_file_processor_pool', 'False')
+            configuration.set('scheduler',
+                              'dag_file_processor_max_tasks_per_worker', '100')
+        self.assertEqual(
+            len(session.query(TI).filter(TI.dag_id == dag_id).all()), 1)
+        session.close()
+
+    def test_processor_pool_replaces_exhausted_workers(self):
+        """
+        Test that a worker that was sent its last file isn't sent another one,
+        which it would exit without processing.
+        """
+        directory = tempfile.mkdtemp()
+        file_path = os.path.join(directory, 'empty_dag_file.py')
+        open(file_path, 'w').close()
+        log_file = os.path.join(directory, 'processor.log')
+        pool = DagFileProcessorWorkerPool(1, 1)
+        pool.start()
+        try:
+            pids = []
+            for _ in range(3):
+                worker = pool.acquire()
+                pids.append(worker.pid)
+                worker.send(file_path, False, [], log_file)
+                self.assertEqual(worker.recv(), [])
+            self.assertEqual(len(set(pids)), 3)
+        finally:
+            pool.terminate()
+            shutil.rmtree(directory)
+
     def test_dag_get_active_runs(self):
         """
         Test to check that a DAG returns it's active runs
@@ -18,20 +18,28 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import datetime
+import json
 import os
+import shutil
+import tempfile
 import unittest
 import time
 
-from airflow import models, settings, AirflowException
+from airflow import configuration, models, settings, AirflowException
+from airflow.dag.serialization import (
+    SerializedDagBag, deserialize_dag, serialize_dag, write_dag)
 from airflow.exceptions import AirflowSkipException
-from airflow.models import DAG, TaskExclusion, TaskExclusionType, TaskInstance as TI
+from airflow.models import DAG, TaskExclusion, TaskExclusionIndex, TaskExclusionType
+from airflow.models import TaskInstance as TI
 from airflow.models import State as ST
-from airflow.models import DagModel
+from airflow.models import DagModel, SerializedDag
 from airflow.operators.dummy_operator import DummyOperator
 from airflow.operators.bash_operator import BashOperator
 from airflow.operators.python_operator import PythonOperator
 from airflow.ti_deps.deps.trigger_rule_dep import TriggerRuleDep
 from airflow.utils.state import State
+from airflow.utils.xcom_storage import ExternalXComValue
+import mock
 from mock import patch
 from nose_parameterized import parameterized
 
@@ -118,6 +126,44 @@ class DagTest(unittest.TestCase):
         self.assertEqual(dag.dag_id, 'creating_dag_in_cm')
         self.assertEqual(dag.tasks[0].task_id, 'op6')
 
+    def test_topology(self):
+        """
+        Test the relatives and priority weights computed by DAG.topology, and
+        that they are computed again when the graph changes.
+        """
+        dag = DAG('dag', start_date=DEFAULT_DATE)
+        with dag:
+            op1 = DummyOperator(task_id='op1', priority_weight=2)
+            op2 = DummyOperator(task_id='op2')
+            op3 = DummyOperator(task_id='op3', priority_weight=3)
+            op4 = DummyOperator(task_id='op4')
+        op1.set_downstream([op2, op3])
+        op2.set_downstream(op4)
+        op3.set_downstream(op4)
+
+        self.assertEqual(dag.topology.topological_order,
+                         ['op1', 'op2', 'op3', 'op4'])
+        self.assertEqual(op1.get_flat_relatives(), [op2, op3, op4])
+        self.assertEqual(op4.get_flat_relatives(upstream=True),
+                         [op1, op2, op3])
+        self.assertEqual(op1.priority_weight_total, 7)
+        self.assertEqual(op3.priority_weight_total, 4)
+        self.assertEqual(op4.priority_weight_total, 1)
+
+        op5 = DummyOperator(task_id='op5', dag=dag)
+        op4.set_downstream(op5)
+        self.assertEqual(op1.priority_weight_total, 8)
+        self.assertEqual(op5.get_flat_relatives(upstream=True),
+                         [op1, op2, op3, op4])
+
+        sub_dag = dag.sub_dag('op3', include_upstream=True)
+        self.assertEqual(sorted(sub_dag.task_ids), ['op1', 'op3'])
+        self.assertEqual(sub_dag.topology.topological_order, ['op1', 'op3'])
+        self.assertEqual(sub_dag.get_task('op1').priority_weight_total, 5)
+
+        with self.assertRaises(AirflowException):
+            op5.set_downstream(op1)
+
 class DagRunTest(unittest.TestCase):
     def test_id_for_date(self):
         run_id = models.DagRun.id_for_date(
@@ -125,6 +171,107 @@ class DagRunTest(unittest.TestCase):
         assert run_id == 'scheduled__2015-01-02T03:04:05', (
             'Generated run_id did not match expectations: {0}'.format(run_id))
 
+    def test_verify_integrity(self):
+        """
+        Test that verify_integrity adds the missing task instances and marks
+        the ones of removed tasks.
+        """
+        session = settings.Session()
+        dag = DAG('test_verify_integrity', start_date=DEFAULT_DATE)
+        op1 = DummyOperator(task_id='op1', dag=dag)
+        op2 = DummyOperator(task_id='op2', dag=dag)
+        op1.set_downstream(op2)
+        dag.clear()
+
+        run = dag.create_dagrun(run_id='test_verify_integrity',
+                                state=State.SUCCESS,
+                                execution_date=DEFAULT_DATE,
+                                start_date=DEFAULT_DATE,
+                                session=session)
+        tis = {ti.task_id: ti for ti in run.get_task_instances(session=session)}
+        self.assertEqual(sorted(tis), ['op1', 'op2'])
+        self.assertEqual(tis['op1'].priority_weight, 2)
+        self.assertEqual(tis['op2'].priority_weight, 1)
+        self.assertIsNone(tis['op1'].state)
+
+        del dag.task_dict['op2']
+        DummyOperator(task_id='op3', dag=dag)
+        run.verify_integrity(session=session)
+        tis = {ti.task_id: ti for ti in run.get_task_instances(session=session)}
+        self.assertEqual(sorted(tis), ['op1', 'op2', 'op3'])
+        self.assertEqual(tis['op2'].state, State.REMOVED)
+        self.assertIsNone(tis['op3'].state)
+        session.close()
+
+
+class TaskStatTest(unittest.TestCase):
+    def test_update(self):
+        """
+        Test that the task instances of a DAG are counted again only when
+        they changed since they were counted.
+        """
+        session = settings.Session()
+        dag = DAG('test_task_stat_update', start_date=DEFAULT_DATE)
+        DummyOperator(task_id='op1', dag=dag)
+        DummyOperator(task_id='op2', dag=dag)
+        dag.clear()
+        session.query(models.TaskStat).filter(
+            models.TaskStat.dag_id == dag.dag_id).delete()
+        session.query(models.DagRun).filter(
+            models.DagRun.dag_id == dag.dag_id).delete()
+        session.commit()
+
+        dag.create_dagrun(run_id='test_task_stat_update',
+                          state=State.RUNNING,
+                          execution_date=DEFAULT_DATE,
+                          start_date=DEFAULT_DATE,
+                          session=session)
+        TI = models.TaskInstance
+        tis = session.query(TI).filter(TI.dag_id == dag.dag_id)
+        tis.update({TI.updated_at: datetime.datetime.now() -
+                    2 * models.TaskStat.UPDATED_AT_OVERLAP},
+                   synchronize_session=False)
+        session.commit()
+        self.assertEqual(models.TaskStat.update([dag], session=session),
+                         {dag.dag_id})
+        self.assertEqual(models.TaskStat.update([dag], session=session),
+                         set())
+
+        # Change the task instances, then one of them again in the same
+        # second, which leaves their latest updated_at unchanged when the
+        # database only keeps seconds
+        updated_at = datetime.datetime.now()
+        tis.update({TI.updated_at: updated_at}, synchronize_session=False)
+        session.commit()
+        self.assertEqual(models.TaskStat.update([dag], session=session),
+                         {dag.dag_id})
+        tis.filter(TI.task_id == 'op1').update(
+            {TI.state: State.SUCCESS, TI.updated_at: updated_at},
+            synchronize_session=False)
+        session.commit()
+        self.assertEqual(models.TaskStat.update([dag], session=session),
+                         {dag.dag_id})
+        counts = dict(
+            session.query(models.TaskStat.state, models.TaskStat.count)
+            .filter(models.TaskStat.dag_id == dag.dag_id))
+        self.assertEqual(counts[State.SUCCESS], 1)
+        self.assertEqual(counts[State.RUNNING], 0)
+
+        # Changed by a worker whose clock is behind, with an updated_at
+        # earlier than the latest one
+        tis.filter(TI.task_id == 'op2').update(
+            {TI.state: State.SUCCESS,
+             TI.updated_at: updated_at - datetime.timedelta(seconds=30)},
+            synchronize_session=False)
+        session.commit()
+        self.assertEqual(models.TaskStat.update([dag], session=session),
+                         {dag.dag_id})
+        counts = dict(
+            session.query(models.TaskStat.state, models.TaskStat.count)
+            .filter(models.TaskStat.dag_id == dag.dag_id))
+        self.assertEqual(counts[State.SUCCESS], 2)
+        session.close()
+
 
 class DagBagTest(unittest.TestCase):
 
@@ -202,6 +349,80 @@ class DagBagTest(unittest.TestCase):
         assert dagbag.process_file_calls == 1
 
 
+class SerializedDagBagTest(unittest.TestCase):
+
+    def test_serialize_dag(self):
+        """
+        test that the serialized DAGs have the structure of the DAGs
+        """
+        dagbag = models.DagBag(include_examples=True)
+        for dag_id in ['example_bash_operator', 'example_subdag_operator']:
+            dag = dagbag.get_dag(dag_id)
+            serialized = deserialize_dag(json.loads(json.dumps(
+                serialize_dag(dag))))
+
+            self.assertEqual(serialized.dag_id, dag.dag_id)
+            self.assertEqual(serialized.schedule_interval,
+                             dag.schedule_interval)
+            self.assertEqual(serialized.start_date, dag.start_date)
+            self.assertEqual(serialized.full_filepath, dag.full_filepath)
+            self.assertEqual(serialized.owner, dag.owner)
+            self.assertEqual(sorted(serialized.task_ids), sorted(dag.task_ids))
+            self.assertEqual([sd.dag_id for sd in serialized.subdags],
+                             [sd.dag_id for sd in dag.subdags])
+            for task in dag.tasks:
+                serialized_task = serialized.get_task(task.task_id)
+                self.assertEqual(serialized_task.task_type, task.task_type)
+                self.assertEqual(serialized_task.ui_color, task.ui_color)
+                self.assertEqual(sorted(serialized_task.upstream_task_ids),
+                                 sorted(task.upstream_task_ids))
+                self.assertEqual(serialized_task.retry_delay, task.retry_delay)
+                for field in task.template_fields:
+                    if isinstance(getattr(task, field), str):
+                        self.assertEqual(getattr(serialized_task, field),
+                                         getattr(task, field))
+
+    def test_get_dag(self):
+        """
+        test that the DAGs are read back from the serialized_dag table, and
+        reloaded when written again
+        """
+        dag = models.DagBag(include_examples=True).get_dag(
+            'example_bash_operator')
+        session = settings.Session()
+        write_dag(dag, session=session)
+        self.assertFalse(write_dag(dag, session=session))
+
+        dagbag = SerializedDagBag()
+        serialized = dagbag.get_dag('example_bash_operator')
+        self.assertEqual(sorted(serialized.task_ids), sorted(dag.task_ids))
+        self.assertIs(dagbag.get_dag('example_bash_operator'), serialized)
+        with self.assertRaises(AirflowException):
+            serialized.get_task('runme_0').execute({})
+
+        dag.max_active_runs = 7
+        self.assertTrue(write_dag(dag, session=session))
+        self.assertEqual(
+            dagbag.get_dag('example_bash_operator').max_active_runs, 7)
+
+        # A new version is loaded even if it has the same last_updated, e.g.
+        # when written in the same second on MySQL
+        row = session.query(SerializedDag).filter(
+            SerializedDag.dag_id == 'example_bash_operator').one()
+        last_updated = row.last_updated
+        dag.max_active_runs = 8
+        self.assertTrue(write_dag(dag, session=session))
+        row = session.query(SerializedDag).filter(
+            SerializedDag.dag_id == 'example_bash_operator').one()
+        row.last_updated = last_updated
+        session.commit()
+        self.assertEqual(
+            dagbag.get_dag('example_bash_operator').max_active_runs, 8)
+        self.assertEqual(
+            dagbag.dags['example_bash_operator'].max_active_runs, 8)
+        session.close()
+
+
 class TaskInstanceTest(unittest.TestCase):
 
     def test_set_dag(self):
@@ -625,6 +846,191 @@ class TaskInstanceTest(unittest.TestCase):
                                       include_prior_dates=True),
                          value)
 
+    def test_xcom_pull_many(self):
+        """
+        tests pulling the XComs of several tasks pushed with set_many
+        """
+        dag = models.DAG(dag_id='test_xcom_many', schedule_interval='@monthly')
+        start_date = datetime.datetime(2016, 6, 2, 0, 0, 0)
+        tasks = [
+            DummyOperator(task_id='test_xcom_{}'.format(i), dag=dag,
+                          owner='airflow', start_date=start_date)
+            for i in range(3)]
+        exec_date = datetime.datetime.now()
+        models.XCom.set_many([
+            dict(key='key', value=i, execution_date=exec_date,
+                 task_id=task.task_id, dag_id=dag.dag_id)
+            for i, task in enumerate(tasks[:2])])
+
+        ti = TI(task=tasks[2], execution_date=exec_date)
+        task_ids = [task.task_id for task in tasks]
+        self.assertEqual(ti.xcom_pull(task_ids=task_ids, key='key'),
+                         (0, 1, None))
+
+        # pulled values are memoized, pushing from this task clears its own
+        with patch.object(models.XCom, 'get_latest_many',
+                          wraps=models.XCom.get_latest_many) as get_mock:
+            self.assertEqual(ti.xcom_pull(task_ids='test_xcom_1', key='key'),
+                             1)
+            self.assertFalse(get_mock.called)
+            ti.xcom_push(key='key', value=2)
+            self.assertEqual(ti.xcom_pull(task_ids=task_ids, key='key'),
+                             (0, 1, 2))
+            self.assertEqual(get_mock.call_args[1]['task_id_keys'],
+                             [('test_xcom_2', 'key')])
+
+    def test_xcom_pull_many_lazily(self):
+        """
+        tests that the values pulled from several tasks are only unpickled
+        when they are accessed
+        """
+        dag = models.DAG(dag_id='test_xcom_many_lazily')
+        start_date = datetime.datetime(2016, 6, 2, 0, 0, 0)
+        tasks = [
+            DummyOperator(task_id='test_xcom_{}'.format(i), dag=dag,
+                          owner='airflow', start_date=start_date)
+            for i in range(4)]
+        exec_date = datetime.datetime.now()
+        models.XCom.set_many([
+            dict(key='key', value=[i], execution_date=exec_date,
+                 task_id=task.task_id, dag_id=dag.dag_id)
+            for i, task in enumerate(tasks[:3])])
+
+        ti = TI(task=tasks[3], execution_date=exec_date)
+        task_ids = [task.task_id for task in tasks]
+        with patch.object(models.dill, 'loads',
+                          wraps=models.dill.loads) as loads_mock:
+            values = ti.xcom_pull(task_ids=task_ids, key='key')
+            self.assertEqual(len(values), 4)
+            self.assertFalse(loads_mock.called)
+            self.assertEqual(values[1], [1])
+            self.assertIsNone(values[3])
+            self.assertEqual(loads_mock.call_count, 1)
+        self.assertEqual(values, ([0], [1], [2], None))
+        self.assertEqual(list(values[:2]), [[0], [1]])
+
+    def test_xcom_pull_many_include_prior_dates(self):
+        """
+        tests pulling the latest XComs of several tasks from prior dates
+        """
+        dag = models.DAG(dag_id='test_xcom_many_prior_dates')
+        start_date = datetime.datetime(2016, 6, 2, 0, 0, 0)
+        tasks = [
+            DummyOperator(task_id='test_xcom_{}'.format(i), dag=dag,
+                          owner='airflow', start_date=start_date)
+            for i in range(3)]
+        exec_date = datetime.datetime(2016, 6, 10, 0, 0, 0)
+        day = datetime.timedelta(days=1)
+        models.XCom.set_many([
+            dict(key='key', value='0_old', execution_date=exec_date - 2 * day,
+                 task_id=tasks[0].task_id, dag_id=dag.dag_id),
+            dict(key='key', value='0_new', execution_date=exec_date - day,
+                 task_id=tasks[0].task_id, dag_id=dag.dag_id),
+            dict(key='key', value='0_later', execution_date=exec_date + day,
+                 task_id=tasks[0].task_id, dag_id=dag.dag_id),
+            dict(key='key', value='1_old', execution_date=exec_date - 2 * day,
+                 task_id=tasks[1].task_id, dag_id=dag.dag_id),
+            dict(key='other', value='1_other', execution_date=exec_date,
+                 task_id=tasks[1].task_id, dag_id=dag.dag_id),
+        ])
+
+        ti = TI(task=tasks[2], execution_date=exec_date)
+        task_ids = [task.task_id for task in tasks]
+        self.assertEqual(ti.xcom_pull(task_ids=task_ids, key='key',
+                                      include_prior_dates=True),
+                         ('0_new', '1_old', None))
+        self.assertEqual(ti.xcom_pull(task_ids=task_ids, key=None,
+                                      include_prior_dates=True),
+                         ('0_new', '1_other', None))
+
+    def test_xcom_storage(self):
+        """
+        tests that large XCom values are kept in the XCom storage
+        """
+        storage_dir = tempfile.mkdtemp()
+        configuration.set('core', 'xcom_storage', 'file://' + storage_dir)
+        configuration.set('core', 'xcom_storage_threshold', '100')
+        try:
+            dag = models.DAG(dag_id='test_xcom_storage')
+            task = DummyOperator(
+                task_id='test_xcom_storage', dag=dag, owner='airflow',
+                start_date=datetime.datetime(2016, 6, 2, 0, 0, 0))
+            ti = TI(task=task, execution_date=datetime.datetime.now())
+            ti.xcom_push(key='small', value='x')
+            ti.xcom_push(key='large', value='x' * 1000)
+
+            xcoms = models.XCom.get_many(
+                execution_date=ti.execution_date,
+                task_ids='test_xcom_storage',
+                dag_ids='test_xcom_storage')
+            xcoms = dict((xcom.key, xcom.value) for xcom in xcoms)
+            self.assertEqual(xcoms['small'], 'x')
+            self.assertIsInstance(xcoms['large'], ExternalXComValue)
+            self.assertTrue(
+                xcoms['large'].url.startswith('file://' + storage_dir))
+
+            self.assertEqual(
+                ti.xcom_pull(task_ids='test_xcom_storage', key='large'),
+                'x' * 1000)
+            self.assertEqual(models.XCom.get_one(
+                execution_date=ti.execution_date,
+                key='large',
+                task_id='test_xcom_storage',
+                dag_id='test_xcom_storage'), 'x' * 1000)
+
+            # The values are deleted from the storage with their XComs
+            path = xcoms['large'].url[len('file://'):]
+            self.assertTrue(os.path.isfile(path))
+            ti.xcom_push(key='large', value='x')
+            self.assertFalse(os.path.isfile(path))
+            ti.xcom_push(key='large', value='x' * 1000)
+            self.assertTrue(os.path.isfile(path))
+            ti.clear_xcom_data()
+            self.assertFalse(os.path.isfile(path))
+        finally:
+            configuration.set('core', 'xcom_storage', '')
+            configuration.set('core', 'xcom_storage_threshold', '65536')
+            shutil.rmtree(storage_dir)
+
+    def test_xcom_s3_storage(self):
+        """
+        tests that large XCom values are written to and read from S3
+        """
+        objects = {}
+
+        def get_key(url):
+            key = mock.Mock()
+            key.get_contents_to_file.side_effect = (
+                lambda f: f.write(objects[url]))
+            return key
+
+        configuration.set('core', 'xcom_storage', 's3://bucket/xcom')
+        configuration.set('core', 'xcom_storage_threshold', '100')
+        try:
+            with patch('airflow.hooks.S3_hook.S3Hook') as hook_class:
+                hook = hook_class.return_value
+                hook.load_string.side_effect = (
+                    lambda data, key, replace: objects.update({key: data}))
+                hook.get_key.side_effect = get_key
+
+                dag = models.DAG(dag_id='test_xcom_s3_storage')
+                task = DummyOperator(
+                    task_id='test_xcom_s3_storage', dag=dag, owner='airflow',
+                    start_date=datetime.datetime(2016, 6, 2, 0, 0, 0))
+                ti = TI(task=task, execution_date=datetime.datetime.now())
+                ti.xcom_push(key='large', value={'x': 'x' * 1000})
+
+                self.assertEqual(len(objects), 1)
+                self.assertTrue(list(objects)[0].startswith('s3://bucket/xcom/'))
+                self.assertEqual(models.XCom.get_one(
+                    execution_date=ti.execution_date,
+                    key='large',
+                    task_id='test_xcom_s3_storage',
+                    dag_id='test_xcom_s3_storage'), {'x': 'x' * 1000})
+        finally:
+            configuration.set('core', 'xcom_storage', '')
+            configuration.set('core', 'xcom_storage_threshold', '65536')
+
 
 class TaskExclusionTest(unittest.TestCase):
     session = settings.Session()
@@ -722,3 +1128,69 @@ class TaskExclusionTest(unittest.TestCase):
             execution_date=self.exec_date)
 
         self.assertFalse(should_exclude)
+
+
+class TaskExclusionIndexTest(unittest.TestCase):
+    dag_id = 'test_task_exclusion_index'
+
+    def setUp(self):
+        session = settings.Session()
+        session.query(TaskExclusion).filter(
+            TaskExclusion.dag_id == self.dag_id).delete()
+        session.merge(DagModel(dag_id=self.dag_id))
+        session.commit()
+        session.close()
+
+    def tearDown(self):
+        session = settings.Session()
+        session.query(TaskExclusion).filter(
+            TaskExclusion.dag_id == self.dag_id).delete()
+        session.query(DagModel).filter(
+            DagModel.dag_id == self.dag_id).delete()
+        session.commit()
+        session.close()
+        TaskExclusionIndex._cache.pop(self.dag_id, None)
+
+    def test_lookups(self):
+        day = datetime.timedelta(days=1)
+        index = TaskExclusionIndex(self.dag_id, 0, [
+            ('indefinite', TaskExclusionType.INDEFINITE, None, None),
+            ('dated', TaskExclusionType.SINGLE_DATE,
+             DEFAULT_DATE, DEFAULT_DATE),
+            ('dated', TaskExclusionType.DATE_RANGE,
+             DEFAULT_DATE + 3 * day, DEFAULT_DATE + 5 * day),
+            ('dated', TaskExclusionType.DATE_RANGE,
+             DEFAULT_DATE + 4 * day, DEFAULT_DATE + 7 * day),
+        ])
+
+        self.assertTrue(index.should_exclude_task('indefinite', DEFAULT_DATE))
+        self.assertFalse(index.should_exclude_task('unknown', DEFAULT_DATE))
+        self.assertTrue(index.should_exclude_task('dated', DEFAULT_DATE))
+        self.assertFalse(index.should_exclude_task('dated', DEFAULT_DATE - day))
+        self.assertFalse(index.should_exclude_task('dated', DEFAULT_DATE + day))
+        self.assertTrue(index.should_exclude_task('dated', DEFAULT_DATE + 3 * day))
+        self.assertTrue(index.should_exclude_task('dated', DEFAULT_DATE + 6 * day))
+        self.assertTrue(index.should_exclude_task('dated', DEFAULT_DATE + 7 * day))
+        self.assertFalse(index.should_exclude_task('dated', DEFAULT_DATE + 8 * day))
+
+    def test_reload_on_change(self):
+        index = TaskExclusionIndex.get(self.dag_id)
+        self.assertFalse(index.should_exclude_task('task', DEFAULT_DATE))
+        self.assertIs(TaskExclusionIndex.get(self.dag_id), index)
+
+        TaskExclusion.set(dag_id=self.dag_id,
+                          task_id='task',
+                          exclusion_type=TaskExclusionType.SINGLE_DATE,
+                          exclusion_start_date=DEFAULT_DATE,
+                          exclusion_end_date=DEFAULT_DATE,
+                          created_by='airflow')
+        index = TaskExclusionIndex.get(self.dag_id)
+        self.assertTrue(index.should_exclude_task('task', DEFAULT_DATE))
+
+        TaskExclusion.remove(dag_id=self.dag_id,
+                             task_id='task',
+                             exclusion_type=TaskExclusionType.SINGLE_DATE,
+                             exclusion_start_date=DEFAULT_DATE,
+                             exclusion_end_date=DEFAULT_DATE)
+        index = TaskExclusionIndex.get(self.dag_id)
+        self.assertFalse(index.should_exclude_task('task', DEFAULT_DATE))
@@ -13,8 +13,10 @@
 # limitations under the License.
 
 import unittest
+from datetime import datetime
 
 from airflow.utils.trigger_rule import TriggerRule
+from airflow.ti_deps.dep_context import DagRunTIStates, DepContext
 from airflow.ti_deps.deps.trigger_rule_dep import TriggerRuleDep
 from airflow.utils.state import State
 from fake_models import FakeTask, FakeTI
@@ -293,3 +295,70 @@ class TriggerRuleDepTest(unittest.TestCase):
 
         self.assertEqual(len(dep_statuses), 1)
         self.assertFalse(dep_statuses[0].passed)
+
+    def test_dagrun_ti_states_counts(self):
+        """
+        The DagRun snapshot should count excluded upstream tasks as successes
+        """
+        ti_states = DagRunTIStates('fake_dag', datetime(2016, 1, 1), {
+            'success': State.SUCCESS,
+            'excluded': State.EXCLUDED,
+            'failed': State.FAILED,
+            'running': State.RUNNING,
+        })
+
+        self.assertEqual(
+            ti_states.count_states(['success', 'excluded', 'failed', 'running']),
+            (1, 1, 0, 1, 0, 3))
+
+        task = FakeTask(
+            trigger_rule=TriggerRule.ALL_SUCCESS,
+            upstream_list=['success', 'excluded'],
+            upstream_task_ids=['success', 'excluded'])
+        ti = FakeTI(
+            task=task,
+            task_id='downstream',
+            dag_id='fake_dag',
+            execution_date=datetime(2016, 1, 1),
+            state=State.NONE)
+        dep_context = DepContext(dagrun_ti_states=ti_states)
+
+        self.assertTrue(TriggerRuleDep().is_met(ti=ti, dep_context=dep_context))
+
+    def test_dagrun_ti_states_flag_upstream_failed(self):
+        """
+        States set by flag_upstream_failed should be visible to the downstream tasks
+        evaluated against the same DagRun snapshot
+        """
+        execution_date = datetime(2016, 1, 1)
+        ti_states = DagRunTIStates('fake_dag', execution_date, {
+            'upstream': State.FAILED,
+            'middle': State.NONE,
+            'downstream': State.NONE,
+        })
+        dep_context = DepContext(flag_upstream_failed=True,
+                                 dagrun_ti_states=ti_states)
+
+        def fake_ti(task_id, upstream_task_id):
+            task = FakeTask(
+                trigger_rule=TriggerRule.ALL_SUCCESS,
+                upstream_list=[upstream_task_id],
+                upstream_task_ids=[upstream_task_id])
+            ti = FakeTI(
+                task=task,
+                task_id=task_id,
+                dag_id='fake_dag',
+                execution_date=execution_date,
+                state=State.NONE)
+            ti.set_state = lambda state, session: setattr(ti, 'state', state)
+            return ti
+
+        middle = fake_ti('middle', 'upstream')
+        self.assertFalse(TriggerRuleDep().is_met(ti=middle, dep_context=dep_context))
+        self.assertEqual(middle.state, State.UPSTREAM_FAILED)
+        self.assertEqual(ti_states.get_state('middle'), State.UPSTREAM_FAILED)
+
+        downstream = fake_ti('downstream', 'middle')
+        self.assertFalse(TriggerRuleDep().is_met(ti=downstream,
+                                                 dep_context=dep_context))
+        self.assertEqual(downstream.state, State.UPSTREAM_FAILED)
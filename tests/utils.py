@@ -18,14 +18,25 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import logging
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
 from io import StringIO
 import os
 
+import mock
+
 import airflow.utils.logging as logging_utils
-from airflow import configuration
+from airflow import configuration, settings
+from airflow.utils import db
 from airflow.exceptions import AirflowException
+from airflow.models import DagBag
+from airflow.utils.dag_cache import DagPickleCache
+from airflow.utils.dag_processing import DagFolderIndex
 from airflow.utils.operator_resources import Resources
+from airflow.utils.profiling import PeriodicProfiler, timed_phase
 
 _log = logging.getLogger('airflow')
 
@@ -232,3 +243,185 @@ class OperatorResourcesTest(unittest.TestCase):
     def test_negative_resource_qty(self):
         with self.assertRaises(AirflowException):
             Resources(cpus=-1)
+
+
+class DagFolderIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index = DagFolderIndex(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, path, content):
+        path = os.path.join(self.directory, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def _list(self, **kwargs):
+        self.index.refresh()
+        return self.index.list_file_paths(**kwargs)
+
+    def test_list_file_paths(self):
+        dag_file = self._write('dag.py', 'from airflow import DAG')
+        other_file = self._write('other.py', 'import os')
+        sub_dag_file = self._write('sub/dag.py', 'from airflow import DAG')
+        self._write('sub/notes.txt', 'DAG airflow')
+
+        self.assertEqual(self._list(), [dag_file, sub_dag_file])
+        self.assertEqual(self._list(safe_mode=False),
+                         [dag_file, other_file, sub_dag_file])
+
+        # The ignore patterns apply to the subdirectories
+        self._write('.airflowignore', 'sub/\n')
+        self.assertEqual(self._list(), [dag_file])
+
+        os.remove(os.path.join(self.directory, '.airflowignore'))
+        os.remove(dag_file)
+        new_sub_dag_file = self._write('sub/new/dag.py', 'from airflow import DAG')
+        self.assertEqual(self._list(), [sub_dag_file, new_sub_dag_file])
+
+    def test_changed_file_is_examined_again(self):
+        dag_file = self._write('dag.py', 'import os')
+        self.assertEqual(self._list(), [])
+
+        self._write('dag.py', 'from airflow import DAG')
+        self.assertEqual(self._list(), [dag_file])
+
+
+class ProfilingTest(unittest.TestCase):
+
+    def test_timed_phase(self):
+        with timed_phase('test.phase') as phase:
+            pass
+        self.assertGreaterEqual(phase.duration, 0)
+        self.assertEqual(phase.queries, 0)
+
+    def test_timed_phase_queries_after_configure_orm(self):
+        # Like in the DagFileProcessor, which replaces the engine
+        settings.configure_orm()
+        session = settings.Session()
+        with timed_phase('test.phase') as phase:
+            session.execute('SELECT 1')
+        self.assertEqual(phase.queries, 1)
+        session.close()
+
+    def test_periodic_profiler(self):
+        directory = tempfile.mkdtemp()
+        try:
+            profiler = PeriodicProfiler('test', directory, interval=3600)
+            profiler.start()
+            profiler.maybe_dump()
+            self.assertEqual(os.listdir(directory), [])
+            profiler.stop()
+            snapshots = os.listdir(directory)
+            self.assertEqual(len(snapshots), 1)
+            self.assertTrue(snapshots[0].startswith('test-'))
+        finally:
+            shutil.rmtree(directory)
+
+
+class SqlInstrumentationTest(unittest.TestCase):
+
+    def test_queries_counted_after_configure_orm(self):
+        # The forked processes and the task processes replace the engine
+        settings.configure_orm()
+        session = settings.Session()
+        count = db.get_query_count()
+        session.execute('SELECT 1')
+        self.assertEqual(db.get_query_count(), count + 1)
+        session.close()
+
+    def test_sql_component_after_configure_orm(self):
+        settings.configure_orm()
+        session = settings.Session()
+        with mock.patch.object(db, 'SQL_INSTRUMENTATION', True), \
+                mock.patch.object(settings.Stats, 'incr') as incr:
+            with db.sql_component('test.component'):
+                session.execute('SELECT 1')
+                session.execute('SELECT 1')
+        incr.assert_called_once_with('sql.test.component.queries', 2)
+        session.close()
+
+
+DAG_FILE_WITH_CALLABLE = """
+from datetime import datetime
+from airflow import DAG
+from airflow.operators.python_operator import PythonOperator
+
+GREETING = 'hello'
+
+
+def greet():
+    return GREETING + ' world'
+
+dag = DAG('test_dag_pickle_cache', start_date=datetime(2016, 1, 1))
+PythonOperator(task_id='greet', python_callable=greet, dag=dag)
+"""
+
+
+class DagPickleCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dags_folder = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = DagPickleCache(self.cache_dir, self.dags_folder, 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.dags_folder)
+        shutil.rmtree(self.cache_dir)
+
+    def _write(self, name, content):
+        path = os.path.join(self.dags_folder, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_get_put(self):
+        path = self._write('dag.py', 'dag = 1')
+        self.assertIsNone(self.cache.get(path))
+
+        self.cache.put(path, self.cache.get_fingerprint(path), {'dag': 'a'})
+        self.assertEqual(self.cache.get(path), {'dag': 'a'})
+
+        self._write('dag.py', 'dag = 12')
+        self.assertIsNone(self.cache.get(path))
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_evict_least_recently_used(self):
+        paths = [self._write('dag{}.py'.format(i), '') for i in range(3)]
+        for i, path in enumerate(paths):
+            self.cache.put(path, self.cache.get_fingerprint(path), {'dag': i})
+            entry_path = self.cache._get_entry_path(path)
+            os.utime(entry_path, (i, i))
+
+        self.assertIsNone(self.cache.get(paths[0]))
+        self.assertEqual(self.cache.get(paths[1]), {'dag': 1})
+        self.assertEqual(self.cache.get(paths[2]), {'dag': 2})
+
+    def test_load_in_new_process(self):
+        path = self._write('python_dag.py', DAG_FILE_WITH_CALLABLE)
+        fingerprint = self.cache.get_fingerprint(path)
+        dagbag = DagBag(path, include_examples=False)
+        self.cache.put(path, fingerprint, dagbag.dags)
+
+        # The module DagBag loaded the file as doesn't exist in a new process
+        output = subprocess.check_output([sys.executable, '-c', (
+            "from airflow.utils.dag_cache import DagPickleCache\n"
+            "cache = DagPickleCache({!r}, {!r}, 2)\n"
+            "dag = cache.get({!r})['test_dag_pickle_cache']\n"
+            "print(dag.get_task('greet').python_callable())\n"
+        ).format(self.cache_dir, self.dags_folder, path)])
+        self.assertEqual(output.decode('utf-8').strip(), 'hello world')
+
+    def test_untrusted_entries_not_loaded(self):
+        path = self._write('dag.py', 'dag = 1')
+        self.cache.put(path, self.cache.get_fingerprint(path), {'dag': 'a'})
+        os.chmod(self.cache_dir, 0o777)
+        self.assertIsNone(self.cache.get(path))
+        os.chmod(self.cache_dir, 0o700)
+        self.assertEqual(self.cache.get(path), {'dag': 'a'})